@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from .models import UserStatistics, Book, ReadingStatistics
+from .models import UserStatistics, Book, ReadingStatistics, BookStatistics
 
 
 class UserStatisticsInline(admin.StackedInline):
@@ -20,3 +20,4 @@ admin.site.register(User, UserAdmin)
 
 admin.site.register(Book)
 admin.site.register(ReadingStatistics)
+admin.site.register(BookStatistics)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BookReadingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "book_reading"
+
+    def ready(self):
+        from . import signals  # noqa: F401
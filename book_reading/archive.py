@@ -0,0 +1,79 @@
+"""
+Archival of old reading sessions.
+
+Finished sessions older than the retention window are moved from ReadingSession
+to ArchivedReadingSession, so the table used by the API keeps only recent sessions
+and its indexes stay small. On PostgreSQL the archive is partitioned by month,
+on other databases (e.g. SQLite in tests) it is a plain table. The table is created by a migration,
+the partitions are created by the archival for the months of the archived sessions.
+"""
+import datetime
+
+from django.db import connection, transaction
+
+from .models import ReadingSession, ArchivedReadingSession
+
+ARCHIVE_TABLE = ArchivedReadingSession._meta.db_table
+
+
+def _month_start(value: datetime.datetime) -> datetime.datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month_start(value: datetime.datetime) -> datetime.datetime:
+    return _month_start(_month_start(value) + datetime.timedelta(days=32))
+
+
+def partition_name(month_start: datetime.datetime) -> str:
+    return f'{ARCHIVE_TABLE}_{month_start.year}_{month_start.month:02d}'
+
+
+def create_archive_partitions(start_times) -> list:
+    """
+    Creates the monthly partitions of the archive for the start times of sessions (PostgreSQL only).
+    Months are in UTC. Returns the names of the partitions.
+    """
+    months = {_month_start(start_time.astimezone(datetime.timezone.utc)) for start_time in start_times}
+    if connection.vendor != 'postgresql':
+        return []
+
+    with connection.cursor() as cursor:
+        for month_start in months:
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {partition_name(month_start)} PARTITION OF {ARCHIVE_TABLE} '
+                           f"FOR VALUES FROM ('{month_start.isoformat()}') "
+                           f"TO ('{_next_month_start(month_start).isoformat()}')")
+    return sorted(partition_name(month_start) for month_start in months)
+
+
+def archive_reading_sessions(retention_days: int, chunk_size: int = 10000, log=print) -> int:
+    """
+    Moves finished sessions which ended more than retention_days ago to the archive.
+    Sessions whose reading time is not yet added to the statistics are kept.
+    Every chunk is moved in its own transaction, so the command can be stopped at any time.
+    Returns the number of archived sessions.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    fields = ('id', 'book_id', 'user_id', 'start_time', 'end_time', 'duration')
+    archived = 0
+    while True:
+        with transaction.atomic():
+            sessions = list(ReadingSession.objects.filter(
+                end_time__lt=cutoff, statistics_applied=True
+            ).order_by('id').values(*fields)[:chunk_size])
+            if not sessions:
+                break
+            create_archive_partitions(session['start_time'] for session in sessions)
+            ArchivedReadingSession.objects.bulk_create([ArchivedReadingSession(**session) for session in sessions])
+            ReadingSession.objects.filter(id__in=[session['id'] for session in sessions]).delete()
+        archived += len(sessions)
+        log(f'Archived {archived} reading sessions')
+    return archived
+
+
+def vacuum_reading_sessions() -> None:
+    """Returns the space of the archived sessions to PostgreSQL and updates the planner statistics"""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'VACUUM (ANALYZE) {ReadingSession._meta.db_table}')
+        cursor.execute(f'ANALYZE {ARCHIVE_TABLE}')
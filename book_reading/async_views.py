@@ -0,0 +1,86 @@
+"""
+Async versions of the reading session and statistics views for ASGI servers.
+
+DRF views are synchronous, so these views run the DRF request handling (authentication, permissions,
+throttling, content negotiation and exception handling) in a thread and await only their handlers.
+An idle request does not hold a worker thread, only the database and cache calls
+are run in threads by Django. The responses are the same as the responses of the DRF views.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .serializers import ReadingPeriodSerializer
+from .services import astart_reading_session_and_get_message, aend_reading_session_and_get_message, \
+    aget_user_statistics, aget_user_reading_statistics
+from .views import get_user_statistics_periods, get_user_statistics_data
+
+
+class AsyncAPIView(APIView):
+    """
+    Base class of the async views.
+    Requests are handled as by APIView.dispatch, except that the handlers are coroutines.
+    """
+    permission_classes = [IsAuthenticated]
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS is handled by the synchronous APIView.options
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = await sync_to_async(self.handle_exception)(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncStartReadingSessionView(AsyncAPIView):
+    """Async version of StartReadingSessionAPIView"""
+
+    async def get(self, request, *args, **kwargs):
+        response = await astart_reading_session_and_get_message(user=request.user, book_id=self.kwargs['pk'])
+        return Response(response)
+
+
+class AsyncEndReadingSessionView(AsyncAPIView):
+    """Async version of EndReadingSessionAPIView"""
+
+    async def get(self, request, *args, **kwargs):
+        response = await aend_reading_session_and_get_message(user=request.user)
+        return Response(response)
+
+
+class AsyncUserStatisticsView(AsyncAPIView):
+    """Async version of UserStatisticsAPIView"""
+
+    async def get(self, request, *args, **kwargs):
+        period = ReadingPeriodSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
+
+        user_statistics = await aget_user_statistics(user=request.user,
+                                                     periods=get_user_statistics_periods(period.validated_data))
+        return Response(get_user_statistics_data(request.user, user_statistics, period.validated_data))
+
+
+class AsyncReadingStatisticsView(AsyncAPIView):
+    """Async version of ReadingStatisticsAPIView"""
+
+    async def get(self, request, *args, **kwargs):
+        response = await aget_user_reading_statistics(user=request.user, book_id=self.kwargs['pk'])
+        return Response(response)
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import get_or_set_auth_token_cache
+
+
+# Fields of the users kept in the auth cache, in the order of the User fields: the flags and what
+# the user statistics show. The password hash and the email are not cached.
+TOKEN_USER_FIELDS = ('id', 'is_superuser', 'username', 'first_name', 'last_name', 'is_staff', 'is_active',
+                     'date_joined')
+
+
+def _get_token_user(token_key):
+    return User.objects.filter(auth_token__key=token_key).values(*TOKEN_USER_FIELDS).first()
+
+
+def _build_user(fields):
+    """
+    Returns a user with only the cached fields loaded, as if it was read with only(),
+    so the other fields are read from the database on access and save() does not overwrite them
+    """
+    if fields is None:
+        return None
+    return User.from_db(DEFAULT_DB_ALIAS, TOKEN_USER_FIELDS, [fields[name] for name in TOKEN_USER_FIELDS])
+
+
+def get_token_user(token_key):
+    """Returns the user of an authentication token from the auth cache, or None if the token does not exist"""
+    return _build_user(get_or_set_auth_token_cache(token_key, lambda: _get_token_user(token_key)))
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication serving the users of tokens from the auth cache,
+    so most requests make no authentication query.
+    Tokens are removed from the cache when they are deleted (e.g. on logout)
+    or when their user is changed or deleted, see signals.
+    """
+
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # The token is not read from the database, request.auth only has its key and user
+        return user, Token(key=key, user=user)
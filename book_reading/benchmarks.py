@@ -0,0 +1,372 @@
+"""
+Benchmarks of the reading session API.
+
+generate_benchmark_data fills the database with realistic users, books and sessions,
+run_benchmarks measures latency percentiles and queries per call of the services,
+the views and the Celery tasks, run_throughput_benchmarks compares the throughput
+of the sync and the async views under concurrent requests, run_connection_benchmarks
+compares new and persistent database connections. All of them write to
+the configured database, so they must not be run against production.
+"""
+import asyncio
+import datetime
+import io
+import math
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from .models import Book, ReadingSession
+from .reconciliation import reconcile_reading_statistics
+from .search import search_books, update_search_vectors
+from .services import start_reading_session_and_get_message, end_reading_session_and_get_message, \
+    get_user_statistics, get_user_reading_statistics, _apply_reading_sessions_statistics
+
+BENCHMARK_USERNAME_PREFIX = 'benchmark_'
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _generate_user_sessions(rng, user_id, book_ids, sessions_count, days, now) -> list:
+    """Returns non-overlapping finished sessions of a user spread over the last days"""
+    period = datetime.timedelta(days=days)
+    slot = period / max(sessions_count, 1)
+    sessions = []
+    for i in range(sessions_count):
+        start_time = now - period + i * slot + rng.random() * slot / 2
+        duration = min(datetime.timedelta(minutes=rng.randint(5, 90)), slot / 2)
+        sessions.append({'user_id': user_id, 'book_id': rng.choice(book_ids),
+                         'start_time': start_time, 'end_time': start_time + duration})
+    return sessions
+
+
+def generate_benchmark_data(users: int, books: int, sessions_per_user: int, days: int = 90,
+                            chunk_size: int = 10000, seed: int = 0, log=print) -> None:
+    """
+    Creates benchmark users, books and finished reading sessions with their statistics.
+    Rows are inserted in chunks, so 100k users with 10M sessions fit into memory.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    password = make_password(None)
+
+    first_number = User.objects.filter(username__startswith=BENCHMARK_USERNAME_PREFIX).count()
+    for numbers in _chunks(range(first_number, first_number + users), chunk_size):
+        User.objects.bulk_create([User(username=f'{BENCHMARK_USERNAME_PREFIX}{number}', password=password)
+                                  for number in numbers])
+    log(f'Created {users} users')
+
+    for numbers in _chunks(range(books), chunk_size):
+        Book.objects.bulk_create([
+            Book(title=f'Benchmark book {number}', author=f'Author {number % 1000}',
+                 year_published=rng.randint(1900, 2023), short_description='Short description ' * 5,
+                 full_description='Full description ' * 200)
+            for number in numbers
+        ])
+    # Books created in bulk are not saved one by one, so their search vectors are updated here
+    update_search_vectors(chunk_size=chunk_size)
+    log(f'Created {books} books')
+
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    user_ids = list(User.objects.filter(
+        username__startswith=BENCHMARK_USERNAME_PREFIX
+    ).order_by('id').values_list('id', flat=True))[first_number:]
+    users_per_chunk = max(chunk_size // max(sessions_per_user, 1), 1)
+    created = 0
+    for user_ids_chunk in _chunks(user_ids, users_per_chunk):
+        sessions = []
+        for user_id in user_ids_chunk:
+            sessions += _generate_user_sessions(rng, user_id, book_ids, sessions_per_user, days, now)
+        with transaction.atomic():
+            ReadingSession.objects.bulk_create([
+                ReadingSession(duration=session['end_time'] - session['start_time'], **session)
+                for session in sessions
+            ])
+            _apply_reading_sessions_statistics(sessions)
+        created += len(sessions)
+        log(f'Created {created} reading sessions')
+
+
+def percentile(values: list, percent: float) -> float:
+    """Returns the percentile of the values using the nearest-rank method"""
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def measure(name: str, call, iterations: int) -> dict:
+    """Calls call(i) the given number of times and returns latency percentiles and queries per call"""
+    latencies = []
+    queries = 0
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            call(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries += len(context.captured_queries)
+    return {
+        'name': name,
+        'iterations': iterations,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies),
+        'queries_per_call': queries / iterations,
+    }
+
+
+def _get_benchmark_users(count: int, seed: int) -> list:
+    user_ids = list(User.objects.filter(
+        username__startswith=BENCHMARK_USERNAME_PREFIX
+    ).values_list('id', flat=True)[:10000])
+    if not user_ids:
+        raise ValueError('There are no benchmark users, generate benchmark data first')
+    return random.Random(seed).sample(user_ids, min(count, len(user_ids)))
+
+
+def run_benchmarks(iterations: int = 200, users: int = 100, seed: int = 0, include_tasks: bool = True,
+                   scenarios: list = None) -> list:
+    """
+    Runs the micro-benchmarks of the services and the macro-benchmarks of the HTTP endpoints.
+    Returns a list of results, see measure.
+    """
+    rng = random.Random(seed)
+    user_ids = _get_benchmark_users(users, seed)
+    book_ids = list(Book.objects.values_list('id', flat=True)[:10000])
+    tokens = {user_id: Token.objects.get_or_create(user_id=user_id)[0].key for user_id in user_ids}
+    client = Client(HTTP_HOST='localhost')
+
+    def user(i):
+        return user_ids[i % len(user_ids)]
+
+    def book(i):
+        return rng.choice(book_ids)
+
+    def get(url, i):
+        return client.get(url, HTTP_AUTHORIZATION=f'Token {tokens[user(i)]}')
+
+    benchmarks = [
+        ('service: start_reading_session_and_get_message',
+         lambda i: start_reading_session_and_get_message(user=user(i), book_id=book(i))),
+        ('service: end_reading_session_and_get_message',
+         lambda i: end_reading_session_and_get_message(user=user(i))),
+        ('service: get_user_statistics',
+         lambda i: get_user_statistics(user=user(i))),
+        ('service: get_user_reading_statistics',
+         lambda i: get_user_reading_statistics(user=user(i), book_id=book(i))),
+        ('view: start-reading-session',
+         lambda i: get(f'/api/v1/start-reading-session/{book(i)}/', i)),
+        ('view: end-reading-session',
+         lambda i: get('/api/v1/end-reading-session/', i)),
+        ('view: user-statistics',
+         lambda i: get('/api/v1/user-statistics/', i)),
+        ('view: book-reading-statistics',
+         lambda i: get(f'/api/v1/book-reading-statistics/{book(i)}/', i)),
+        ('view: books',
+         lambda i: client.get('/api/v1/books/')),
+        ('service: search_books',
+         lambda i: search_books(f'Author {i % 1000}')),
+    ]
+    if include_tasks:
+        # The incremental run only checks the users with recent sessions, the full one checks everyone
+        benchmarks.append(('task: reconcile_reading_statistics',
+                           lambda i: reconcile_reading_statistics(full=True, log=lambda message: None)))
+
+    results = []
+    for name, call in benchmarks:
+        if scenarios and not any(scenario in name for scenario in scenarios):
+            continue
+        task_iterations = max(iterations // 100, 1) if name.startswith('task') else iterations
+        results.append(measure(name, call, task_iterations))
+    return results
+
+
+def _wsgi_get(application, path: str, token: str) -> int:
+    """Makes a GET request to the WSGI application and returns the status code"""
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': f'Token {token}',
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        # Closing the response closes the database connections of the request like a WSGI server does
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+async def _asgi_get(application, path: str, token: str) -> int:
+    """Makes a GET request to the ASGI application and returns the status code"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+def _throughput_result(name: str, statuses: list, concurrency: int, seconds: float) -> dict:
+    return {
+        'name': name,
+        'requests': len(statuses),
+        'concurrency': concurrency,
+        'errors': sum(status >= 400 for status in statuses),
+        'seconds': seconds,
+        'requests_per_second': len(statuses) / seconds,
+    }
+
+
+def run_throughput_benchmarks(requests: int = 1000, concurrency: int = 100, users: int = 100, seed: int = 0,
+                              scenarios: list = None) -> list:
+    """
+    Compares the throughput of the sync and the async views under concurrent requests.
+    The sync views are served by the WSGI handler from a pool of concurrency threads,
+    like a WSGI server with that many threads, the async views by the ASGI handler
+    from concurrency tasks of one event loop, like a single ASGI process.
+    Returns a list of results with the number of requests per second.
+    """
+    rng = random.Random(seed)
+    user_ids = _get_benchmark_users(users, seed)
+    book_ids = list(Book.objects.values_list('id', flat=True)[:10000])
+    tokens = [Token.objects.get_or_create(user_id=user_id)[0].key for user_id in user_ids]
+    calls = [(tokens[i % len(tokens)], rng.choice(book_ids)) for i in range(requests)]
+
+    endpoints = [
+        ('user-statistics', lambda book_id: '/api/v1/{}user-statistics/'),
+        ('book-reading-statistics', lambda book_id: f'/api/v1/{{}}book-reading-statistics/{book_id}/'),
+        ('start-reading-session', lambda book_id: f'/api/v1/{{}}start-reading-session/{book_id}/'),
+    ]
+    wsgi_application = WSGIHandler()
+    asgi_application = ASGIHandler()
+
+    async def run_async(get_path):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(token, book_id):
+            async with semaphore:
+                return await _asgi_get(asgi_application, get_path(book_id).format('async/'), token)
+        return await asyncio.gather(*(call(token, book_id) for token, book_id in calls))
+
+    results = []
+    for name, get_path in endpoints:
+        if scenarios and not any(scenario in name for scenario in scenarios):
+            continue
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            statuses = list(executor.map(
+                lambda call: _wsgi_get(wsgi_application, get_path(call[1]).format(''), call[0]), calls
+            ))
+        results.append(_throughput_result(f'sync: {name}', statuses, concurrency, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        statuses = asyncio.run(run_async(get_path))
+        results.append(_throughput_result(f'async: {name}', statuses, concurrency, time.perf_counter() - start))
+    return results
+
+
+def run_connection_benchmarks(requests: int = 200, users: int = 100, seed: int = 0) -> list:
+    """
+    Compares the latency of requests opening a new database connection with requests reusing
+    a persistent connection (CONN_MAX_AGE with health checks). Requests are made to the WSGI handler,
+    which closes the connections at the end of a request like a WSGI server.
+    Returns a list of results, see measure, with the number of opened connections per request.
+    """
+    user_ids = _get_benchmark_users(users, seed)
+    tokens = [Token.objects.get_or_create(user_id=user_id)[0].key for user_id in user_ids]
+    application = WSGIHandler()
+    # The settings are shared by the connections of all threads
+    database_settings = connections.settings[connection.alias]
+    original = {key: database_settings.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    opened = []
+
+    def count_connection(**kwargs):
+        opened.append(1)
+
+    connection_created.connect(count_connection)
+    results = []
+    try:
+        for name, max_age in (('connections: new connection per request', 0),
+                              ('connections: persistent connection', 600)):
+            database_settings.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=True)
+            connection.close()
+            opened.clear()
+            result = measure(name, lambda i: _wsgi_get(application, '/api/v1/user-statistics/',
+                                                       tokens[i % len(tokens)]), requests)
+            result['connections_per_call'] = len(opened) / requests
+            results.append(result)
+    finally:
+        connection_created.disconnect(count_connection)
+        database_settings.update(original)
+        connection.close()
+    return results
+
+
+def format_throughput_results(results: list) -> str:
+    """Returns the throughput benchmark results as a text table"""
+    header = f'{"benchmark":<40}{"requests":>10}{"concurrency":>13}{"errors":>8}{"seconds":>10}{"req/s":>10}'
+    lines = [header, '-' * len(header)]
+    for result in results:
+        lines.append(f'{result["name"]:<40}{result["requests"]:>10}{result["concurrency"]:>13}'
+                     f'{result["errors"]:>8}{result["seconds"]:>10.2f}{result["requests_per_second"]:>10.1f}')
+    return '\n'.join(lines)
+
+
+def format_results(results: list) -> str:
+    """Returns the benchmark results as a text table"""
+    header = f'{"benchmark":<52}{"calls":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}{"queries":>9}'
+    lines = [header, '-' * len(header)]
+    for result in results:
+        lines.append(f'{result["name"]:<52}{result["iterations"]:>7}{result["p50_ms"]:>10.2f}'
+                     f'{result["p95_ms"]:>10.2f}{result["p99_ms"]:>10.2f}{result["max_ms"]:>10.2f}'
+                     f'{result["queries_per_call"]:>9.1f}')
+    return '\n'.join(lines)
+
+
+def find_regressions(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Compares the results with the results of a previous run.
+    Returns descriptions of benchmarks whose p95 latency grew by more than tolerance percent
+    or which make more queries per call.
+    """
+    baseline = {result['name']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance / 100):
+            regressions.append(f'{result["name"]}: p95 {previous["p95_ms"]:.2f} ms -> {result["p95_ms"]:.2f} ms')
+        if result['queries_per_call'] > previous['queries_per_call']:
+            regressions.append(f'{result["name"]}: queries per call '
+                               f'{previous["queries_per_call"]:.1f} -> {result["queries_per_call"]:.1f}')
+    return regressions
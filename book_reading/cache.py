@@ -0,0 +1,252 @@
+import datetime
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+BOOKS_VERSION_CACHE_KEY = 'books:version'
+
+
+def get_books_cache():
+    return caches[settings.BOOKS_CACHE_ALIAS]
+
+
+def _get_books_version() -> int:
+    """
+    Returns the current version of the book catalogue.
+    All cached book lists are built for a version, so changing
+    the version invalidates them without deleting keys one by one.
+    """
+    version = get_books_cache().get(BOOKS_VERSION_CACHE_KEY)
+    if version is None:
+        version = 1
+        get_books_cache().add(BOOKS_VERSION_CACHE_KEY, version, timeout=None)
+    return version
+
+
+def book_list_cache_key(*parts) -> str:
+    """Returns a cache key of a book list for the current catalogue version"""
+    return ':'.join(['books', 'list', str(_get_books_version()), *map(str, parts)])
+
+
+def book_details_cache_key(book_id) -> str:
+    return f'books:details:{book_id}'
+
+
+def get_or_set_books_cache(key, get_data):
+    """
+    Returns data from the books cache, calling get_data on a miss.
+    The result of get_data is cached unless it is None.
+    """
+    data = get_books_cache().get(key)
+    if data is None:
+        data = get_data()
+        if data is not None:
+            get_books_cache().set(key, data, timeout=settings.BOOKS_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_or_set_books_cache(key, get_data):
+    """Async version of get_or_set_books_cache, get_data is a coroutine function"""
+    data = await get_books_cache().aget(key)
+    if data is None:
+        data = await get_data()
+        if data is not None:
+            await get_books_cache().aset(key, data, timeout=settings.BOOKS_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_book_cache(book_id) -> None:
+    """Removes a book and all book lists from the cache"""
+    get_books_cache().delete(book_details_cache_key(book_id))
+    try:
+        get_books_cache().incr(BOOKS_VERSION_CACHE_KEY)
+    except ValueError:
+        # There is no version yet, so there are no cached lists either
+        pass
+
+
+def invalidate_books_statistics_cache(book_ids) -> None:
+    """
+    Removes the details of books whose reading statistics changed from the cache.
+    The book lists and search results are kept, as every ended session would invalidate all of them,
+    so their statistics can be up to BOOKS_CACHE_TIMEOUT seconds old.
+    Called after the statistics are committed, so errors are logged instead of failing the request.
+    """
+    try:
+        get_books_cache().delete_many([book_details_cache_key(book_id) for book_id in book_ids])
+    except Exception:
+        logger.exception('The cached books could not be invalidated')
+
+
+def get_statistics_cache():
+    return caches[settings.STATISTICS_CACHE_ALIAS]
+
+
+def statistics_version_cache_key(user_id) -> str:
+    return f'statistics:user:{user_id}:version'
+
+
+def user_statistics_cache_key(user_id, field, version) -> str:
+    return f'statistics:user:{user_id}:{version}:{field}'
+
+
+def reading_time_for_period_cache_key(user_id, period, version) -> str:
+    return f'statistics:user:{user_id}:{version}:period:{int(period.total_seconds())}'
+
+
+def book_reading_statistics_cache_key(user_id, book_id, version) -> str:
+    return f'statistics:user:{user_id}:{version}:book:{book_id}'
+
+
+def _to_microseconds(reading_time) -> int:
+    return reading_time // datetime.timedelta(microseconds=1)
+
+
+def _get_statistics_version(user_id) -> int:
+    """
+    Returns the version of the cached statistics of a user, which is a part of their keys.
+    The version is read before the statistics are loaded from the database, so a value loaded
+    before the statistics changed is cached under the old version and never read again.
+    """
+    key = statistics_version_cache_key(user_id)
+    version = get_statistics_cache().get(key)
+    if version is None:
+        # A new version after an eviction, so values cached under the previous versions are not read
+        get_statistics_cache().add(key, time.time_ns(), timeout=None)
+        version = get_statistics_cache().get(key)
+    return version
+
+
+async def _aget_statistics_version(user_id) -> int:
+    """Async version of _get_statistics_version"""
+    key = statistics_version_cache_key(user_id)
+    version = await get_statistics_cache().aget(key)
+    if version is None:
+        await get_statistics_cache().aadd(key, time.time_ns(), timeout=None)
+        version = await get_statistics_cache().aget(key)
+    return version
+
+
+def _get_or_set_reading_time(key, get_data, timeout):
+    cached = get_statistics_cache().get(key)
+    if cached is not None:
+        return datetime.timedelta(microseconds=cached)
+
+    reading_time = get_data()
+    get_statistics_cache().set(key, _to_microseconds(reading_time), timeout=timeout)
+    return reading_time
+
+
+async def _aget_or_set_reading_time(key, get_data, timeout):
+    cached = await get_statistics_cache().aget(key)
+    if cached is not None:
+        return datetime.timedelta(microseconds=cached)
+
+    reading_time = await get_data()
+    await get_statistics_cache().aset(key, _to_microseconds(reading_time), timeout=timeout)
+    return reading_time
+
+
+def get_or_set_user_total_reading_time_cache(user_id, get_data):
+    """Returns the total reading time of a user from the statistics cache, calling get_data on a miss"""
+    key = user_statistics_cache_key(user_id, 'total_reading_time', _get_statistics_version(user_id))
+    return _get_or_set_reading_time(key, get_data, settings.STATISTICS_CACHE_TIMEOUT)
+
+
+async def aget_or_set_user_total_reading_time_cache(user_id, get_data):
+    """Async version of get_or_set_user_total_reading_time_cache, get_data is a coroutine function"""
+    key = user_statistics_cache_key(user_id, 'total_reading_time', await _aget_statistics_version(user_id))
+    return await _aget_or_set_reading_time(key, get_data, settings.STATISTICS_CACHE_TIMEOUT)
+
+
+def get_or_set_reading_time_for_periods_cache(user_id, periods: list, get_data) -> list:
+    """
+    Returns the reading time of a user for each of the last periods of time from the statistics cache,
+    calling get_data and caching its result if any of the values is missing.
+    The values are kept for STATISTICS_PERIOD_CACHE_TIMEOUT seconds only, since the periods move with time.
+    """
+    version = _get_statistics_version(user_id)
+    keys = [reading_time_for_period_cache_key(user_id, period, version) for period in periods]
+    cached = get_statistics_cache().get_many(keys)
+    if len(cached) == len(keys):
+        return [datetime.timedelta(microseconds=cached[key]) for key in keys]
+
+    reading_time = get_data()
+    get_statistics_cache().set_many({key: _to_microseconds(value) for key, value in zip(keys, reading_time)},
+                                    timeout=settings.STATISTICS_PERIOD_CACHE_TIMEOUT)
+    return reading_time
+
+
+async def aget_or_set_reading_time_for_periods_cache(user_id, periods: list, get_data) -> list:
+    """Async version of get_or_set_reading_time_for_periods_cache, get_data is a coroutine function"""
+    version = await _aget_statistics_version(user_id)
+    keys = [reading_time_for_period_cache_key(user_id, period, version) for period in periods]
+    cached = await get_statistics_cache().aget_many(keys)
+    if len(cached) == len(keys):
+        return [datetime.timedelta(microseconds=cached[key]) for key in keys]
+
+    reading_time = await get_data()
+    await get_statistics_cache().aset_many({key: _to_microseconds(value) for key, value in zip(keys, reading_time)},
+                                           timeout=settings.STATISTICS_PERIOD_CACHE_TIMEOUT)
+    return reading_time
+
+
+def get_or_set_book_reading_statistics_cache(user_id, book_id, get_data):
+    """Returns the user's reading time of a specific book from the statistics cache, calling get_data on a miss"""
+    key = book_reading_statistics_cache_key(user_id, book_id, _get_statistics_version(user_id))
+    return _get_or_set_reading_time(key, get_data, settings.STATISTICS_CACHE_TIMEOUT)
+
+
+async def aget_or_set_book_reading_statistics_cache(user_id, book_id, get_data):
+    """Async version of get_or_set_book_reading_statistics_cache, get_data is a coroutine function"""
+    key = book_reading_statistics_cache_key(user_id, book_id, await _aget_statistics_version(user_id))
+    return await _aget_or_set_reading_time(key, get_data, settings.STATISTICS_CACHE_TIMEOUT)
+
+
+def invalidate_statistics_cache(user_ids) -> None:
+    """
+    Moves the cached statistics of users to a new version, so they are loaded from the database on the next read.
+    Called after the statistics are committed, so errors are logged instead of failing the request,
+    the old values expire after STATISTICS_CACHE_TIMEOUT.
+    """
+    for user_id in user_ids:
+        try:
+            get_statistics_cache().incr(statistics_version_cache_key(user_id))
+        except ValueError:
+            # There is no version, the next read starts a new one
+            pass
+        except Exception:
+            logger.exception(f'The cached statistics of user {user_id} could not be invalidated')
+
+
+def get_auth_cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def auth_token_cache_key(token_key) -> str:
+    """Tokens are hashed, so they cannot be read from the cache"""
+    return f'auth:token:user:{hashlib.sha256(token_key.encode()).hexdigest()}'
+
+
+def get_or_set_auth_token_cache(token_key, get_data):
+    """
+    Returns the fields of the user of an authentication token from the auth cache, calling get_data on a miss.
+    The result of get_data is cached unless it is None, so invalid tokens cannot fill the cache.
+    """
+    key = auth_token_cache_key(token_key)
+    user = get_auth_cache().get(key)
+    if user is None:
+        user = get_data()
+        if user is not None:
+            get_auth_cache().set(key, user, timeout=settings.AUTH_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_auth_token_cache(token_keys) -> None:
+    """Removes the users of authentication tokens from the cache"""
+    get_auth_cache().delete_many([auth_token_cache_key(token_key) for token_key in token_keys])
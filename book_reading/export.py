@@ -0,0 +1,97 @@
+"""
+Export of the reading history in CSV or NDJSON.
+
+Sessions are read from the database in chunks, every chunk by its own query continuing
+after the last session of the previous one, and rendered row by row, so a history of any
+size is exported with constant memory, either as a StreamingHttpResponse or by the
+exportreadingsessions command. Server-side cursors are not needed, so it also streams
+behind pgbouncer (DB_PGBOUNCER).
+"""
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import ReadingSession, ArchivedReadingSession
+from .services import KIEV_TZ, timedelta_to_string
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ('id', 'user_id', 'book_id', 'book__title', 'start_time', 'end_time', 'duration')
+EXPORT_COLUMNS = ('id', 'user_id', 'book_id', 'book_title', 'start_time', 'end_time', 'duration_seconds')
+HUMAN_READABLE_COLUMNS = ('duration',)
+
+
+def _filter_reading_sessions(queryset, user_id=None, book_id=None, date_from=None, date_to=None):
+    """Filters sessions by user, book and the days (Europe/Kiev) they started on"""
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    if book_id is not None:
+        queryset = queryset.filter(book_id=book_id)
+    if date_from is not None:
+        queryset = queryset.filter(start_time__gte=KIEV_TZ.localize(datetime.datetime.combine(
+            date_from, datetime.time())))
+    if date_to is not None:
+        queryset = queryset.filter(start_time__lt=KIEV_TZ.localize(datetime.datetime.combine(
+            date_to + datetime.timedelta(days=1), datetime.time())))
+    return queryset
+
+
+def iter_reading_sessions(user_id=None, book_id=None, date_from=None, date_to=None, chunk_size=None):
+    """
+    Yields the sessions as tuples of EXPORT_FIELDS ordered by start time, archived sessions first.
+    Active sessions have no end time.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    for model in (ArchivedReadingSession, ReadingSession):
+        queryset = _filter_reading_sessions(model.objects.all(), user_id, book_id, date_from, date_to)
+        sessions = queryset.order_by('start_time', 'id').values_list(*EXPORT_FIELDS)
+        chunk = list(sessions[:chunk_size])
+        while chunk:
+            yield from chunk
+            last_id, last_start_time = chunk[-1][0], chunk[-1][4]
+            after_last = Q(start_time__gt=last_start_time) | Q(start_time=last_start_time, id__gt=last_id)
+            chunk = list(sessions.filter(after_last)[:chunk_size])
+
+
+def _get_export_row(session: tuple, human_readable: bool) -> list:
+    session_id, user_id, book_id, book_title, start_time, end_time, duration = session
+    row = [
+        session_id, user_id, book_id, book_title,
+        start_time.isoformat(),
+        end_time.isoformat() if end_time else None,
+        duration.total_seconds() if end_time else None,
+    ]
+    if human_readable:
+        row.append(timedelta_to_string(duration) if end_time else None)
+    return row
+
+
+class _Echo:
+    """A file-like object returning what is written, so csv.writer renders one row at a time"""
+
+    def write(self, value):
+        return value
+
+
+def render_reading_sessions(sessions, export_format: str, human_readable: bool = False):
+    """Yields the sessions rendered in CSV (with a header) or NDJSON, one line at a time"""
+    columns = EXPORT_COLUMNS + HUMAN_READABLE_COLUMNS if human_readable else EXPORT_COLUMNS
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for session in sessions:
+            yield writer.writerow(_get_export_row(session, human_readable))
+    else:
+        for session in sessions:
+            yield json.dumps(dict(zip(columns, _get_export_row(session, human_readable))), ensure_ascii=False) + '\n'
+
+
+def export_reading_sessions(export_format: str, human_readable: bool = False, chunk_size=None, **filters):
+    """Yields the lines of the export of the sessions matching the filters, see iter_reading_sessions"""
+    return render_reading_sessions(iter_reading_sessions(chunk_size=chunk_size, **filters),
+                                   export_format, human_readable)
@@ -0,0 +1,87 @@
+"""
+Heartbeats of the active reading sessions.
+
+Clients send a heartbeat every minute or so while the user is reading. A heartbeat only
+stores the time it was received for the user, in a Redis hash when HEARTBEATS_REDIS_URL
+is set, otherwise in the memory of the process (e.g. for tests). The stored times are
+flushed to the last_seen field of the active sessions in batches, and sessions without
+heartbeats for a while are closed by the close_idle_reading_sessions task. Without Redis
+the heartbeats received by web processes never reach the Celery worker, so the tasks
+which flush them and close idle sessions are skipped.
+"""
+import threading
+
+import redis
+from django.conf import settings
+
+HEARTBEATS_KEY = 'heartbeats:users'
+
+
+class LocalHeartbeats:
+    """Heartbeats in the memory of the process, every process has its own"""
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._last_seen = {}
+
+    def record(self, user_id: int, timestamp: float) -> None:
+        """Stores the time of the last heartbeat of a user, as a unix timestamp"""
+        with self._lock:
+            self._last_seen[user_id] = max(timestamp, self._last_seen.get(user_id, timestamp))
+
+    def pop_all(self) -> dict:
+        """Removes and returns the stored heartbeats {user_id: unix timestamp}"""
+        with self._lock:
+            last_seen, self._last_seen = self._last_seen, {}
+        return last_seen
+
+    def restore(self, last_seen: dict) -> None:
+        """Stores popped heartbeats {user_id: unix timestamp} again, newer heartbeats received meanwhile are kept"""
+        for user_id, timestamp in last_seen.items():
+            self.record(user_id, timestamp)
+
+
+class RedisHeartbeats:
+    """Heartbeats in a Redis hash shared by all processes"""
+    shared = True
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def clear(self) -> None:
+        self._redis.delete(HEARTBEATS_KEY)
+
+    def record(self, user_id: int, timestamp: float) -> None:
+        self._redis.hset(HEARTBEATS_KEY, user_id, timestamp)
+
+    def pop_all(self) -> dict:
+        # Read and deleted in one transaction, so heartbeats received meanwhile are kept for the next flush
+        pipeline = self._redis.pipeline(transaction=True)
+        pipeline.hgetall(HEARTBEATS_KEY)
+        pipeline.delete(HEARTBEATS_KEY)
+        last_seen, _ = pipeline.execute()
+        return {int(user_id): float(timestamp) for user_id, timestamp in last_seen.items()}
+
+    def restore(self, last_seen: dict) -> None:
+        # A heartbeat received after the pop is newer, so it is not overwritten
+        pipeline = self._redis.pipeline(transaction=False)
+        for user_id, timestamp in last_seen.items():
+            pipeline.hsetnx(HEARTBEATS_KEY, user_id, timestamp)
+        pipeline.execute()
+
+
+_heartbeats = None
+
+
+def get_heartbeats():
+    """Returns the heartbeats storage configured by HEARTBEATS_REDIS_URL"""
+    global _heartbeats
+    if _heartbeats is None:
+        _heartbeats = RedisHeartbeats(settings.HEARTBEATS_REDIS_URL) if settings.HEARTBEATS_REDIS_URL \
+            else LocalHeartbeats()
+    return _heartbeats
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from book_reading.archive import archive_reading_sessions, vacuum_reading_sessions
+
+
+class Command(BaseCommand):
+    help = 'Moves finished reading sessions older than the retention window to the archive, ' \
+           'which is partitioned by month on PostgreSQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.READING_SESSIONS_RETENTION_DAYS)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of sessions moved per transaction')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Vacuums the reading sessions table afterwards (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        if options['retention_days'] <= settings.STATISTICS_MAX_PERIOD_DAYS:
+            # The reading time for the last days is computed from the sessions of the first day of a period
+            raise CommandError(f'The retention window must be longer than '
+                               f'STATISTICS_MAX_PERIOD_DAYS ({settings.STATISTICS_MAX_PERIOD_DAYS} days)')
+
+        archived = archive_reading_sessions(options['retention_days'], options['chunk_size'],
+                                            log=self.stdout.write)
+        if options['vacuum']:
+            vacuum_reading_sessions()
+        self.stdout.write(f'Archived {archived} reading sessions in total')
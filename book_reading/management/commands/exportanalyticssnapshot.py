@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.snapshots import export_analytics_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Adds the reading sessions finished since the previous run to the columnar analytics snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None,
+                            help='Directory of the snapshot, ANALYTICS_SNAPSHOT_DIR by default')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Number of sessions read from the database at a time')
+        parser.add_argument('--segment-size', type=int, default=None,
+                            help='Maximum number of sessions written to the files of a segment at a time')
+
+    def handle(self, *args, **options):
+        exported = export_analytics_snapshot(options['path'], options['chunk_size'], options['segment_size'],
+                                             log=self.stdout.write)
+        self.stdout.write(f'Exported {exported} reading sessions in total')
@@ -0,0 +1,35 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from book_reading.export import export_reading_sessions, EXPORT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Exports reading sessions of all or one user in CSV or NDJSON with constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', dest='export_format')
+        parser.add_argument('--user', type=int, help='Id of the user, all users by default')
+        parser.add_argument('--book', type=int, help='Id of the book, all books by default')
+        parser.add_argument('--date-from', type=datetime.date.fromisoformat,
+                            help='First day of the sessions, YYYY-MM-DD (Europe/Kiev)')
+        parser.add_argument('--date-to', type=datetime.date.fromisoformat,
+                            help='Last day of the sessions, YYYY-MM-DD (Europe/Kiev)')
+        parser.add_argument('--human-readable', action='store_true',
+                            help='Adds the duration in the format of the statistics')
+        parser.add_argument('--chunk-size', type=int, help='Number of sessions read from the database at a time')
+        parser.add_argument('--output', help='Path of the file, the standard output by default')
+
+    def handle(self, *args, **options):
+        lines = export_reading_sessions(
+            options['export_format'], options['human_readable'], chunk_size=options['chunk_size'],
+            user_id=options['user'], book_id=options['book'],
+            date_from=options['date_from'], date_to=options['date_to'],
+        )
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.benchmarks import generate_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with benchmark users, books and reading sessions. Do not run it in production'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=1000)
+        parser.add_argument('--sessions-per-user', type=int, default=100)
+        parser.add_argument('--days', type=int, default=90, help='Period of the generated sessions')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of rows inserted at once')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generate_benchmark_data(users=options['users'], books=options['books'],
+                                sessions_per_user=options['sessions_per_user'], days=options['days'],
+                                chunk_size=options['chunk_size'], seed=options['seed'], log=self.stdout.write)
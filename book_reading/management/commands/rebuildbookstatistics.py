@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book_reading.services import rebuild_book_statistics
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the reading statistics of all books from the statistics of users and the finished sessions'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = rebuild_book_statistics()
+        self.stdout.write(f'Created {created} book statistics rows')
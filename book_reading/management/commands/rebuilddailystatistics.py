@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.services import rebuild_daily_reading_statistics
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds daily reading statistics from the finished reading sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of users whose statistics are rebuilt in one transaction')
+
+    def handle(self, *args, **options):
+        created = rebuild_daily_reading_statistics(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Created {created} daily reading statistics rows')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.services import rebuild_rankings
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the rankings of the current and the previous week and month from daily reading statistics'
+
+    def handle(self, *args, **options):
+        used = rebuild_rankings()
+        self.stdout.write(f'Rankings rebuilt from {used} daily reading statistics rows')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Updates the search vectors of all books (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of books updated per query')
+
+    def handle(self, *args, **options):
+        updated = update_search_vectors(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Search vectors of {updated} books updated')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from book_reading.reconciliation import reconcile_reading_statistics
+from book_reading.services import timedelta_to_string
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the reading statistics from the reading sessions and repairs the wrong ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Check all users instead of the users with sessions changed since the previous run')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Number of users checked in one transaction')
+
+    def handle(self, *args, **options):
+        report = reconcile_reading_statistics(full=options['full'], chunk_size=options['chunk_size'],
+                                              log=self.stdout.write)
+        self.stdout.write(
+            f'Checked {report["users"]} users and {report["books"]} books, repaired '
+            f'{report["reading_statistics"]} book reading statistics '
+            f'({timedelta_to_string(report["reading_time_corrected"])}), '
+            f'{report["user_statistics"]} user statistics '
+            f'({timedelta_to_string(report["total_reading_time_corrected"])}) '
+            f'and {report["book_statistics"]} book statistics'
+        )
@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book_reading.benchmarks import run_benchmarks, format_results, find_regressions, run_throughput_benchmarks, \
+    format_throughput_results, run_connection_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles and queries per call of the reading session API, ' \
+           'or the throughput of the sync and the async views with --throughput, ' \
+           'or the latency of requests with new and persistent database connections with --connections. ' \
+           'Requires data created by generatebenchmarkdata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--users', type=int, default=100, help='Number of benchmark users taking part')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scenario', action='append', help='Runs only benchmarks containing this text')
+        parser.add_argument('--skip-tasks', action='store_true', help='Does not run the Celery task benchmarks')
+        parser.add_argument('--output', help='Saves the results to a JSON file')
+        parser.add_argument('--compare', help='JSON file with the results of a previous run')
+        parser.add_argument('--tolerance', type=float, default=20,
+                            help='Allowed growth of the p95 latency compared to the previous run, in percent')
+        parser.add_argument('--throughput', action='store_true',
+                            help='Compares the throughput of the sync and the async views instead')
+        parser.add_argument('--connections', action='store_true',
+                            help='Compares requests with new and persistent database connections instead')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Number of requests per throughput or connection benchmark')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Number of concurrent requests of the throughput benchmarks')
+
+    def handle(self, *args, **options):
+        if options['throughput']:
+            return self.handle_throughput(options)
+        if options['connections']:
+            return self.handle_connections(options)
+
+        try:
+            results = run_benchmarks(iterations=options['iterations'], users=options['users'],
+                                     seed=options['seed'], include_tasks=not options['skip_tasks'],
+                                     scenarios=options['scenario'])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(format_results(results))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                regressions = find_regressions(results, json.load(file), options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write('No performance regressions')
+
+    def handle_throughput(self, options):
+        try:
+            results = run_throughput_benchmarks(requests=options['requests'], concurrency=options['concurrency'],
+                                                users=options['users'], seed=options['seed'],
+                                                scenarios=options['scenario'])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(format_throughput_results(results))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def handle_connections(self, options):
+        try:
+            results = run_connection_benchmarks(requests=options['requests'], users=options['users'],
+                                                seed=options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(format_results(results))
+        for result in results:
+            self.stdout.write(f'{result["name"]}: {result["connections_per_call"]:.2f} connections per request')
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
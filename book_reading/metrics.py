@@ -0,0 +1,80 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class ViewMetrics:
+    """
+    Request metrics of the views collected in the current process.
+    Every worker process keeps its own metrics, so Prometheus has to scrape each of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.queries = defaultdict(int)
+            self.db_time = defaultdict(float)
+            self.latency_sum = defaultdict(float)
+            self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+            self.budget_exceeded = defaultdict(int)
+
+    def record(self, view: str, queries: int, db_time: float, latency: float, budget_exceeded: bool) -> None:
+        """Adds a request to the metrics, times are in seconds"""
+        with self._lock:
+            self.requests[view] += 1
+            self.queries[view] += queries
+            self.db_time[view] += db_time
+            self.latency_sum[view] += latency
+            buckets = self.latency_buckets[view]
+            for i, bucket in enumerate(LATENCY_BUCKETS):
+                if latency <= bucket:
+                    buckets[i] += 1
+            if budget_exceeded:
+                self.budget_exceeded[view] += 1
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text format"""
+        with self._lock:
+            lines = [
+                '# HELP http_requests_total Number of requests by view.',
+                '# TYPE http_requests_total counter',
+                *(f'http_requests_total{{view="{view}"}} {value}' for view, value in self.requests.items()),
+                '# HELP http_db_queries_total Number of database queries by view.',
+                '# TYPE http_db_queries_total counter',
+                *(f'http_db_queries_total{{view="{view}"}} {value}' for view, value in self.queries.items()),
+                '# HELP http_db_time_seconds_total Time spent in database queries by view.',
+                '# TYPE http_db_time_seconds_total counter',
+                *(f'http_db_time_seconds_total{{view="{view}"}} {value:.6f}' for view, value in self.db_time.items()),
+                '# HELP http_query_budget_exceeded_total Number of requests exceeding the query budget by view.',
+                '# TYPE http_query_budget_exceeded_total counter',
+                *(f'http_query_budget_exceeded_total{{view="{view}"}} {value}'
+                  for view, value in self.budget_exceeded.items()),
+                '# HELP http_request_duration_seconds Request latency by view.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for view, buckets in self.latency_buckets.items():
+                for bucket, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="{bucket}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} '
+                             f'{self.requests[view]}')
+                lines.append(f'http_request_duration_seconds_sum{{view="{view}"}} {self.latency_sum[view]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{view="{view}"}} {self.requests[view]}')
+        return '\n'.join(lines) + '\n'
+
+
+view_metrics = ViewMetrics()
+
+
+def metrics_view(request):
+    """Displaying request metrics in the Prometheus text format, only for local addresses"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(view_metrics.to_prometheus(), content_type='text/plain; version=0.0.4')
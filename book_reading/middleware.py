@@ -0,0 +1,120 @@
+import contextvars
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .metrics import view_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """A view has made more database queries than its budget allows"""
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+# The counter of the current request, asgiref passes it to the threads running the queries of async views
+_current_query_counter = contextvars.ContextVar('current_query_counter', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _current_query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def _install_query_counting() -> None:
+    """
+    Adds query counting to the database connections of the current thread.
+    Connections belong to threads, so it has to be done in the thread running the queries.
+    """
+    for connection in connections.all():
+        if _count_query not in connection.execute_wrappers:
+            # The first position is not popped by the execute_wrapper() context managers
+            connection.execute_wrappers.insert(0, _count_query)
+
+
+class QueryMetricsMiddleware:
+    """
+    Records the number of database queries, the database time and the total latency of every request.
+    They are added to the response headers and to the metrics served by metrics_view.
+    Requests of views listed in QUERY_BUDGETS are checked against their query budget.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_query_counting()
+        counter = QueryCounter()
+        token = _current_query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_query_counter.reset(token)
+        return self._process_response(request, response, counter, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Django runs the queries of a request in one worker thread, the same as this call
+        await sync_to_async(_install_query_counting)()
+        counter = QueryCounter()
+        token = _current_query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_query_counter.reset(token)
+        return self._process_response(request, response, counter, time.perf_counter() - start)
+
+    def _process_response(self, request, response, counter, latency):
+        view = self._get_view_name(request)
+        budget = settings.QUERY_BUDGETS.get(view)
+        budget_exceeded = budget is not None and counter.queries > budget
+        view_metrics.record(view=view, queries=counter.queries, db_time=counter.db_time,
+                            latency=latency, budget_exceeded=budget_exceeded)
+
+        response['X-DB-Query-Count'] = str(counter.queries)
+        response['X-DB-Time-Ms'] = f'{counter.db_time * 1000:.2f}'
+        response['X-Response-Time-Ms'] = f'{latency * 1000:.2f}'
+        response['Server-Timing'] = f'db;dur={counter.db_time * 1000:.2f}, total;dur={latency * 1000:.2f}'
+
+        if budget_exceeded:
+            message = f'View {view} made {counter.queries} database queries, its budget is {budget}'
+            if settings.QUERY_BUDGETS_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    @staticmethod
+    def _get_view_name(request) -> str:
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return 'unresolved'
+        return resolver_match.view_name or resolver_match._func_path
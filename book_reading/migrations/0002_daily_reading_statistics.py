@@ -0,0 +1,77 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:20
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import pytz
+
+KIEV_TZ = pytz.timezone('Europe/Kiev')
+
+
+def split_reading_time_by_days(start_time, end_time):
+    """A copy of book_reading.services.split_reading_time_by_days, migrations must not depend on app code"""
+    start_time = start_time.astimezone(KIEV_TZ)
+    end_time = end_time.astimezone(KIEV_TZ)
+
+    result = []
+    while start_time.date() < end_time.date():
+        next_day = start_time.date() + datetime.timedelta(days=1)
+        midnight = KIEV_TZ.localize(datetime.datetime.combine(next_day, datetime.time()))
+        result.append((start_time.date(), midnight - start_time))
+        start_time = midnight
+    if end_time > start_time:
+        result.append((end_time.date(), end_time - start_time))
+    return result
+
+
+def fill_daily_reading_statistics(apps, schema_editor):
+    """Fills daily reading statistics from the finished reading sessions, user by user"""
+    ReadingSession = apps.get_model('book_reading', 'ReadingSession')
+    DailyReadingStatistics = apps.get_model('book_reading', 'DailyReadingStatistics')
+    sessions = ReadingSession.objects.filter(end_time__isnull=False).order_by('user_id').values_list(
+        'user_id', 'book_id', 'start_time', 'end_time'
+    )
+
+    def create_rows(user_id, daily_reading_time):
+        DailyReadingStatistics.objects.bulk_create([
+            DailyReadingStatistics(user_id=user_id, book_id=book_id, date=date, reading_time=reading_time)
+            for (book_id, date), reading_time in daily_reading_time.items()
+        ], batch_size=2000)
+
+    current_user_id = None
+    daily_reading_time = {}
+    for user_id, book_id, start_time, end_time in sessions.iterator(chunk_size=2000):
+        if user_id != current_user_id:
+            create_rows(current_user_id, daily_reading_time)
+            current_user_id = user_id
+            daily_reading_time = {}
+        for date, reading_time in split_reading_time_by_days(start_time, end_time):
+            key = (book_id, date)
+            daily_reading_time[key] = daily_reading_time.get(key, datetime.timedelta()) + reading_time
+    create_rows(current_user_id, daily_reading_time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book_reading', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reading_time', models.DurationField(default=datetime.timedelta(0))),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='book_reading.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'book', 'date'), name='unique_daily_reading_statistics')],
+            },
+        ),
+        migrations.RunPython(fill_daily_reading_statistics, migrations.RunPython.noop),
+    ]
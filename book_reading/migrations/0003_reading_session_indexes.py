@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book_reading', '0002_daily_reading_statistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(condition=models.Q(('end_time__isnull', True)), fields=['user'], name='reading_session_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(fields=['user', 'start_time'], include=('duration',), name='reading_session_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyreadingstatistics',
+            index=models.Index(fields=['user', 'date'], include=('reading_time',), name='daily_reading_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:30
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+def close_duplicate_active_sessions(apps, schema_editor):
+    """
+    Ends all but the newest active session of every user, so unique_active_reading_session can be added.
+    The start path before this migration could create several active sessions of a user in concurrent requests.
+    The sessions are ended at their start, as their reading time is unknown and is not in the statistics.
+    """
+    ReadingSession = apps.get_model('book_reading', 'ReadingSession')
+    active_sessions = ReadingSession.objects.filter(end_time__isnull=True)
+    user_ids = list(active_sessions.order_by().values('user_id').annotate(
+        sessions_count=models.Count('id')
+    ).filter(sessions_count__gt=1).values_list('user_id', flat=True))
+    for user_id in user_ids:
+        user_sessions = active_sessions.filter(user_id=user_id)
+        newest_session_id = user_sessions.order_by('-start_time', '-id').values_list('id', flat=True).first()
+        user_sessions.exclude(id=newest_session_id).update(end_time=models.F('start_time'),
+                                                           duration=datetime.timedelta())
+
+
+def merge_duplicate_reading_statistics(apps, schema_editor):
+    """
+    Merges the book reading statistics of a user into one row, so unique_reading_statistics can be added.
+    The update path before this migration could create several rows in concurrent requests.
+    Their reading time is summed in the oldest row and the other rows are deleted.
+    """
+    ReadingStatistics = apps.get_model('book_reading', 'ReadingStatistics')
+    duplicates = list(ReadingStatistics.objects.order_by().values('user_id', 'book_id').annotate(
+        rows_count=models.Count('id'), reading_time=models.Sum('total_reading_time'), first_id=models.Min('id'),
+    ).filter(rows_count__gt=1).values_list('user_id', 'book_id', 'reading_time', 'first_id'))
+    for user_id, book_id, total_reading_time, first_id in duplicates:
+        ReadingStatistics.objects.filter(id=first_id).update(total_reading_time=total_reading_time)
+        ReadingStatistics.objects.filter(user_id=user_id, book_id=book_id).exclude(id=first_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book_reading', '0003_reading_session_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_sessions, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='readingsession',
+            name='reading_session_active_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='readingsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_time__isnull', True)), fields=('user',), name='unique_active_reading_session'),
+        ),
+        migrations.RunPython(merge_duplicate_reading_statistics, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='readingstatistics',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_reading_statistics'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:35
+
+import book_reading.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0004_unique_active_session_and_statistics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='readingsession',
+            name='start_time',
+            field=models.DateTimeField(default=book_reading.models.current_time),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0005_reading_session_start_time_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readingsession',
+            name='statistics_applied',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(condition=models.Q(('statistics_applied', False)), fields=['id'], name='reading_session_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0006_reading_session_statistics_applied'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReadingSession',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('duration', models.DurationField()),
+            ],
+            options={
+                'db_table': 'book_reading_archived_reading_session',
+                'managed': False,
+            },
+        ),
+    ]
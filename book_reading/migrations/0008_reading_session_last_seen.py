@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0007_archived_reading_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readingsession',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(condition=models.Q(('end_time__isnull', True)), fields=['last_seen'], name='reading_session_idle_idx'),
+        ),
+    ]
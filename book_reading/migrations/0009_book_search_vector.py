@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:39
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0008_reading_session_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['year_published'], name='book_year_published_idx'),
+        ),
+    ]
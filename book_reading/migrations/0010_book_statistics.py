@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:40
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0009_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_reading_time', models.DurationField(default=datetime.timedelta(0))),
+                ('readers_count', models.IntegerField(default=0)),
+                ('sessions_count', models.IntegerField(default=0)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='book_reading.book')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0010_book_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readingsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(fields=['updated_at'], name='reading_session_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# The indexes are only supported by PostgreSQL, so they are not declared in the Book model
+SEARCH_INDEXES = {
+    'book_search_vector_idx': 'gin (search_vector)',
+    'book_author_trgm_idx': 'gin (author gin_trgm_ops)',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('book_reading', 'Book')._meta.db_table
+    # Created here instead of with TrigramExtension, which cannot be reversed on other databases.
+    # The extension is not dropped when the migration is reversed, as other objects of the database may use it
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in SEARCH_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING {definition}')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0011_reading_session_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
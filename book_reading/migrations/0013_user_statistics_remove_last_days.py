@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0012_book_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userstatistics',
+            name='last_30_days_reading_time',
+        ),
+        migrations.RemoveField(
+            model_name='userstatistics',
+            name='last_7_days_reading_time',
+        ),
+    ]
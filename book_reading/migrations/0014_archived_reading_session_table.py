@@ -0,0 +1,57 @@
+from django.db import migrations
+
+ARCHIVE_TABLE = 'book_reading_archived_reading_session'
+
+# The model of the archive is not managed: on PostgreSQL the table is partitioned by month of start_time,
+# which Django cannot declare, so its primary key is (id, start_time) and it has no foreign keys.
+# The partitions are created by the archivereadingsessions command
+POSTGRESQL_TABLE_SQL = f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+        id bigint NOT NULL,
+        book_id bigint NOT NULL,
+        user_id integer NOT NULL,
+        start_time timestamp with time zone NOT NULL,
+        end_time timestamp with time zone NOT NULL,
+        duration interval NOT NULL,
+        PRIMARY KEY (id, start_time)
+    ) PARTITION BY RANGE (start_time)
+'''
+
+# On other databases (e.g. SQLite in tests) the archive is a plain table
+TABLE_SQL = f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+        id bigint NOT NULL PRIMARY KEY,
+        book_id bigint NOT NULL,
+        user_id integer NOT NULL,
+        start_time datetime NOT NULL,
+        end_time datetime NOT NULL,
+        duration bigint NOT NULL
+    )
+'''
+
+INDEX_SQL = f'CREATE INDEX IF NOT EXISTS archived_session_user_idx ON {ARCHIVE_TABLE} (user_id, start_time)'
+
+
+def create_archive_table(apps, schema_editor):
+    # Earlier versions of the archivereadingsessions command created the table, so it may exist already
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_TABLE_SQL)
+    else:
+        schema_editor.execute(TABLE_SQL)
+    schema_editor.execute(INDEX_SQL)
+
+
+def drop_archive_table(apps, schema_editor):
+    # The partitions of the table are dropped with it
+    schema_editor.execute(f'DROP TABLE {ARCHIVE_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_reading', '0013_user_statistics_remove_last_days'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_archive_table, drop_archive_table),
+    ]
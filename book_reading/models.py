@@ -1,7 +1,13 @@
 from datetime import timedelta
 
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, connection
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def current_time():
+    return timezone.now()
 
 
 class Book(models.Model):
@@ -10,14 +16,84 @@ class Book(models.Model):
     year_published = models.IntegerField()
     short_description = models.TextField()
     full_description = models.TextField()
+    # Weighted tsvector of the title, author and descriptions, computed by save (PostgreSQL only).
+    # Its GIN index and the trigram index of author are created by the migration 0012_book_search_indexes
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['year_published'], name='book_year_published_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if connection.vendor == 'postgresql':
+            from .search import book_search_vector
+
+            # Computed by the INSERT or UPDATE of the book, so saved books are found by the search at once
+            self.search_vector = book_search_vector(self)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'search_vector'}
+        super().save(*args, **kwargs)
 
 
 class ReadingSession(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    start_time = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so the start time of sessions uploaded in bulk is kept
+    start_time = models.DateTimeField(default=current_time)
     end_time = models.DateTimeField(null=True, blank=True)
     duration = models.DurationField(default=timedelta())
+    # False while the reading time of an ended session is not yet added to the statistics
+    statistics_applied = models.BooleanField(default=True)
+    # Time of the last heartbeat of an active session saved by the flush_of_reading_session_heartbeats task
+    last_seen = models.DateTimeField(null=True, blank=True)
+    # Time of the last change which affects the statistics, the reconciliation only checks users
+    # with sessions changed since its previous run. Set explicitly by QuerySet.update() and bulk_update()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # A user can have only one active (not ended) session,
+            # the index also serves the lookup of this session
+            models.UniqueConstraint(fields=['user'], condition=models.Q(end_time__isnull=True),
+                                    name='unique_active_reading_session'),
+        ]
+        indexes = [
+            # Reading time of a user for a period, served from the index only
+            models.Index(fields=['user', 'start_time'], include=['duration'],
+                         name='reading_session_user_start_idx'),
+            # Ended sessions waiting for the statistics update
+            models.Index(fields=['id'], condition=models.Q(statistics_applied=False),
+                         name='reading_session_pending_idx'),
+            # Active sessions without heartbeats for a while, closed by the closing_of_idle_reading_sessions task
+            models.Index(fields=['last_seen'], condition=models.Q(end_time__isnull=True),
+                         name='reading_session_idle_idx'),
+            # Sessions changed since the previous reconciliation of the statistics
+            models.Index(fields=['updated_at'], name='reading_session_updated_idx'),
+        ]
+
+
+class ArchivedReadingSession(models.Model):
+    """
+    A finished reading session older than the retention window, moved out of ReadingSession
+    by the archivereadingsessions command. Their reading time stays in the statistics.
+    The table is created by a migration: on PostgreSQL it is partitioned by month of start_time,
+    so it has no foreign keys and its primary key is (id, start_time).
+    """
+    # The id of the session in ReadingSession
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    duration = models.DurationField()
+
+    class Meta:
+        managed = False
+        db_table = 'book_reading_archived_reading_session'
+        indexes = [
+            models.Index(fields=['user', 'start_time'], name='archived_session_user_idx'),
+        ]
 
 
 class ReadingStatistics(models.Model):
@@ -25,10 +101,53 @@ class ReadingStatistics(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     total_reading_time = models.DurationField(default=timedelta())
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'],
+                                    name='unique_reading_statistics'),
+        ]
+
+
+class BookStatistics(models.Model):
+    """
+    Reading of a book by all users, updated together with the statistics of the users,
+    so the popularity of a book is read without aggregating ReadingStatistics
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='statistics')
+    total_reading_time = models.DurationField(default=timedelta())
+    readers_count = models.IntegerField(default=0)
+    sessions_count = models.IntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
 
 class UserStatistics(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE,
                                 related_name='statistics')
     total_reading_time = models.DurationField(default=timedelta())
-    last_7_days_reading_time = models.DurationField(default=timedelta())
-    last_30_days_reading_time = models.DurationField(default=timedelta())
+
+
+class DailyReadingStatistics(models.Model):
+    """Reading time of a user for a specific book per day (Europe/Kiev)"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    reading_time = models.DurationField(default=timedelta())
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book', 'date'],
+                                    name='unique_daily_reading_statistics'),
+        ]
+        indexes = [
+            # Reading time of a user for the last days, served from the index only
+            models.Index(fields=['user', 'date'], include=['reading_time'],
+                         name='daily_reading_user_date_idx'),
+        ]
+
+
+class ReconciliationCheckpoint(models.Model):
+    """
+    The start time of the last completed reconciliation of the reading statistics, see reconciliation.
+    The table has one row, kept in the database so the checkpoint is not lost with the cache
+    """
+    started_at = models.DateTimeField()
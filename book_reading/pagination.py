@@ -0,0 +1,13 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class BookCursorPagination(CursorPagination):
+    """
+    Keyset pagination of books by id.
+    Every page is a single index range scan, no matter how deep it is.
+    """
+    ordering = 'id'
+    page_size = settings.BOOKS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.BOOKS_MAX_PAGE_SIZE
@@ -0,0 +1,251 @@
+"""
+Rankings of readers and books by reading time for the current week and month.
+
+Rankings are kept in sorted sets, which are updated incrementally when reading time
+is added to the statistics, so top-N and rank queries take logarithmic time instead
+of a GROUP BY over all statistics. Redis is used when RANKINGS_REDIS_URL is set,
+otherwise the rankings are kept in the memory of the process (e.g. for tests).
+The rankings have no other copy until they are rebuilt, so the Redis of the rankings
+must not evict keys (maxmemory-policy noeviction), see docker-compose.yml.
+"""
+import bisect
+import datetime
+import logging
+import threading
+import uuid
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+READERS = 'readers'
+BOOKS = 'books'
+PERIODS = ('week', 'month')
+KEY_PREFIX = 'rankings:'
+# Rebuilt rankings are written under this prefix and renamed at once when they are complete
+REBUILD_KEY_PREFIX = 'rankings-rebuild:'
+REBUILD_TIMEOUT = 24 * 60 * 60
+
+
+def period_label(period: str, date: datetime.date) -> str:
+    """Returns the label of the week or month containing the date, e.g. 2023-W05 or 2023-01"""
+    if period == 'week':
+        year, week, _ = date.isocalendar()
+        return f'{year}-W{week:02d}'
+    return f'{date.year}-{date.month:02d}'
+
+
+def _period_end(period: str, date: datetime.date) -> datetime.date:
+    """Returns the day after the week or month containing the date"""
+    if period == 'week':
+        return date + datetime.timedelta(days=7 - date.weekday())
+    return (date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def ranking_key(board: str, period: str, date: datetime.date) -> str:
+    return f'{KEY_PREFIX}{board}:{period}:{period_label(period, date)}'
+
+
+class LocalRankings:
+    """
+    Rankings in the memory of the process, every process has its own, so it is only meant
+    for tests and development. Members are kept in a list sorted by score, so a rank is found
+    by binary search, but a changed score is moved in the list in linear time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores = {}
+            self._sorted = {}
+            self._expire_at = {}
+
+    def increment(self, increments: dict, expire_at: dict) -> None:
+        """
+        Adds scores to members of the rankings and sets the expiration time of the rankings.
+        increments is a dict {(key, member): score}, expire_at is a dict {key: unix timestamp}.
+        """
+        with self._lock:
+            self._remove_expired()
+            for (key, member), score in increments.items():
+                scores = self._scores.setdefault(key, {})
+                ranking = self._sorted.setdefault(key, [])
+                if member in scores:
+                    del ranking[bisect.bisect_left(ranking, (-scores[member], member))]
+                scores[member] = scores.get(member, 0) + score
+                bisect.insort(ranking, (-scores[member], member))
+            self._expire_at.update(expire_at)
+
+    def top(self, key: str, limit: int) -> list:
+        """Returns [(member, score)] of the members with the highest scores"""
+        with self._lock:
+            return [(member, -score) for score, member in self._sorted.get(key, [])[:limit]]
+
+    def rank(self, key: str, member: int):
+        """Returns (rank starting from 1, score) of a member, or None if it is not ranked"""
+        with self._lock:
+            score = self._scores.get(key, {}).get(member)
+            if score is None:
+                return None
+            return bisect.bisect_left(self._sorted[key], (-score, member)) + 1, score
+
+    def replace(self, changes) -> None:
+        """
+        Replaces all rankings with the ones built from changes, an iterable of the arguments
+        of increment. Readers see the old rankings until the new ones are complete.
+        """
+        rankings = LocalRankings()
+        for increments, expire_at in changes:
+            rankings.increment(increments, expire_at)
+        with self._lock:
+            self._scores, self._sorted, self._expire_at = rankings._scores, rankings._sorted, rankings._expire_at
+
+    def _remove_expired(self) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        for key in [key for key, expire_at in self._expire_at.items() if expire_at <= now]:
+            self._scores.pop(key, None)
+            self._sorted.pop(key, None)
+            del self._expire_at[key]
+
+
+class RedisRankings:
+    """Rankings in Redis sorted sets shared by all processes"""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def clear(self) -> None:
+        keys = list(self._redis.scan_iter(match=f'{KEY_PREFIX}*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def increment(self, increments: dict, expire_at: dict) -> None:
+        """See LocalRankings.increment, all changes are sent in one round trip"""
+        pipeline = self._redis.pipeline(transaction=False)
+        for (key, member), score in increments.items():
+            pipeline.zincrby(key, score, member)
+        for key, timestamp in expire_at.items():
+            pipeline.expireat(key, int(timestamp))
+        pipeline.execute()
+
+    def top(self, key: str, limit: int) -> list:
+        return [(int(member), score) for member, score in self._redis.zrevrange(key, 0, limit - 1, withscores=True)]
+
+    def rank(self, key: str, member: int):
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.zrevrank(key, member)
+        pipeline.zscore(key, member)
+        rank, score = pipeline.execute()
+        if rank is None:
+            return None
+        return rank + 1, score
+
+    def replace(self, changes) -> None:
+        """
+        See LocalRankings.replace. The rankings are built under temporary keys, which are renamed
+        to the rankings and the rankings which were not rebuilt are deleted in one transaction.
+        """
+        prefix = f'{REBUILD_KEY_PREFIX}{uuid.uuid4().hex}:'
+        expire_at = {}
+        try:
+            for increments, changes_expire_at in changes:
+                pipeline = self._redis.pipeline(transaction=False)
+                for (key, member), score in increments.items():
+                    pipeline.zincrby(f'{prefix}{key}', score, member)
+                for key in changes_expire_at:
+                    # The temporary keys of a failed rebuild are removed by Redis
+                    pipeline.expire(f'{prefix}{key}', REBUILD_TIMEOUT)
+                pipeline.execute()
+                expire_at.update(changes_expire_at)
+
+            stale_keys = [key for key in self._redis.scan_iter(match=f'{KEY_PREFIX}*') if key.decode() not in expire_at]
+            pipeline = self._redis.pipeline(transaction=True)
+            for key, timestamp in expire_at.items():
+                pipeline.rename(f'{prefix}{key}', key)
+                pipeline.expireat(key, int(timestamp))
+            if stale_keys:
+                pipeline.delete(*stale_keys)
+            pipeline.execute()
+        except Exception:
+            keys = list(self._redis.scan_iter(match=f'{prefix}*'))
+            if keys:
+                self._redis.delete(*keys)
+            raise
+
+
+_rankings = None
+
+
+def get_rankings():
+    """Returns the rankings storage configured by RANKINGS_REDIS_URL"""
+    global _rankings
+    if _rankings is None:
+        if settings.RANKINGS_REDIS_URL:
+            _rankings = RedisRankings(settings.RANKINGS_REDIS_URL)
+        else:
+            if not settings.DEBUG:
+                logger.warning('Rankings are kept in the memory of the process, set RANKINGS_REDIS_URL')
+            _rankings = LocalRankings()
+    return _rankings
+
+
+def _get_rankings_changes(daily_reading_time: dict) -> tuple:
+    """Returns the increments and the expiration times of the rankings, see LocalRankings.increment"""
+    increments = {}
+    expire_at = {}
+    for (user_id, book_id, date), reading_time in daily_reading_time.items():
+        seconds = reading_time.total_seconds()
+        for period in PERIODS:
+            for board, member in ((READERS, user_id), (BOOKS, book_id)):
+                key = ranking_key(board, period, date)
+                increments[(key, member)] = increments.get((key, member), 0) + seconds
+                # A ranking is kept for one more period, so the previous week or month can be read
+                expire_date = _period_end(period, _period_end(period, date))
+                expire_at[key] = timezone.make_aware(
+                    datetime.datetime.combine(expire_date, datetime.time())
+                ).timestamp()
+    return increments, expire_at
+
+
+def add_reading_time_to_rankings(daily_reading_time: dict) -> None:
+    """
+    Adds reading time to the rankings of readers and books of the weeks and months it belongs to.
+    daily_reading_time is a dict {(user_id, book_id, date): reading time}.
+    Rankings are derived data, so errors are logged instead of failing the request,
+    the rankings can be restored with the rebuildrankings command.
+    """
+    try:
+        get_rankings().increment(*_get_rankings_changes(daily_reading_time))
+    except Exception:
+        logger.exception('Reading time could not be added to the rankings')
+
+
+def replace_rankings(daily_reading_statistics, chunk_size: int = 10000) -> int:
+    """
+    Replaces all rankings with the reading time of daily_reading_statistics,
+    an iterable of (user_id, book_id, date, reading time).
+    The rankings are replaced at once when the new ones are complete, reading time added
+    to the old rankings meanwhile is only kept if it is in daily_reading_statistics.
+    Returns the number of added rows.
+    """
+    count = 0
+
+    def iter_changes():
+        nonlocal count
+        chunk = {}
+        for user_id, book_id, date, reading_time in daily_reading_statistics:
+            chunk[(user_id, book_id, date)] = reading_time
+            count += 1
+            if len(chunk) >= chunk_size:
+                yield _get_rankings_changes(chunk)
+                chunk = {}
+        if chunk:
+            yield _get_rankings_changes(chunk)
+
+    get_rankings().replace(iter_changes())
+    return count
@@ -0,0 +1,203 @@
+"""
+Reconciliation of the denormalized reading statistics.
+
+The total reading time of users, their reading time of every book and the statistics
+of books are running sums updated when sessions end, so a lost update leaves them wrong
+for good. The reconciliation recomputes them from the finished and the archived sessions,
+compares them with the stored rows and repairs the differences.
+
+An incremental run only checks the users with sessions changed (by updated_at) since the
+checkpoint of the previous run, and the books they read. Users and books are checked in
+chunks, every chunk in its own transaction with its statistics rows locked, so sessions
+ended meanwhile wait for the chunk instead of being counted twice or not at all.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction, IntegrityError
+from django.db.models import Sum
+
+from .cache import invalidate_statistics_cache, invalidate_books_statistics_cache
+from .models import ReadingSession, ArchivedReadingSession, ReadingStatistics, UserStatistics, BookStatistics, \
+    ReconciliationCheckpoint
+from .services import compute_book_statistics
+
+BOOK_STATISTICS_FIELDS = ['total_reading_time', 'readers_count', 'sessions_count', 'last_read_at']
+
+
+def _iter_chunks(queryset, field: str, chunk_size: int):
+    """Yields the distinct values of an integer field of the queryset in ascending chunks"""
+    values = queryset.order_by(field).values_list(field, flat=True).distinct()
+    last_value = 0
+    while True:
+        chunk = list(values.filter(**{f'{field}__gt': last_value})[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_value = chunk[-1]
+
+
+def _compute_reading_time(user_ids: list) -> dict:
+    """Returns {(user_id, book_id): reading time} of the sessions of users which is added to the statistics"""
+    sessions = [ReadingSession.objects.filter(user_id__in=user_ids, end_time__isnull=False, statistics_applied=True),
+                ArchivedReadingSession.objects.filter(user_id__in=user_ids)]
+    reading_time = {}
+    for queryset in sessions:
+        for user_id, book_id, duration in queryset.order_by().values('user_id', 'book_id').annotate(
+            duration=Sum('duration'),
+        ).values_list('user_id', 'book_id', 'duration'):
+            reading_time[(user_id, book_id)] = reading_time.get((user_id, book_id), datetime.timedelta()) + duration
+    return reading_time
+
+
+def _create_rows(model, rows: list) -> int:
+    """
+    Creates the rows with one query, or one by one if some of them were created meanwhile.
+    Rows created by sessions ended meanwhile are skipped. Their users have sessions changed
+    after the start of the run, so they are checked by the next run.
+    Returns the number of created rows.
+    """
+    if not rows:
+        return 0
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(rows)
+        return len(rows)
+    except IntegrityError:
+        created = 0
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([row])
+                created += 1
+            except IntegrityError:
+                pass
+        return created
+
+
+def _repair(model, stored: dict, expected: dict, key_fields: tuple) -> tuple:
+    """
+    Sets total_reading_time of the stored rows {key: row} to the expected values {key: reading time}.
+    Rows which do not exist are created, unless nothing was read.
+    Returns (the number of repaired rows, the corrected reading time).
+    """
+    rows_to_update, rows_to_create = [], []
+    corrected = datetime.timedelta()
+    for key in stored.keys() | expected.keys():
+        reading_time = expected.get(key, datetime.timedelta())
+        row = stored.get(key)
+        if row is None:
+            if reading_time:
+                rows_to_create.append(model(total_reading_time=reading_time, **dict(zip(key_fields, key))))
+                corrected += reading_time
+        elif row.total_reading_time != reading_time:
+            corrected += abs(row.total_reading_time - reading_time)
+            row.total_reading_time = reading_time
+            rows_to_update.append(row)
+
+    model.objects.bulk_update(rows_to_update, ['total_reading_time'])
+    return len(rows_to_update) + _create_rows(model, rows_to_create), corrected
+
+
+def reconcile_users_statistics(user_ids: list) -> dict:
+    """
+    Repairs the book reading statistics and the total reading time of users.
+    Returns the numbers of repaired rows, the corrected reading time of both and the ids of the books
+    read by the users.
+    """
+    with transaction.atomic():
+        # Locked in the same order as when a session is ended
+        reading_statistics = {
+            (row.user_id, row.book_id): row for row in ReadingStatistics.objects.select_for_update().filter(
+                user_id__in=user_ids
+            ).order_by('id').only('id', 'user_id', 'book_id', 'total_reading_time')
+        }
+        user_statistics = {
+            (row.user_id,): row for row in UserStatistics.objects.select_for_update().filter(
+                user_id__in=user_ids
+            ).order_by('id').only('id', 'user_id', 'total_reading_time')
+        }
+        books_reading_time = _compute_reading_time(user_ids)
+        users_reading_time = {}
+        for (user_id, _), reading_time in books_reading_time.items():
+            users_reading_time[(user_id,)] = users_reading_time.get((user_id,), datetime.timedelta()) + reading_time
+
+        repaired_reading_statistics, books_corrected = _repair(ReadingStatistics, reading_statistics,
+                                                               books_reading_time, ('user_id', 'book_id'))
+        repaired_user_statistics, users_corrected = _repair(UserStatistics, user_statistics,
+                                                            users_reading_time, ('user_id',))
+        if repaired_reading_statistics or repaired_user_statistics:
+            transaction.on_commit(lambda: invalidate_statistics_cache(user_ids))
+
+    return {
+        'reading_statistics': repaired_reading_statistics,
+        'user_statistics': repaired_user_statistics,
+        'reading_time_corrected': books_corrected,
+        'total_reading_time_corrected': users_corrected,
+        'book_ids': {book_id for _, book_id in reading_statistics.keys() | books_reading_time.keys()},
+    }
+
+
+def reconcile_books_statistics(book_ids: list) -> int:
+    """Repairs the reading statistics of books, see services.compute_book_statistics. Returns the repaired rows"""
+    with transaction.atomic():
+        # Locked last, as when a session is ended
+        stored = BookStatistics.objects.select_for_update().order_by('id').in_bulk(book_ids, field_name='book_id')
+        expected = compute_book_statistics(book_ids)
+        rows_to_update, rows_to_create = [], []
+        for book_id in stored.keys() | expected.keys():
+            # Books nobody has read any more, e.g. after their sessions were removed, get empty statistics
+            statistics = expected.get(book_id) or BookStatistics(book_id=book_id)
+            row = stored.get(book_id)
+            if row is None:
+                rows_to_create.append(statistics)
+            elif any(getattr(row, field) != getattr(statistics, field) for field in BOOK_STATISTICS_FIELDS):
+                statistics.id = row.id
+                rows_to_update.append(statistics)
+
+        BookStatistics.objects.bulk_update(rows_to_update, BOOK_STATISTICS_FIELDS)
+        if rows_to_update or rows_to_create:
+            transaction.on_commit(lambda: invalidate_books_statistics_cache(
+                [statistics.book_id for statistics in rows_to_update + rows_to_create]))
+        return len(rows_to_update) + _create_rows(BookStatistics, rows_to_create)
+
+
+def reconcile_reading_statistics(full: bool = False, chunk_size: int = None, log=print) -> dict:
+    """
+    Checks the statistics of the users with sessions changed since the checkpoint of the previous run,
+    or of all users if full is set or there is no checkpoint, and repairs the wrong ones.
+    The checkpoint is moved to the start of the run when it completes.
+    Returns the numbers of checked users and books, of repaired rows of every model and the corrected reading time
+    of users per book and in total.
+    """
+    chunk_size = chunk_size or settings.RECONCILIATION_CHUNK_SIZE
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    checkpoint = None if full else ReconciliationCheckpoint.objects.values_list('started_at', flat=True).first()
+    if checkpoint is None:
+        users = User.objects.all()
+        user_field = 'id'
+    else:
+        users = ReadingSession.objects.filter(
+            updated_at__gte=checkpoint - datetime.timedelta(seconds=settings.RECONCILIATION_CHECKPOINT_OVERLAP)
+        )
+        user_field = 'user_id'
+
+    report = {'users': 0, 'books': 0, 'reading_statistics': 0, 'user_statistics': 0, 'book_statistics': 0,
+              'reading_time_corrected': datetime.timedelta(), 'total_reading_time_corrected': datetime.timedelta()}
+    book_ids = set()
+    for user_ids in _iter_chunks(users, user_field, chunk_size):
+        result = reconcile_users_statistics(user_ids)
+        book_ids |= result.pop('book_ids')
+        for key, value in result.items():
+            report[key] += value
+        report['users'] += len(user_ids)
+        log(f'Checked {report["users"]} users')
+
+    book_ids = sorted(book_ids)
+    for start in range(0, len(book_ids), chunk_size):
+        report['book_statistics'] += reconcile_books_statistics(book_ids[start:start + chunk_size])
+    report['books'] = len(book_ids)
+
+    ReconciliationCheckpoint.objects.update_or_create(id=1, defaults={'started_at': started_at})
+    return report
@@ -0,0 +1,93 @@
+"""
+Full-text search over the book catalogue.
+
+On PostgreSQL every book has a search_vector (a weighted tsvector of its title, author
+and descriptions) with a GIN index, and authors have a trigram GIN index for fuzzy
+matches, so a search is served from the indexes. The indexes are created by the migrations,
+the vectors are computed by Book.save and can be rebuilt with the rebuildsearchindex command.
+Other databases (e.g. SQLite in tests) fall back to case-insensitive substring matches.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Count, F, Q, Value
+
+from .models import Book
+from .serializers import BookWithoutFullDescriptionSerializer
+from .services import books_with_statistics
+
+SEARCH_CONFIG = 'english'
+SEARCH_WEIGHTS = {'title': 'A', 'author': 'A', 'short_description': 'B', 'full_description': 'C'}
+
+
+def book_search_vector(book=None):
+    """
+    Returns the search vector of the fields of a book, so it is saved with the book,
+    or of the columns of the updated rows if book is None
+    """
+    vectors = [SearchVector(Value(getattr(book, field)) if book else field, weight=weight, config=SEARCH_CONFIG)
+               for field, weight in SEARCH_WEIGHTS.items()]
+    return sum(vectors[1:], vectors[0])
+
+
+def update_search_vectors(book_ids=None, chunk_size: int = 10000) -> int:
+    """
+    Updates the search vectors of the books with book_ids, or of all books in chunks of ids
+    (PostgreSQL only). Returns the number of updated books.
+    """
+    if connection.vendor != 'postgresql':
+        return 0
+    if book_ids is not None:
+        return Book.objects.filter(id__in=book_ids).update(search_vector=book_search_vector())
+
+    updated = 0
+    last_id = 0
+    while True:
+        ids = list(Book.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return updated
+        updated += Book.objects.filter(id__in=ids).update(search_vector=book_search_vector())
+        last_id = ids[-1]
+
+
+def _filter_matching_books(text: str):
+    """Returns the books matching the text"""
+    if connection.vendor != 'postgresql':
+        return books_with_statistics().filter(
+            Q(title__icontains=text) | Q(author__icontains=text)
+            | Q(short_description__icontains=text) | Q(full_description__icontains=text)
+        )
+    return books_with_statistics().filter(
+        Q(search_vector=SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch'))
+        | Q(author__trigram_similar=text)
+    )
+
+
+def _order_by_relevance(books, text: str):
+    if connection.vendor != 'postgresql':
+        return books.order_by('id')
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    return books.annotate(
+        rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('author', text)
+    ).order_by('-rank', 'id')
+
+
+def search_books(text: str, year_published=None, limit: int = 20, offset: int = 0) -> dict:
+    """
+    Returns a page of the books matching the text ordered by relevance, the number of matches
+    and the number of matches per year of publication. The facets are not filtered by year_published,
+    so all years can be offered to the user. Two queries are made: the facets and the page.
+    """
+    books = _filter_matching_books(text)
+    years = list(books.values('year_published').annotate(count=Count('id')).order_by('-year_published'))
+    if year_published is not None:
+        books = books.filter(year_published=year_published)
+        count = sum(year['count'] for year in years if year['year_published'] == year_published)
+    else:
+        count = sum(year['count'] for year in years)
+
+    page = _order_by_relevance(books, text)[offset:offset + limit]
+    return {
+        'count': count,
+        'results': [dict(book) for book in BookWithoutFullDescriptionSerializer(page, many=True).data],
+        'facets': {'year_published': [{'value': year['year_published'], 'count': year['count']} for year in years]},
+    }
@@ -1,17 +1,110 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Book
+from .models import Book, BookStatistics
+
+# Columns of Book sent by BookWithoutFullDescriptionSerializer, e.g. for QuerySet.only()
+BOOK_LIST_FIELDS = ['id', 'title', 'author', 'year_published', 'short_description']
+
+
+class BookStatisticsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BookStatistics
+        fields = ['total_reading_time', 'readers_count', 'sessions_count', 'last_read_at']
+
 
+class BookStatisticsMixin(serializers.Serializer):
+    """
+    Adds the reading statistics of a book by all users.
+    Books should be loaded with select_related('statistics'), so no query is made.
+    """
+    statistics = serializers.SerializerMethodField()
 
-class BookSerializer(serializers.ModelSerializer):
+    def get_statistics(self, book):
+        # A book nobody has read yet has no statistics
+        return BookStatisticsSerializer(getattr(book, 'statistics', None) or BookStatistics()).data
+
+
+class BookSerializer(BookStatisticsMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'year_published',
-                  'short_description', 'full_description']
+        fields = BOOK_LIST_FIELDS + ['full_description', 'statistics']
 
 
-class BookWithoutFullDescriptionSerializer(serializers.ModelSerializer):
+class BookWithoutFullDescriptionSerializer(BookStatisticsMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'year_published',
-                  'short_description']
+        fields = BOOK_LIST_FIELDS + ['statistics']
+
+
+class FinishedReadingSessionSerializer(serializers.Serializer):
+    """A reading session recorded by a client offline"""
+    book_id = serializers.IntegerField()
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['end_time'] <= data['start_time']:
+            raise serializers.ValidationError('The session must end after it starts')
+        if data['end_time'] > timezone.now():
+            raise serializers.ValidationError('The session cannot end in the future')
+        # Older sessions could overlap archived sessions, which are not checked
+        if data['start_time'] < timezone.now() - timedelta(days=settings.READING_SESSIONS_RETENTION_DAYS):
+            raise serializers.ValidationError(
+                f'Sessions older than {settings.READING_SESSIONS_RETENTION_DAYS} days cannot be uploaded'
+            )
+        return data
+
+
+class ReadingPeriodSerializer(serializers.Serializer):
+    """An additional period of the user statistics: the last days and/or hours"""
+    days = serializers.IntegerField(required=False, min_value=1, max_value=settings.STATISTICS_MAX_PERIOD_DAYS)
+    hours = serializers.IntegerField(required=False, min_value=1, max_value=settings.STATISTICS_MAX_PERIOD_DAYS * 24)
+
+
+class BookSearchSerializer(serializers.Serializer):
+    """The text, the year filter and the page of a book search"""
+    q = serializers.CharField(max_length=200)
+    year_published = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=settings.BOOK_SEARCH_MAX_LIMIT)
+    offset = serializers.IntegerField(default=0, min_value=0, max_value=settings.BOOK_SEARCH_MAX_OFFSET)
+
+
+class BookIdsSerializer(serializers.Serializer):
+    """Comma separated ids of books, e.g. ids=1,2,3"""
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            book_ids = [int(book_id) for book_id in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError('Book ids must be comma separated integers')
+        if len(book_ids) > settings.BOOK_STATISTICS_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'No more than {settings.BOOK_STATISTICS_BATCH_MAX_SIZE} books can be requested at once'
+            )
+        return book_ids
+
+
+class RankingSerializer(serializers.Serializer):
+    """The period and the number of places of a ranking"""
+    period = serializers.ChoiceField(choices=['week', 'month'], default='week')
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=settings.RANKINGS_MAX_LIMIT)
+
+
+class ReadingSessionsExportSerializer(serializers.Serializer):
+    """The format and the filters of an export of the reading history"""
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    book_id = serializers.IntegerField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    # Adds the duration in the format of the statistics
+    human_readable = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError('date_from must not be after date_to')
+        return data
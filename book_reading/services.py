@@ -1,54 +1,418 @@
 import datetime
 import pytz
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
 
-from django.db.models import Sum
-
-from .models import ReadingSession, ReadingStatistics, UserStatistics, Book
-from .serializers import BookWithoutFullDescriptionSerializer
+from django.db import transaction, IntegrityError, connection
+from django.db.models import Sum, Q, F, Subquery, FilteredRelation, Count, Max
+
+from .models import ReadingSession, ReadingStatistics, UserStatistics, Book, DailyReadingStatistics, \
+    ArchivedReadingSession, BookStatistics
+from .heartbeats import get_heartbeats
+from .cache import get_or_set_books_cache, book_details_cache_key, get_or_set_user_total_reading_time_cache, \
+    get_or_set_book_reading_statistics_cache, invalidate_statistics_cache, invalidate_books_statistics_cache, \
+    get_or_set_reading_time_for_periods_cache, aget_or_set_books_cache, aget_or_set_user_total_reading_time_cache, \
+    aget_or_set_reading_time_for_periods_cache, aget_or_set_book_reading_statistics_cache
+from .rankings import add_reading_time_to_rankings, get_rankings, ranking_key, period_label, replace_rankings, \
+    READERS, BOOKS
+from .serializers import BookSerializer, BookWithoutFullDescriptionSerializer, BookStatisticsSerializer, \
+    BOOK_LIST_FIELDS
 
 KIEV_TZ = pytz.timezone('Europe/Kiev')
 
+USER_STATISTICS_PERIODS = {
+    'last_7_days_reading_time': datetime.timedelta(days=7),
+    'last_30_days_reading_time': datetime.timedelta(days=30),
+}
+
 
-def _get_user(user):
+def _get_user_id(user) -> int:
     if type(user) == int:
-        user = User.objects.get(id=user)
-    return user
+        return user
+    return user.id
 
 
-def _end_active_reading_session(user) -> None:
+def _get_active_reading_session(user_id: int):
+    """
+    Returns the active reading session of a user locked for update, or None.
+    Must be called inside a transaction.
+    """
+    return ReadingSession.objects.select_for_update().filter(
+        user_id=user_id, end_time__isnull=True
+    ).only('id', 'book_id', 'start_time').first()
+
+
+def _end_active_reading_session(user_id: int, active_session) -> None:
     """
     The function ends the book reading session,
     updates book reading statistics and general user statistics.
     """
-    active_session = ReadingSession.objects.filter(user=user, end_time__isnull=True).first()
-    book = active_session.book
-    active_session.end_time = datetime.datetime.now(KIEV_TZ)
-    active_session.duration = active_session.end_time - active_session.start_time
-    active_session.save()
+    end_time = datetime.datetime.now(KIEV_TZ)
+    duration = end_time - active_session.start_time
+
+    if settings.STATISTICS_UPDATE_MODE == 'async':
+        # Statistics are updated in batches by the batch_update_of_reading_statistics task
+        ReadingSession.objects.filter(id=active_session.id).update(end_time=end_time, duration=duration,
+                                                                   statistics_applied=False, updated_at=end_time)
+        transaction.on_commit(_schedule_batch_update_of_reading_statistics)
+        return
+
+    ReadingSession.objects.filter(id=active_session.id).update(end_time=end_time, duration=duration,
+                                                               updated_at=end_time)
+
+    new_reader = _update_book_reading_statistics(user_id=user_id, book_id=active_session.book_id, duration=duration)
+    _update_general_user_statistics(user_id=user_id, duration=duration)
+    _update_daily_reading_statistics(user_id=user_id, book_id=active_session.book_id,
+                                     start_time=active_session.start_time, end_time=end_time)
+    _update_books_statistics({active_session.book_id: (duration, 1, int(new_reader), end_time)})
+    transaction.on_commit(lambda: invalidate_statistics_cache([user_id]))
 
-    _update_book_reading_statistics(user=user, book=book, duration=active_session.duration)
-    _update_general_user_statistics(user=user, duration=active_session.duration)
 
+def _schedule_batch_update_of_reading_statistics() -> None:
+    # Imported here, as the tasks module imports this one
+    from .tasks import schedule_batch_update_of_reading_statistics
+    schedule_batch_update_of_reading_statistics()
 
-def _update_general_user_statistics(user, duration) -> None:
+
+def _upsert_statistics(model, key_fields: tuple, rows: dict, added_fields: tuple, latest_fields: tuple = (),
+                       batch_size: int = 1000) -> set:
+    """
+    Adds rows {key: values} to the statistics rows found by key (values of key_fields), creating the missing
+    rows, with one INSERT ... ON CONFLICT DO UPDATE query per batch_size rows, which PostgreSQL and SQLite support.
+    values are the values of added_fields, which are added to the stored values, followed by the values
+    of latest_fields, which replace the stored values if they are later (bulk_create(update_conflicts=True)
+    would replace all of them). Rows are written in the order of their keys, so concurrent callers lock them
+    in the same order.
+    Returns the keys of the rows whose first added field was zero before, including the created rows.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in (*key_fields, *added_fields, *latest_fields)]
+    columns = [quote_name(field.column) for field in fields]
+    key_columns = columns[:len(key_fields)]
+    added_columns = columns[len(key_fields):len(key_fields) + len(added_fields)]
+    latest_columns = columns[len(key_fields) + len(added_fields):]
+    updates = [f'{column} = {table}.{column} + EXCLUDED.{column}' for column in added_columns] + [
+        f'{column} = CASE WHEN {table}.{column} IS NULL OR {table}.{column} < EXCLUDED.{column} '
+        f'THEN EXCLUDED.{column} ELSE {table}.{column} END' for column in latest_columns
+    ]
+
+    zero_keys = set()
+    keys = sorted(rows)
+    for start in range(0, len(keys), batch_size):
+        batch = {key: [field.get_db_prep_value(value, connection) for field, value in zip(fields, (*key, *rows[key]))]
+                 for key in keys[start:start + batch_size]}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'VALUES {", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(batch))} '
+                f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {", ".join(updates)} '
+                f'RETURNING {", ".join(key_columns)}, {added_columns[0]}',
+                [value for values in batch.values() for value in values],
+            )
+            returned = cursor.fetchall()
+        for *db_key, value in returned:
+            key = tuple(field.to_python(key_value) for field, key_value in zip(fields, db_key))
+            # The stored value was zero if the new one equals the added one
+            if value == batch[key][len(key_fields)]:
+                zero_keys.add(key)
+    return zero_keys
+
+
+def _update_books_statistics(books_reading: dict) -> None:
+    """
+    Adds reading of books {book_id: reading} to their statistics, creating the missing statistics.
+    reading is a tuple (reading time, number of sessions, number of new readers, time of the last reading).
+    """
+    # The statistics are sent with the cached books
+    transaction.on_commit(lambda: invalidate_books_statistics_cache(list(books_reading)))
+    _upsert_statistics(BookStatistics, ('book_id',),
+                       {(book_id,): reading for book_id, reading in books_reading.items()},
+                       ('total_reading_time', 'sessions_count', 'readers_count'), ('last_read_at',))
+
+
+def _apply_reading_sessions_statistics(sessions: list) -> None:
+    """
+    Adds the reading time of finished sessions to the book reading statistics,
+    general user statistics and daily statistics with a few bulk queries.
+    sessions is a list of dicts with user_id, book_id, start_time and end_time.
+    Must be called inside a transaction.
+    """
+    books_reading_time = {}
+    users_reading_time = {}
+    daily_reading_time = {}
+    books_sessions = {}
+    for session in sessions:
+        user_id, book_id = session['user_id'], session['book_id']
+        duration = session['end_time'] - session['start_time']
+        sessions_count, last_read_at = books_sessions.get(book_id, (0, session['end_time']))
+        books_sessions[book_id] = (sessions_count + 1, max(last_read_at, session['end_time']))
+        books_reading_time[(user_id, book_id)] = books_reading_time.get((user_id, book_id),
+                                                                        datetime.timedelta()) + duration
+        users_reading_time[(user_id,)] = users_reading_time.get((user_id,), datetime.timedelta()) + duration
+        for date, reading_time in split_reading_time_by_days(session['start_time'], session['end_time']):
+            key = (user_id, book_id, date)
+            daily_reading_time[key] = daily_reading_time.get(key, datetime.timedelta()) + reading_time
+
+    # Statistics are locked in the same order as when a session is ended.
+    # A reader is new when the reading time of the book was zero, see _update_book_reading_statistics
+    new_readers = {key for key in _upsert_statistics(
+        ReadingStatistics, ('user_id', 'book_id'),
+        {key: (reading_time,) for key, reading_time in books_reading_time.items()}, ('total_reading_time',)
+    ) if books_reading_time[key]}
+    _upsert_statistics(UserStatistics, ('user_id',),
+                       {key: (reading_time,) for key, reading_time in users_reading_time.items()},
+                       ('total_reading_time',))
+    _upsert_statistics(DailyReadingStatistics, ('user_id', 'book_id', 'date'),
+                       {key: (reading_time,) for key, reading_time in daily_reading_time.items()}, ('reading_time',))
+
+    books_reading = {}
+    for (user_id, book_id), reading_time in books_reading_time.items():
+        previous_reading_time, readers_count = books_reading.get(book_id, (datetime.timedelta(), 0))
+        books_reading[book_id] = (previous_reading_time + reading_time,
+                                  readers_count + ((user_id, book_id) in new_readers))
+    _update_books_statistics({
+        book_id: (reading_time, books_sessions[book_id][0], readers_count, books_sessions[book_id][1])
+        for book_id, (reading_time, readers_count) in books_reading.items()
+    })
+
+    def update_statistics_cache():
+        invalidate_statistics_cache({user_id for user_id, _ in books_reading_time})
+        add_reading_time_to_rankings(daily_reading_time)
+
+    transaction.on_commit(update_statistics_cache)
+
+
+def apply_pending_reading_statistics(batch_size: int) -> int:
+    """
+    Adds the reading time of sessions ended in the async statistics mode to the statistics.
+    Sessions are processed in one transaction and marked as applied in it,
+    so a repeated or concurrent call never applies a session twice.
+    Returns the number of processed sessions.
+    """
+    with transaction.atomic():
+        sessions = list(ReadingSession.objects.select_for_update(skip_locked=True).filter(
+            end_time__isnull=False, statistics_applied=False
+        ).order_by('id').values('id', 'user_id', 'book_id', 'start_time', 'end_time')[:batch_size])
+        if sessions:
+            _apply_reading_sessions_statistics(sessions)
+            ReadingSession.objects.filter(id__in=[session['id'] for session in sessions]).update(
+                statistics_applied=True, updated_at=datetime.datetime.now(datetime.timezone.utc)
+            )
+    return len(sessions)
+
+
+def record_reading_session_heartbeat(user) -> dict:
+    """
+    Stores the time of a heartbeat of the user's active session.
+    It is saved to the database later by flush_reading_session_heartbeats, so no queries are made.
+    """
+    get_heartbeats().record(_get_user_id(user), datetime.datetime.now(datetime.timezone.utc).timestamp())
+    return {'message': 'Heartbeat received'}
+
+
+def flush_reading_session_heartbeats(batch_size: int) -> int:
+    """
+    Saves the stored heartbeats to the last_seen field of the active sessions,
+    with two queries per batch_size users. Heartbeats older than the start of the session are ignored.
+    Heartbeats which could not be saved are stored again for the next flush.
+    Returns the number of updated sessions.
+    """
+    heartbeats = get_heartbeats()
+    last_seen = heartbeats.pop_all()
+    user_ids = list(last_seen)
+    updated = 0
+    for i in range(0, len(user_ids), batch_size):
+        try:
+            sessions = []
+            for session in ReadingSession.objects.filter(
+                user_id__in=user_ids[i:i + batch_size], end_time__isnull=True
+            ).only('id', 'user_id', 'start_time'):
+                session.last_seen = datetime.datetime.fromtimestamp(last_seen[session.user_id],
+                                                                    datetime.timezone.utc)
+                if session.last_seen > session.start_time:
+                    sessions.append(session)
+            ReadingSession.objects.bulk_update(sessions, ['last_seen'])
+        except Exception:
+            heartbeats.restore({user_id: last_seen[user_id] for user_id in user_ids[i:]})
+            raise
+        updated += len(sessions)
+    return updated
+
+
+def close_idle_reading_sessions(batch_size: int) -> int:
+    """
+    Ends active sessions without heartbeats for READING_SESSION_IDLE_TIMEOUT seconds at their last heartbeat,
+    and sessions which never sent a heartbeat after READING_SESSION_MAX_DURATION seconds at their start,
+    so abandoned sessions do not add the time after the user stopped reading.
+    Their reading time is added to the statistics in bulk. Returns the number of closed sessions.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with transaction.atomic():
+        sessions = list(ReadingSession.objects.select_for_update(skip_locked=True).filter(
+            Q(last_seen__lt=now - datetime.timedelta(seconds=settings.READING_SESSION_IDLE_TIMEOUT)) |
+            Q(last_seen__isnull=True,
+              start_time__lt=now - datetime.timedelta(seconds=settings.READING_SESSION_MAX_DURATION)),
+            end_time__isnull=True,
+        ).order_by('id').values('id', 'user_id', 'book_id', 'start_time', 'last_seen')[:batch_size])
+        for session in sessions:
+            session['end_time'] = session['last_seen'] or session['start_time']
+
+        ReadingSession.objects.bulk_update([
+            ReadingSession(id=session['id'], end_time=session['end_time'],
+                           duration=session['end_time'] - session['start_time'], updated_at=now)
+            for session in sessions
+        ], ['end_time', 'duration', 'updated_at'])
+        _apply_reading_sessions_statistics([session for session in sessions
+                                            if session['end_time'] > session['start_time']])
+    return len(sessions)
+
+
+def _update_general_user_statistics(user_id: int, duration) -> None:
     """Adds book reading time to the user's general statistics"""
-    try:
-        user_statistics = UserStatistics.objects.get(user=user)
-    except UserStatistics.DoesNotExist:
-        user_statistics = UserStatistics(user=user)
-    user_statistics.total_reading_time += duration
-    user_statistics.save()
+    _upsert_statistics(UserStatistics, ('user_id',), {(user_id,): (duration,)}, ('total_reading_time',))
 
 
-def _update_book_reading_statistics(user, book, duration) -> None:
-    """Adds the reading time to the user's statistics for a specific book"""
-    try:
-        reading_statistics = ReadingStatistics.objects.get(user=user, book=book)
-    except ReadingStatistics.DoesNotExist:
-        reading_statistics = ReadingStatistics(user=user, book=book)
-    reading_statistics.total_reading_time += duration
-    reading_statistics.save()
+def _update_book_reading_statistics(user_id: int, book_id: int, duration) -> bool:
+    """
+    Adds the reading time to the user's statistics for a specific book, returns True for a new reader.
+    A reader is new when the reading time of the book was zero, as earlier versions of
+    get_user_reading_statistics created the statistics of the books the user had not read yet.
+    """
+    zero_keys = _upsert_statistics(ReadingStatistics, ('user_id', 'book_id'), {(user_id, book_id): (duration,)},
+                                   ('total_reading_time',))
+    return bool(duration) and bool(zero_keys)
+
+
+def _update_daily_reading_statistics(user_id: int, book_id: int, start_time, end_time) -> None:
+    """
+    Adds the reading time of a session to the user's daily statistics for a specific book.
+    The rows of all days are written with one query.
+    """
+    daily_reading_time = {(user_id, book_id, date): reading_time
+                          for date, reading_time in split_reading_time_by_days(start_time, end_time)}
+    _upsert_statistics(DailyReadingStatistics, ('user_id', 'book_id', 'date'),
+                       {key: (reading_time,) for key, reading_time in daily_reading_time.items()}, ('reading_time',))
+    transaction.on_commit(lambda: add_reading_time_to_rankings(daily_reading_time))
+
+
+def split_reading_time_by_days(start_time, end_time) -> list:
+    """
+    Splits the time between start_time and end_time by days in the Europe/Kiev time zone.
+    Returns a list of (date, reading_time) pairs, days without reading time are skipped.
+    """
+    start_time = start_time.astimezone(KIEV_TZ)
+    end_time = end_time.astimezone(KIEV_TZ)
+
+    result = []
+    while start_time.date() < end_time.date():
+        next_day = start_time.date() + datetime.timedelta(days=1)
+        midnight = KIEV_TZ.localize(datetime.datetime.combine(next_day, datetime.time()))
+        result.append((start_time.date(), midnight - start_time))
+        start_time = midnight
+    if end_time > start_time:
+        result.append((end_time.date(), end_time - start_time))
+    return result
+
+
+def rebuild_daily_reading_statistics(chunk_size: int = 1000) -> int:
+    """
+    Rebuilds daily reading statistics of all users from the finished and the archived reading sessions
+    whose reading time is added to the statistics.
+    Users are rebuilt in chunks of chunk_size, so memory usage does not depend on the number of sessions.
+    Returns the number of created rows.
+    """
+    created = 0
+    last_user_id = 0
+    while True:
+        users = User.objects.filter(id__gt=last_user_id).order_by('id')
+        user_ids = list(users.values_list('id', flat=True)[:chunk_size])
+        if not user_ids:
+            return created
+        created += _rebuild_users_daily_reading_statistics(user_ids)
+        last_user_id = user_ids[-1]
+
+
+def _rebuild_users_daily_reading_statistics(user_ids: list) -> int:
+    """
+    Rebuilds daily reading statistics of users in one transaction, see rebuild_daily_reading_statistics.
+    The users and their active and pending sessions are locked first, as the reading time is added to daily
+    statistics by a bulk upload with the user locked, by ending a session with the session locked
+    and by the batch update with the pending sessions locked. So the reading time added meanwhile waits
+    for the rebuild instead of being counted twice or not at all. The users are locked without the key,
+    so the rows inserted with a reference to them do not wait for the rebuild while holding a session.
+    Returns the number of created rows.
+    """
+    with transaction.atomic():
+        list(User.objects.select_for_update(no_key=True).filter(id__in=user_ids).order_by('id').values_list('id'))
+        list(ReadingSession.objects.select_for_update().filter(
+            Q(end_time__isnull=True) | Q(statistics_applied=False), user_id__in=user_ids
+        ).order_by('id').values_list('id'))
+        DailyReadingStatistics.objects.filter(user_id__in=user_ids).delete()
+
+        # Sessions ended in the async statistics mode are added to the daily statistics when they are applied
+        sessions = ReadingSession.objects.filter(
+            user_id__in=user_ids, end_time__isnull=False, statistics_applied=True
+        ).values_list('user_id', 'book_id', 'start_time', 'end_time').union(
+            ArchivedReadingSession.objects.filter(user_id__in=user_ids).values_list(
+                'user_id', 'book_id', 'start_time', 'end_time'
+            ), all=True)
+
+        daily_reading_time = {}
+        for user_id, book_id, start_time, end_time in sessions.iterator(chunk_size=2000):
+            for date, reading_time in split_reading_time_by_days(start_time, end_time):
+                key = (user_id, book_id, date)
+                daily_reading_time[key] = daily_reading_time.get(key, datetime.timedelta()) + reading_time
+        DailyReadingStatistics.objects.bulk_create([
+            DailyReadingStatistics(user_id=user_id, book_id=book_id, date=date, reading_time=reading_time)
+            for (user_id, book_id, date), reading_time in daily_reading_time.items()
+        ], batch_size=2000)
+    return len(daily_reading_time)
+
+
+def compute_book_statistics(book_ids=None) -> dict:
+    """
+    Computes the reading statistics of books with book_ids, or of all books, from the book reading
+    statistics of users and the finished and the archived reading sessions whose reading time is added to them.
+    Returns {book_id: unsaved BookStatistics} of the books which have been read.
+    """
+    sessions = [ReadingSession.objects.filter(end_time__isnull=False, statistics_applied=True,
+                                              duration__gt=datetime.timedelta()),
+                ArchivedReadingSession.objects.filter(duration__gt=datetime.timedelta())]
+    # Statistics of a book with zero reading time do not make the user its reader
+    reading_statistics = ReadingStatistics.objects.filter(total_reading_time__gt=datetime.timedelta())
+    if book_ids is not None:
+        sessions = [queryset.filter(book_id__in=book_ids) for queryset in sessions]
+        reading_statistics = reading_statistics.filter(book_id__in=book_ids)
+
+    books_sessions = {}
+    for queryset in sessions:
+        for book_id, sessions_count, last_read_at in queryset.order_by().values('book_id').annotate(
+            sessions_count=Count('id'), last_read_at=Max('end_time'),
+        ).values_list('book_id', 'sessions_count', 'last_read_at'):
+            previous_count, previous_last_read_at = books_sessions.get(book_id, (0, last_read_at))
+            books_sessions[book_id] = (previous_count + sessions_count, max(previous_last_read_at, last_read_at))
+
+    statistics = {}
+    for book_id, total_reading_time, readers_count in reading_statistics.order_by().values('book_id').annotate(
+        reading_time=Sum('total_reading_time'), readers_count=Count('id'),
+    ).values_list('book_id', 'reading_time', 'readers_count'):
+        sessions_count, last_read_at = books_sessions.get(book_id, (0, None))
+        statistics[book_id] = BookStatistics(book_id=book_id, total_reading_time=total_reading_time,
+                                             readers_count=readers_count, sessions_count=sessions_count,
+                                             last_read_at=last_read_at)
+    return statistics
+
+
+def rebuild_book_statistics() -> int:
+    """Rebuilds the reading statistics of all books, see compute_book_statistics. Returns the number of created rows"""
+    statistics = compute_book_statistics()
+    book_ids = set(BookStatistics.objects.values_list('book_id', flat=True)) | statistics.keys()
+    BookStatistics.objects.all().delete()
+    BookStatistics.objects.bulk_create(statistics.values(), batch_size=2000)
+    transaction.on_commit(lambda: invalidate_books_statistics_cache(book_ids))
+    return len(statistics)
 
 
 def timedelta_to_string(timedelta) -> str:
@@ -64,50 +428,182 @@ def timedelta_to_string(timedelta) -> str:
     return result
 
 
+def _first_day_of_period(days: int) -> datetime.date:
+    """Returns the first day of a period of a certain number of recent days, including today"""
+    return datetime.datetime.now(KIEV_TZ).date() - datetime.timedelta(days=days - 1)
+
+
 def collect_user_reading_statistics(user_id: int, days: int):
     """
     Function for getting the total reading time of a user
-    for a certain number of recent days
+    for a certain number of recent days (including today)
     """
-    period_of_time = datetime.datetime.now(KIEV_TZ) - datetime.timedelta(days=days)
-
-    total_duration = ReadingSession.objects.filter(
+    total_duration = DailyReadingStatistics.objects.filter(
         user_id=user_id,
-        start_time__gte=period_of_time
+        date__gte=_first_day_of_period(days)
     ).aggregate(
-        total_duration=Sum('duration')
+        total_duration=Sum('reading_time')
     )['total_duration']
     if not total_duration:
         total_duration = datetime.timedelta()
     return total_duration
 
 
+def _get_reading_sessions_not_in_daily_statistics(user_id: int, windows: list):
+    """
+    Returns the reading sessions of a user which are needed for the periods of time besides daily statistics:
+    the sessions started on the first day of a period after its start, the sessions crossing the start of a period,
+    the active session and the sessions whose statistics are not applied yet.
+    windows is a list of (start time of a period, end of its first day).
+    """
+    # The sessions of a user do not overlap, so only the last session started before a period can cross its start
+    sessions_filter = Q(end_time__isnull=True) | Q(statistics_applied=False)
+    for start_time, first_day_end in windows:
+        previous_session = ReadingSession.objects.filter(
+            user_id=user_id, start_time__lt=start_time
+        ).order_by('-start_time').values('id')[:1]
+        sessions_filter |= Q(start_time__gte=start_time, start_time__lt=first_day_end) | \
+            Q(id=Subquery(previous_session))
+    return ReadingSession.objects.filter(sessions_filter, user_id=user_id)
+
+
+def _get_periods_windows(periods: list, now) -> list:
+    """Returns (start time, end of the first day) of each of the last periods of time ending now"""
+    windows = []
+    for period in periods:
+        start_time = (now - period).astimezone(KIEV_TZ)
+        next_midnight = KIEV_TZ.localize(datetime.datetime.combine(start_time.date() + datetime.timedelta(days=1),
+                                                                   datetime.time()))
+        windows.append((start_time, min(next_midnight, now)))
+    return windows
+
+
+def _get_daily_reading_statistics_for_periods(user_id: int, windows: list):
+    """Returns daily reading statistics of the whole days of the periods and the aggregates of their reading time"""
+    daily_reading_statistics = DailyReadingStatistics.objects.filter(
+        user_id=user_id,
+        date__gt=min(start_time.date() for start_time, _ in windows)
+    )
+    aggregates = {
+        f'period_{i}': Sum('reading_time', filter=Q(date__gt=start_time.date()), default=datetime.timedelta())
+        for i, (start_time, _) in enumerate(windows)
+    }
+    return daily_reading_statistics, aggregates
+
+
+def _sum_reading_time_for_periods(windows: list, daily_reading_time: dict, sessions: list, now) -> list:
+    """Adds the parts of the sessions which are not counted in daily reading statistics to the periods"""
+    reading_time = []
+    for i, (start_time, first_day_end) in enumerate(windows):
+        period_reading_time = daily_reading_time[f'period_{i}']
+        for session_start_time, session_end_time, statistics_applied in sessions:
+            end_time = session_end_time or now
+            if session_end_time is not None and statistics_applied:
+                # The rest of the session is already counted in daily reading statistics
+                end_time = min(end_time, first_day_end)
+            period_reading_time += max(end_time - max(session_start_time, start_time), datetime.timedelta())
+        reading_time.append(period_reading_time)
+    return reading_time
+
+
+def get_reading_time_for_periods(user, periods: list) -> list:
+    """
+    Returns the reading time of a user for each of the last periods of time (e.g. 7 days or 3 hours)
+    at the moment of the call, including the active session.
+    Whole days are taken from daily reading statistics, the first day of every period, the active session
+    and sessions whose statistics are not applied yet - from a few reading sessions,
+    so it takes two queries whatever the periods are.
+    """
+    user_id = _get_user_id(user)
+    if not periods:
+        return []
+
+    now = datetime.datetime.now(KIEV_TZ)
+    windows = _get_periods_windows(periods, now)
+    daily_reading_statistics, aggregates = _get_daily_reading_statistics_for_periods(user_id, windows)
+    daily_reading_time = daily_reading_statistics.aggregate(**aggregates)
+    sessions = list(_get_reading_sessions_not_in_daily_statistics(user_id, windows).values_list(
+        'start_time', 'end_time', 'statistics_applied'
+    ))
+    return _sum_reading_time_for_periods(windows, daily_reading_time, sessions, now)
+
+
+async def aget_reading_time_for_periods(user, periods: list) -> list:
+    """Async version of get_reading_time_for_periods"""
+    user_id = _get_user_id(user)
+    if not periods:
+        return []
+
+    now = datetime.datetime.now(KIEV_TZ)
+    windows = _get_periods_windows(periods, now)
+    daily_reading_statistics, aggregates = _get_daily_reading_statistics_for_periods(user_id, windows)
+    daily_reading_time = await daily_reading_statistics.aaggregate(**aggregates)
+    sessions = [session async for session in _get_reading_sessions_not_in_daily_statistics(
+        user_id, windows
+    ).values_list('start_time', 'end_time', 'statistics_applied')]
+    return _sum_reading_time_for_periods(windows, daily_reading_time, sessions, now)
+
+
 def start_reading_session_and_get_message(user, book_id):
     """
     Starts a new book reading session.
     Returns a dict with a message or with an error.
     """
-    user = _get_user(user)
+    user_id = _get_user_id(user)
 
-    active_session = ReadingSession.objects.filter(user=user, end_time__isnull=True).first()
+    if not Book.objects.filter(id=book_id).exists():
+        return {'Error': 'There is no book with this ID'}
+    return _start_reading_session(user_id, book_id)
 
-    try:
-        book = Book.objects.get(id=book_id)
-    except Book.DoesNotExist:
+
+async def astart_reading_session_and_get_message(user, book_id):
+    """
+    Async version of start_reading_session_and_get_message.
+    The book and an already active session are checked with the async ORM.
+    Starting the session needs a transaction, which the async ORM does not support,
+    so it is done in a worker thread.
+    """
+    user_id = _get_user_id(user)
+
+    if not await Book.objects.filter(id=book_id).aexists():
         return {'Error': 'There is no book with this ID'}
+    if await ReadingSession.objects.filter(user_id=user_id, book_id=book_id, end_time__isnull=True).aexists():
+        return {'message': 'A reading session for this book is already active'}
+    return await sync_to_async(_start_reading_session)(user_id, book_id)
 
-    if active_session and active_session.book == book:
-        response = {'message': 'A reading session for this book is already active'}
-    elif active_session:
-        _end_active_reading_session(user=user)
-        ReadingSession.objects.create(book=book, user=user)
-        response = {'message': 'The previous book reading session was ended successfully, '
-                               'and the new book reading session started successfully'}
-    elif not active_session:
-        ReadingSession.objects.create(book=book, user=user)
-        response = {'message': 'Book reading session started successfully'}
 
-    return response
+def _is_active_reading_session_conflict(error: IntegrityError, user_id: int) -> bool:
+    """
+    Checks that a session could not be started because of the unique active session of the user.
+    PostgreSQL reports the name of the failed constraint, otherwise an active session is looked for.
+    """
+    diag = getattr(error.__cause__, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name == 'unique_active_reading_session'
+    return ReadingSession.objects.filter(user_id=user_id, end_time__isnull=True).exists()
+
+
+def _start_reading_session(user_id: int, book_id) -> dict:
+    """Starts a new book reading session of an existing book, ending the active one"""
+    try:
+        with transaction.atomic():
+            active_session = _get_active_reading_session(user_id)
+            if active_session and active_session.book_id == int(book_id):
+                return {'message': 'A reading session for this book is already active'}
+            if active_session:
+                _end_active_reading_session(user_id=user_id, active_session=active_session)
+            ReadingSession.objects.create(book_id=book_id, user_id=user_id)
+    except IntegrityError as error:
+        if not _is_active_reading_session_conflict(error, user_id):
+            raise
+        # A concurrent request of the same user has started a session meanwhile.
+        # Starting again ends it, or finds it is for this book
+        return _start_reading_session(user_id, book_id)
+
+    if active_session:
+        return {'message': 'The previous book reading session was ended successfully, '
+                           'and the new book reading session started successfully'}
+    return {'message': 'Book reading session started successfully'}
 
 
 def end_reading_session_and_get_message(user):
@@ -115,46 +611,280 @@ def end_reading_session_and_get_message(user):
     Ends the current book reading session, if one exists.
     Returns a dict with a message or with an error.
     """
-    user = _get_user(user)
-
-    active_session = ReadingSession.objects.filter(user=user, end_time__isnull=True).first()
-    if active_session:
-        _end_active_reading_session(user=user)
-        response = {'message': 'Book reading session ended successfully'}
-    else:
-        response = {'message': 'There is currently no book reading session started'}
+    user_id = _get_user_id(user)
+
+    with transaction.atomic():
+        active_session = _get_active_reading_session(user_id)
+        if active_session:
+            _end_active_reading_session(user_id=user_id, active_session=active_session)
+            response = {'message': 'Book reading session ended successfully'}
+        else:
+            response = {'message': 'There is currently no book reading session started'}
     return response
 
 
-def get_user_statistics(user):
-    """Returns common user statistics"""
-    user = _get_user(user)
-    try:
-        user_statistics = user.statistics
-    except UserStatistics.DoesNotExist:
-        user_statistics = UserStatistics(user=user)
-        user_statistics.save()
-    return {"total_reading_time": user_statistics.total_reading_time,
-            "last_7_days_reading_time": user_statistics.last_7_days_reading_time,
-            "last_30_days_reading_time": user_statistics.last_30_days_reading_time}
+async def aend_reading_session_and_get_message(user):
+    """
+    Async version of end_reading_session_and_get_message.
+    Only ending an active session is done in a worker thread, since it needs a transaction.
+    """
+    user_id = _get_user_id(user)
+
+    if not await ReadingSession.objects.filter(user_id=user_id, end_time__isnull=True).aexists():
+        return {'message': 'There is currently no book reading session started'}
+    return await sync_to_async(end_reading_session_and_get_message)(user_id)
+
+
+def _find_overlapping_reading_sessions(user_id: int, sessions: list):
+    """
+    Returns a pair of overlapping reading sessions among the new sessions
+    and the existing sessions of a user, or None.
+    An active session is considered to last until now.
+    """
+    first_start_time = min(session['start_time'] for session in sessions)
+    last_end_time = max(session['end_time'] for session in sessions)
+    existing_sessions = ReadingSession.objects.filter(
+        Q(end_time__isnull=True) | Q(end_time__gt=first_start_time),
+        user_id=user_id,
+        start_time__lt=last_end_time,
+    ).values('book_id', 'start_time', 'end_time')
+
+    now = datetime.datetime.now(KIEV_TZ)
+    all_sessions = sorted(
+        [*sessions, *({**session, 'end_time': session['end_time'] or now} for session in existing_sessions)],
+        key=lambda session: session['start_time']
+    )
+    for previous_session, session in zip(all_sessions, all_sessions[1:]):
+        if session['start_time'] < previous_session['end_time']:
+            return previous_session, session
+    return None
+
+
+def create_reading_sessions_and_get_message(user, sessions: list):
+    """
+    Saves finished reading sessions recorded by a client offline
+    and adds their reading time to the user's statistics in one transaction.
+    sessions is a list of dicts with book_id, start_time and end_time.
+    Returns a dict with a message or with an error.
+    """
+    user_id = _get_user_id(user)
+
+    book_ids = {session['book_id'] for session in sessions}
+    missing_book_ids = book_ids - set(Book.objects.filter(id__in=book_ids).values_list('id', flat=True))
+    if missing_book_ids:
+        return {'Error': f'There are no books with IDs {sorted(missing_book_ids)}'}
+
+    with transaction.atomic():
+        # Uploads of the same user are processed one at a time
+        User.objects.select_for_update().values_list('id').get(id=user_id)
+
+        overlapping_sessions = _find_overlapping_reading_sessions(user_id, sessions)
+        if overlapping_sessions:
+            previous_session, session = overlapping_sessions
+            return {'Error': f'The reading session started at {session["start_time"].isoformat()} '
+                             f'overlaps the session started at {previous_session["start_time"].isoformat()}'}
+
+        ReadingSession.objects.bulk_create([
+            ReadingSession(user_id=user_id, book_id=session['book_id'], start_time=session['start_time'],
+                           end_time=session['end_time'], duration=session['end_time'] - session['start_time'])
+            for session in sessions
+        ])
+
+        _apply_reading_sessions_statistics([{**session, 'user_id': user_id} for session in sessions])
+
+    return {'message': f'{len(sessions)} book reading sessions saved successfully'}
+
+
+def books_with_statistics(fields=BOOK_LIST_FIELDS):
+    """
+    Returns a queryset of books with only the fields and the reading statistics loaded,
+    which is what the book serializers send.
+    """
+    return Book.objects.select_related('statistics').only(
+        *fields, *(f'statistics__{field}' for field in BookStatisticsSerializer.Meta.fields)
+    )
+
+
+def get_serialized_book(book_id):
+    """Returns information of a specific book using the books cache, or None if there is no such book"""
+    def serialize_book():
+        book = Book.objects.select_related('statistics').filter(id=book_id).first()
+        return dict(BookSerializer(book).data) if book else None
+
+    return get_or_set_books_cache(book_details_cache_key(book_id), serialize_book)
+
+
+async def aget_serialized_book(book_id):
+    """Async version of get_serialized_book"""
+    async def serialize_book():
+        book = await Book.objects.select_related('statistics').filter(id=book_id).afirst()
+        return dict(BookSerializer(book).data) if book else None
+
+    return await aget_or_set_books_cache(book_details_cache_key(book_id), serialize_book)
+
+
+def get_user_statistics(user, periods: dict = None):
+    """
+    Returns common user statistics: the total reading time
+    and the reading time for the last periods of time, USER_STATISTICS_PERIODS by default.
+    Statistics are served from the statistics cache, the database is only read on a miss.
+    """
+    user_id = _get_user_id(user)
+    periods = periods or USER_STATISTICS_PERIODS
+
+    def read_total_reading_time():
+        total_reading_time = UserStatistics.objects.filter(
+            user_id=user_id
+        ).values_list('total_reading_time', flat=True).first()
+        return total_reading_time or datetime.timedelta()
+
+    total_reading_time = get_or_set_user_total_reading_time_cache(user_id, read_total_reading_time)
+    periods_reading_time = get_or_set_reading_time_for_periods_cache(
+        user_id, list(periods.values()), lambda: get_reading_time_for_periods(user_id, list(periods.values()))
+    )
+    return {'total_reading_time': total_reading_time, **dict(zip(periods, periods_reading_time))}
+
+
+async def aget_user_statistics(user, periods: dict = None):
+    """Async version of get_user_statistics"""
+    user_id = _get_user_id(user)
+    periods = periods or USER_STATISTICS_PERIODS
+
+    async def read_total_reading_time():
+        total_reading_time = await UserStatistics.objects.filter(
+            user_id=user_id
+        ).values_list('total_reading_time', flat=True).afirst()
+        return total_reading_time or datetime.timedelta()
+
+    total_reading_time = await aget_or_set_user_total_reading_time_cache(user_id, read_total_reading_time)
+    periods_reading_time = await aget_or_set_reading_time_for_periods_cache(
+        user_id, list(periods.values()), lambda: aget_reading_time_for_periods(user_id, list(periods.values()))
+    )
+    return {'total_reading_time': total_reading_time, **dict(zip(periods, periods_reading_time))}
 
 
 def get_user_reading_statistics(user, book_id):
-    """Returns user statistics for a specific book"""
-    user = _get_user(user)
-    try:
-        book = Book.objects.get(id=book_id)
-        book_serialized = BookWithoutFullDescriptionSerializer(book)
+    """
+    Returns user statistics for a specific book.
+    The book and the reading time are served from the cache, the database is only read on a miss.
+    """
+    user_id = _get_user_id(user)
+    book = get_serialized_book(book_id)
+    if book is None:
+        return {'Error': 'There is no book with this ID'}
 
-        # Checking whether user statistics exist for this book. If not, we create it.
-        try:
-            reading_statistics = ReadingStatistics.objects.get(user=user, book=book)
-        except ReadingStatistics.DoesNotExist:
-            reading_statistics = ReadingStatistics(user=user, book=book)
-            reading_statistics.save()
-        total_reading_time = reading_statistics.total_reading_time
-        response = {'Book': book_serialized.data, 'Total reading time': timedelta_to_string(total_reading_time)}
-    except Book.DoesNotExist:
-        response = {'Error': 'There is no book with this ID'}
+    def read_total_reading_time():
+        total_reading_time = ReadingStatistics.objects.filter(
+            user_id=user_id, book_id=book_id
+        ).values_list('total_reading_time', flat=True).first()
+        return total_reading_time or datetime.timedelta()
 
-    return response
+    total_reading_time = get_or_set_book_reading_statistics_cache(user_id, book_id, read_total_reading_time)
+    book_serialized = {field: book[field] for field in BookWithoutFullDescriptionSerializer.Meta.fields}
+    return {'Book': book_serialized, 'Total reading time': timedelta_to_string(total_reading_time)}
+
+
+def get_user_reading_statistics_for_books(user, book_ids: list):
+    """
+    Returns user statistics for several books in the order of book_ids.
+    The books and the reading time are read with one query, books the user has not read have zero reading time.
+    """
+    user_id = _get_user_id(user)
+    book_ids = list(dict.fromkeys(book_ids))
+    books = books_with_statistics().filter(id__in=book_ids).annotate(
+        user_reading_statistics=FilteredRelation(
+            'readingstatistics', condition=Q(readingstatistics__user_id=user_id)
+        ),
+        user_total_reading_time=F('user_reading_statistics__total_reading_time'),
+    ).in_bulk()
+
+    statistics = []
+    for book_id in book_ids:
+        if book_id not in books:
+            continue
+        book = books[book_id]
+        statistics.append({
+            'Book': BookWithoutFullDescriptionSerializer(book).data,
+            'Total reading time': timedelta_to_string(book.user_total_reading_time or datetime.timedelta()),
+        })
+    return {'Statistics': statistics, 'Not found': [book_id for book_id in book_ids if book_id not in books]}
+
+
+async def aget_user_reading_statistics(user, book_id):
+    """Async version of get_user_reading_statistics"""
+    user_id = _get_user_id(user)
+    book = await aget_serialized_book(book_id)
+    if book is None:
+        return {'Error': 'There is no book with this ID'}
+
+    async def read_total_reading_time():
+        total_reading_time = await ReadingStatistics.objects.filter(
+            user_id=user_id, book_id=book_id
+        ).values_list('total_reading_time', flat=True).afirst()
+        return total_reading_time or datetime.timedelta()
+
+    total_reading_time = await aget_or_set_book_reading_statistics_cache(user_id, book_id, read_total_reading_time)
+    book_serialized = {field: book[field] for field in BookWithoutFullDescriptionSerializer.Meta.fields}
+    return {'Book': book_serialized, 'Total reading time': timedelta_to_string(total_reading_time)}
+
+
+def _ranking_reading_time(score) -> str:
+    return timedelta_to_string(datetime.timedelta(seconds=round(score)))
+
+
+def get_top_readers(user, period: str, limit: int):
+    """
+    Returns the readers with the most reading time in the current week or month
+    and the rank of the user among them.
+    """
+    user_id = _get_user_id(user)
+    today = datetime.datetime.now(KIEV_TZ).date()
+    key = ranking_key(READERS, period, today)
+    rankings = get_rankings()
+
+    top_readers = rankings.top(key, limit)
+    usernames = dict(User.objects.filter(
+        id__in=[user_id for user_id, _ in top_readers]
+    ).values_list('id', 'username'))
+    user_rank = rankings.rank(key, user_id)
+    return {
+        'Period': period_label(period, today),
+        'Top readers': [
+            {'Rank': rank, 'Username': usernames[reader_id], 'Reading time': _ranking_reading_time(score)}
+            for rank, (reader_id, score) in enumerate(top_readers, start=1) if reader_id in usernames
+        ],
+        'Your rank': user_rank[0] if user_rank else None,
+        'Your reading time': _ranking_reading_time(user_rank[1] if user_rank else 0),
+    }
+
+
+def get_most_read_books(period: str, limit: int):
+    """Returns the books with the most reading time of all users in the current week or month"""
+    today = datetime.datetime.now(KIEV_TZ).date()
+    top_books = get_rankings().top(ranking_key(BOOKS, period, today), limit)
+    books = books_with_statistics().in_bulk(
+        [book_id for book_id, _ in top_books]
+    )
+    return {
+        'Period': period_label(period, today),
+        'Most read books': [
+            {'Rank': rank, 'Book': BookWithoutFullDescriptionSerializer(books[book_id]).data,
+             'Reading time': _ranking_reading_time(score)}
+            for rank, (book_id, score) in enumerate(top_books, start=1) if book_id in books
+        ],
+    }
+
+
+def rebuild_rankings() -> int:
+    """
+    Rebuilds the rankings of the current and the previous week and month from daily reading statistics,
+    e.g. after the rankings storage has lost its data.
+    Returns the number of daily reading statistics rows used.
+    """
+    today = datetime.datetime.now(KIEV_TZ).date()
+    previous_week = today - datetime.timedelta(days=today.weekday() + 7)
+    previous_month = (today.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+    daily_reading_statistics = DailyReadingStatistics.objects.filter(
+        date__gte=min(previous_week, previous_month)
+    ).values_list('user_id', 'book_id', 'date', 'reading_time')
+    return replace_rankings(daily_reading_statistics.iterator(chunk_size=10000))
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .cache import invalidate_book_cache, invalidate_auth_token_cache
+from .models import Book
+
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_book_cache_on_change(sender, instance, **kwargs):
+    """
+    Book changes made through the admin panel are visible immediately.
+    The cache is invalidated again after commit, in case a concurrent
+    request has cached the old data before the transaction was committed.
+    """
+    book_id = instance.id
+    invalidate_book_cache(book_id)
+    transaction.on_commit(lambda: invalidate_book_cache(book_id))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_auth_token_cache_on_delete(sender, instance, **kwargs):
+    """A deleted token (logout, deleted user) is rejected immediately, also after commit as above"""
+    token_key = instance.key
+    invalidate_auth_token_cache([token_key])
+    transaction.on_commit(lambda: invalidate_auth_token_cache([token_key]))
+
+
+@receiver(post_save, sender=User)
+def invalidate_auth_token_cache_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    """A deactivated or changed user is not served from the cache of its tokens"""
+    if created or (update_fields is not None and set(update_fields) == {'last_login'}):
+        # A new user has no tokens yet, logins only update the time of the last login
+        return
+    token_keys = list(Token.objects.filter(user_id=instance.id).values_list('key', flat=True))
+    if token_keys:
+        invalidate_auth_token_cache(token_keys)
+        transaction.on_commit(lambda: invalidate_auth_token_cache(token_keys))
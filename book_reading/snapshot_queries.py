@@ -0,0 +1,117 @@
+"""
+Queries over the columnar snapshot of the reading sessions.
+
+The snapshot is written by the exportanalyticssnapshot command into a directory per month
+(Europe/Kiev) of the start of the sessions. Every export adds segments: directories with one
+.npy file per column. Only the segments listed in manifest.json are complete. Columns are
+memory-mapped and aggregated segment by segment, so memory usage depends on the number of
+distinct users, books or days and not on the number of sessions. The module only needs NumPy,
+so the snapshot can be queried without Django or the database.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+# Columns of a segment and their types, times are unix timestamps and durations are in seconds
+COLUMNS = {
+    'id': np.int64,
+    'user_id': np.int32,
+    'book_id': np.int64,
+    'start_time': np.int64,
+    'end_time': np.int64,
+    'duration': np.int32,
+    # Day (Europe/Kiev) the session started on, as the number of days since 1970-01-01
+    'day': np.int32,
+}
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+def day_number(date: datetime.date) -> int:
+    return (date - EPOCH_DATE).days
+
+
+def read_manifest(path) -> dict:
+    """Returns the manifest of the snapshot in path, or an empty one if nothing was exported yet"""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {'checkpoint': None, 'segments': []}
+
+
+def iter_segments(path, date_from: datetime.date = None, date_to: datetime.date = None):
+    """
+    Yields the columns {name: memory-mapped array} of the segments with sessions started
+    from date_from to date_to (inclusive), rows outside the days are filtered out.
+    """
+    first_month = f'{date_from.year}-{date_from.month:02d}' if date_from else None
+    last_month = f'{date_to.year}-{date_to.month:02d}' if date_to else None
+    for segment in read_manifest(path)['segments']:
+        if (first_month and segment['month'] < first_month) or (last_month and segment['month'] > last_month):
+            continue
+        columns = {name: np.load(os.path.join(path, segment['month'], segment['name'], f'{name}.npy'), mmap_mode='r')
+                   for name in COLUMNS}
+        if date_from or date_to:
+            mask = np.ones(len(columns['day']), dtype=bool)
+            if date_from:
+                mask &= columns['day'] >= day_number(date_from)
+            if date_to:
+                mask &= columns['day'] <= day_number(date_to)
+            columns = {name: column[mask] for name, column in columns.items()}
+        yield columns
+
+
+def _aggregate(path, key: str, date_from=None, date_to=None, user_id=None, book_id=None) -> dict:
+    """
+    Returns {key: sorted unique values, 'reading_time': seconds, 'sessions': number of sessions}
+    of the sessions grouped by a column.
+    """
+    keys, reading_time, sessions = [], [], []
+    for columns in iter_segments(path, date_from, date_to):
+        if user_id is not None or book_id is not None:
+            mask = np.ones(len(columns[key]), dtype=bool)
+            if user_id is not None:
+                mask &= columns['user_id'] == user_id
+            if book_id is not None:
+                mask &= columns['book_id'] == book_id
+            columns = {name: columns[name][mask] for name in (key, 'duration')}
+        segment_keys, inverse = np.unique(columns[key], return_inverse=True)
+        keys.append(segment_keys)
+        reading_time.append(np.bincount(inverse, weights=columns['duration'], minlength=len(segment_keys)))
+        sessions.append(np.bincount(inverse, minlength=len(segment_keys)))
+
+    if not keys:
+        return {key: np.array([], dtype=COLUMNS[key]), 'reading_time': np.array([], dtype=np.int64),
+                'sessions': np.array([], dtype=np.int64)}
+    # The partial sums of the segments are added up
+    unique_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return {
+        key: unique_keys,
+        'reading_time': np.bincount(inverse, weights=np.concatenate(reading_time),
+                                    minlength=len(unique_keys)).astype(np.int64),
+        'sessions': np.bincount(inverse, weights=np.concatenate(sessions),
+                                minlength=len(unique_keys)).astype(np.int64),
+    }
+
+
+def reading_time_by_user(path, date_from=None, date_to=None, book_id=None) -> dict:
+    """Returns the reading time and the number of sessions of every user, optionally of one book"""
+    return _aggregate(path, 'user_id', date_from, date_to, book_id=book_id)
+
+
+def reading_time_by_book(path, date_from=None, date_to=None, user_id=None) -> dict:
+    """Returns the reading time and the number of sessions of every book, optionally of one user"""
+    return _aggregate(path, 'book_id', date_from, date_to, user_id=user_id)
+
+
+def reading_time_by_day(path, date_from=None, date_to=None, user_id=None, book_id=None) -> dict:
+    """
+    Returns the reading time and the number of sessions per day (Europe/Kiev) the sessions started on,
+    the days are numpy.datetime64 dates. A session is counted on the day it started, even if it ends later.
+    """
+    result = _aggregate(path, 'day', date_from, date_to, user_id=user_id, book_id=book_id)
+    result['day'] = result['day'].astype('datetime64[D]')
+    return result
@@ -0,0 +1,98 @@
+"""
+Columnar snapshot of the finished reading sessions for offline reporting.
+
+Every run of the exportanalyticssnapshot command adds the sessions finished since the previous
+run to the snapshot as typed NumPy arrays, see snapshot_queries for the layout and the queries,
+so analysts do not query the sessions table used by the API. Sessions are exported once their
+reading time is added to the statistics, after which they do not change. Only sessions changed
+more than ANALYTICS_SNAPSHOT_LAG seconds ago are exported and the manifest records the time they
+are exported up to, so sessions whose transaction committed late are not missed or exported twice.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .models import ReadingSession, ArchivedReadingSession
+from .services import KIEV_TZ
+from .snapshot_queries import COLUMNS, MANIFEST_FILE, EPOCH_DATE, read_manifest
+
+SNAPSHOT_FIELDS = ('id', 'user_id', 'book_id', 'start_time', 'end_time', 'duration')
+
+
+def _get_snapshot_row(session: tuple) -> tuple:
+    """Returns the values of COLUMNS of a session"""
+    session_id, user_id, book_id, start_time, end_time, duration = session
+    day = start_time.astimezone(KIEV_TZ).date()
+    return (session_id, user_id, book_id, int(start_time.timestamp()), int(end_time.timestamp()),
+            int(duration.total_seconds()), (day - EPOCH_DATE).days)
+
+
+def _month(day: int) -> str:
+    date = EPOCH_DATE + datetime.timedelta(days=day)
+    return f'{date.year}-{date.month:02d}'
+
+
+def _write_segments(path, months_rows: dict, first_number: int) -> list:
+    """Writes the rows {month: [row]} as one segment per month, returns the manifest entries of the segments"""
+    segments = []
+    for number, (month, rows) in enumerate(sorted(months_rows.items()), start=first_number):
+        name = f'{number:06d}'
+        directory = os.path.join(path, month, name)
+        os.makedirs(directory, exist_ok=True)
+        for (column, dtype), values in zip(COLUMNS.items(), zip(*rows)):
+            np.save(os.path.join(directory, f'{column}.npy'), np.array(values, dtype=dtype))
+        segments.append({'month': month, 'name': name, 'rows': len(rows)})
+    return segments
+
+
+def _write_manifest(path, manifest: dict) -> None:
+    # Replaced at once, so readers never see a manifest listing segments which are not written yet
+    temporary_path = os.path.join(path, f'{MANIFEST_FILE}.tmp')
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary_path, os.path.join(path, MANIFEST_FILE))
+
+
+def export_analytics_snapshot(path=None, chunk_size: int = None, segment_size: int = None, log=print) -> int:
+    """
+    Adds the sessions finished since the previous export to the snapshot in path.
+    The first export also includes the archived sessions.
+    Returns the number of exported sessions.
+    """
+    path = path or settings.ANALYTICS_SNAPSHOT_DIR
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    segment_size = segment_size or settings.ANALYTICS_SNAPSHOT_SEGMENT_SIZE
+    os.makedirs(path, exist_ok=True)
+
+    manifest = read_manifest(path)
+    since = datetime.datetime.fromisoformat(manifest['checkpoint']) if manifest['checkpoint'] else None
+    until = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=settings.ANALYTICS_SNAPSHOT_LAG)
+    sessions = ReadingSession.objects.filter(end_time__isnull=False, statistics_applied=True, updated_at__lt=until)
+    querysets = [sessions.filter(updated_at__gte=since) if since else sessions]
+    if since is None:
+        querysets.insert(0, ArchivedReadingSession.objects.all())
+
+    exported = 0
+    months_rows = {}
+    for queryset in querysets:
+        # Read in chunks of ids by separate queries, so no server-side cursor is needed
+        sessions = queryset.order_by('id').values_list(*SNAPSHOT_FIELDS)
+        chunk = list(sessions[:chunk_size])
+        while chunk:
+            for session in chunk:
+                row = _get_snapshot_row(session)
+                months_rows.setdefault(_month(row[-1]), []).append(row)
+                exported += 1
+                if exported % segment_size == 0:
+                    manifest['segments'] += _write_segments(path, months_rows, len(manifest['segments']))
+                    months_rows = {}
+                    log(f'Exported {exported} reading sessions')
+            chunk = list(sessions.filter(id__gt=chunk[-1][0])[:chunk_size])
+    manifest['segments'] += _write_segments(path, months_rows, len(manifest['segments']))
+
+    manifest['checkpoint'] = until.isoformat()
+    _write_manifest(path, manifest)
+    return exported
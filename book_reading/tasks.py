@@ -1,29 +1,95 @@
+import logging
+
 from celery import shared_task
-from django.contrib.auth.models import User
+from django.conf import settings
+
+from .cache import get_statistics_cache
+from .heartbeats import get_heartbeats
+from .reconciliation import reconcile_reading_statistics
+from .services import apply_pending_reading_statistics, flush_reading_session_heartbeats, close_idle_reading_sessions
+
+logger = logging.getLogger(__name__)
 
-from .models import UserStatistics
-from .services import collect_user_reading_statistics
+PENDING_STATISTICS_SCHEDULED_CACHE_KEY = 'statistics:pending:scheduled'
 
 
 @shared_task
-def daily_collection_of_user_statistics() -> None:
+def batch_update_of_reading_statistics() -> int:
     """
-    Task for daily collection of user reading statistics for the last 7 and 30 days
+    Task for adding the reading time of sessions ended in the async statistics mode
+    to the statistics. Sessions ended in a short period are applied together.
+    Safe to run repeatedly or concurrently, every session is applied only once.
     """
-    users = User.objects.all()
+    # Sessions ended from now on schedule a new run
+    get_statistics_cache().delete(PENDING_STATISTICS_SCHEDULED_CACHE_KEY)
+
+    applied = apply_pending_reading_statistics(batch_size=settings.STATISTICS_BATCH_SIZE)
+    if applied == settings.STATISTICS_BATCH_SIZE:
+        batch_update_of_reading_statistics.delay()
+    return applied
+
 
-    for user in users:
-        last_7_days_reading_time = collect_user_reading_statistics(user_id=user.id, days=7)
-        last_30_days_reading_time = collect_user_reading_statistics(user_id=user.id, days=30)
+def schedule_batch_update_of_reading_statistics() -> None:
+    """
+    Schedules the pending statistics task, unless it is already scheduled.
+    The delay lets the task collect the sessions ended in the meantime into one batch.
+    Called after the session is committed, so errors are logged instead of failing the request,
+    the sessions are picked up by the next session ended or by the periodic run of the task.
+    """
+    delay = settings.STATISTICS_BATCH_DELAY
+    try:
+        if get_statistics_cache().add(PENDING_STATISTICS_SCHEDULED_CACHE_KEY, True, timeout=delay * 2):
+            try:
+                batch_update_of_reading_statistics.apply_async(countdown=delay)
+            except Exception:
+                # The next session ended tries again
+                get_statistics_cache().delete(PENDING_STATISTICS_SCHEDULED_CACHE_KEY)
+                raise
+    except Exception:
+        logger.exception('The update of the pending reading statistics could not be scheduled')
 
-        try:
-            user_statistics = UserStatistics.objects.get(user=user)
-        except UserStatistics.DoesNotExist:
-            user_statistics = UserStatistics(user=user)
 
-        user_statistics.last_7_days_reading_time = last_7_days_reading_time
-        user_statistics.last_30_days_reading_time = last_30_days_reading_time
-        user_statistics.save()
+def _heartbeats_are_shared() -> bool:
+    """
+    Heartbeats kept in the memory of a web process never reach the worker, which would close
+    every session as abandoned, so the heartbeat tasks require HEARTBEATS_REDIS_URL
+    """
+    if get_heartbeats().shared:
+        return True
+    logger.warning('Heartbeats are not shared between processes, set HEARTBEATS_REDIS_URL to close idle sessions')
+    return False
 
 
+@shared_task
+def flush_of_reading_session_heartbeats() -> int:
+    """Task for saving the heartbeats of the active sessions received since the last run to the database"""
+    if not _heartbeats_are_shared():
+        return 0
+    return flush_reading_session_heartbeats(batch_size=settings.HEARTBEATS_FLUSH_BATCH_SIZE)
 
+
+@shared_task
+def closing_of_idle_reading_sessions() -> int:
+    """
+    Task for ending the sessions abandoned by their users, see close_idle_reading_sessions.
+    The heartbeats are flushed first, so sessions still being read are not closed.
+    """
+    if not _heartbeats_are_shared():
+        return 0
+    flush_reading_session_heartbeats(batch_size=settings.HEARTBEATS_FLUSH_BATCH_SIZE)
+    closed = close_idle_reading_sessions(batch_size=settings.STATISTICS_BATCH_SIZE)
+    if closed == settings.STATISTICS_BATCH_SIZE:
+        closing_of_idle_reading_sessions.delay()
+    return closed
+
+
+@shared_task
+def reconciliation_of_reading_statistics() -> dict:
+    """
+    Task for repairing the statistics of the users with sessions changed since the previous run,
+    see reconcile_reading_statistics. Repairs are logged, as they mean updates were lost.
+    """
+    report = reconcile_reading_statistics(log=logger.debug)
+    if report['reading_statistics'] or report['user_statistics'] or report['book_statistics']:
+        logger.warning(f'Reconciliation of reading statistics repaired {report}')
+    return report
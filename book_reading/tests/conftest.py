@@ -0,0 +1,51 @@
+import importlib
+
+import pytest
+
+from django.core.cache import caches
+from django.db import connection
+
+from book_reading.heartbeats import get_heartbeats
+from book_reading.rankings import get_rankings
+from config import celery_app
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Cached data must not leak between tests"""
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_rankings():
+    """Rankings kept in the memory of the process must not leak between tests"""
+    get_rankings().clear()
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker, request):
+    """The archive table is not managed by Django, so without migrations it is created as by its migration"""
+    if request.config.getvalue('nomigrations'):
+        migration = importlib.import_module('book_reading.migrations.0014_archived_reading_session_table')
+        with django_db_blocker.unblock(), connection.schema_editor() as schema_editor:
+            migration.create_archive_table(None, schema_editor)
+
+
+@pytest.fixture(autouse=True)
+def clear_heartbeats():
+    """Heartbeats kept in the memory of the process must not leak between tests"""
+    get_heartbeats().clear()
+
+
+@pytest.fixture(autouse=True)
+def strict_query_budgets(settings):
+    """Views exceeding their query budget fail the tests"""
+    settings.QUERY_BUDGETS_STRICT = True
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    """Tasks started by other tasks (e.g. shards of the daily statistics collection) run synchronously"""
+    celery_app.conf.task_always_eager = True
+    celery_app.conf.task_eager_propagates = True
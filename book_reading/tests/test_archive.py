@@ -0,0 +1,85 @@
+import datetime
+import io
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+from book_reading.archive import partition_name
+from book_reading.models import ReadingSession, ArchivedReadingSession, DailyReadingStatistics
+from book_reading.services import rebuild_daily_reading_statistics
+
+from .test_views import api_client, create_book_1, test_user
+
+
+@pytest.fixture
+def old_and_recent_sessions(create_book_1, test_user):
+    """Creates two sessions older than the retention window, one of them not applied to the statistics yet,
+    and a recent session. The sessions start at noon, so none of them is split by midnight in Kiev"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    sessions = []
+    for days_ago, statistics_applied in ((500, True), (450, False), (10, True)):
+        start_time = now - datetime.timedelta(days=days_ago)
+        sessions.append(ReadingSession.objects.create(
+            book=create_book_1, user_id=test_user, start_time=start_time,
+            end_time=start_time + datetime.timedelta(hours=1), duration=datetime.timedelta(hours=1),
+            statistics_applied=statistics_applied,
+        ))
+    return sessions
+
+
+@pytest.mark.django_db
+class TestArchiveReadingSessions:
+    def test_archive_reading_sessions(self, old_and_recent_sessions):
+        old_session, pending_session, recent_session = old_and_recent_sessions
+        stdout = io.StringIO()
+        call_command('archivereadingsessions', chunk_size=1, stdout=stdout)
+
+        assert 'Archived 1 reading sessions in total' in stdout.getvalue()
+        assert set(ReadingSession.objects.values_list('id', flat=True)) == {pending_session.id, recent_session.id}
+        archived_session = ArchivedReadingSession.objects.get()
+        assert archived_session.id == old_session.id
+        assert archived_session.start_time == old_session.start_time
+        assert archived_session.duration == datetime.timedelta(hours=1)
+
+        # Nothing is left to archive on the next run
+        call_command('archivereadingsessions', stdout=io.StringIO())
+        assert ArchivedReadingSession.objects.count() == 1
+
+    def test_archive_reading_sessions_retention_shorter_than_statistics_periods(self, settings):
+        with pytest.raises(CommandError):
+            call_command('archivereadingsessions', retention_days=settings.STATISTICS_MAX_PERIOD_DAYS,
+                         stdout=io.StringIO())
+
+    def test_rebuild_daily_reading_statistics_includes_archived_sessions(self, old_and_recent_sessions):
+        # The session not applied to the statistics yet is added by the batch update, not by the rebuild
+        assert rebuild_daily_reading_statistics() == 2
+
+        call_command('archivereadingsessions', stdout=io.StringIO())
+        assert rebuild_daily_reading_statistics(chunk_size=1) == 2
+        assert sum((statistics.reading_time for statistics in DailyReadingStatistics.objects.all()),
+                   datetime.timedelta()) == datetime.timedelta(hours=2)
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='Only PostgreSQL tables are partitioned')
+    def test_archive_is_partitioned_by_month(self, old_and_recent_sessions):
+        old_session = old_and_recent_sessions[0]
+        call_command('archivereadingsessions', stdout=io.StringIO())
+
+        month_start = old_session.start_time.astimezone(datetime.timezone.utc).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT child.relname FROM pg_inherits '
+                           'JOIN pg_class parent ON parent.oid = inhparent JOIN pg_class child ON child.oid = inhrelid '
+                           'WHERE parent.relname = %s', [ArchivedReadingSession._meta.db_table])
+            assert [row[0] for row in cursor.fetchall()] == [partition_name(month_start)]
+
+
+@pytest.mark.django_db
+def test_bulk_reading_sessions_older_than_retention(api_client, create_book_1, test_user, settings):
+    start_time = datetime.datetime.now(datetime.timezone.utc) - \
+                 datetime.timedelta(days=settings.READING_SESSIONS_RETENTION_DAYS + 1)
+    sessions = [{"book_id": create_book_1.id, "start_time": start_time.isoformat(),
+                 "end_time": (start_time + datetime.timedelta(hours=1)).isoformat()}]
+    response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+    assert response.status_code == 400
@@ -0,0 +1,125 @@
+import base64
+import datetime
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from book_reading.models import ReadingSession, ReadingStatistics
+from book_reading.services import timedelta_to_string
+
+from .test_views import api_client, create_book_1, create_book_2, test_user, reading_a_book_for_two_hours
+
+
+@pytest.fixture
+def async_get(test_user):
+    """Returns a function making GET requests to the async views with the token of the test user"""
+    client = AsyncClient()
+    headers = {'Authorization': f'Token {Token.objects.get(user_id=test_user).key}'}
+
+    def get(url):
+        return async_to_sync(client.get)(url, headers=headers)
+    return get
+
+
+@pytest.mark.django_db
+class TestAsyncReadingSession:
+    def test_async_start_reading_session(self, create_book_1, test_user, async_get):
+        response = async_get(f"/api/v1/async/start-reading-session/{create_book_1.id}/")
+        assert response.status_code == 200
+        assert response.json()["message"] == "Book reading session started successfully"
+        assert ReadingSession.objects.filter(user_id=test_user, end_time__isnull=True).exists()
+
+    def test_async_start_reading_session_already_active(self, create_book_1, test_user, async_get):
+        async_get(f"/api/v1/async/start-reading-session/{create_book_1.id}/")
+        response = async_get(f"/api/v1/async/start-reading-session/{create_book_1.id}/")
+        assert response.json()["message"] == "A reading session for this book is already active"
+
+    def test_async_start_reading_session_with_active_session(self, create_book_1, create_book_2, test_user,
+                                                             async_get):
+        async_get(f"/api/v1/async/start-reading-session/{create_book_1.id}/")
+        response = async_get(f"/api/v1/async/start-reading-session/{create_book_2.id}/")
+        assert response.json()["message"] == 'The previous book reading session was ended successfully, ' \
+                                             'and the new book reading session started successfully'
+        assert ReadingStatistics.objects.filter(user_id=test_user, book=create_book_1).exists()
+
+    def test_async_start_reading_session_invalid_book_id(self, create_book_1, test_user, async_get):
+        response = async_get(f"/api/v1/async/start-reading-session/{create_book_1.id + 1}/")
+        assert response.json()["Error"] == "There is no book with this ID"
+
+    def test_async_end_reading_session(self, create_book_1, test_user, async_get):
+        async_get(f"/api/v1/async/start-reading-session/{create_book_1.id}/")
+        response = async_get("/api/v1/async/end-reading-session/")
+        assert response.json()["message"] == "Book reading session ended successfully"
+        assert not ReadingSession.objects.filter(user_id=test_user, end_time__isnull=True).exists()
+
+    def test_async_end_reading_session_without_active_session(self, create_book_1, test_user, async_get):
+        response = async_get("/api/v1/async/end-reading-session/")
+        assert response.json()["message"] == "There is currently no book reading session started"
+
+    def test_async_views_require_authentication(self, create_book_1):
+        client = AsyncClient()
+        assert async_to_sync(client.get)("/api/v1/async/user-statistics/").status_code == 401
+        response = async_to_sync(client.get)("/api/v1/async/end-reading-session/",
+                                             headers={'Authorization': 'Token invalid'})
+        assert response.status_code == 401
+
+    @pytest.mark.parametrize('headers', [{}, {'Authorization': 'Token invalid'}])
+    def test_async_views_reject_requests_as_sync_views(self, create_book_1, headers):
+        response = async_to_sync(AsyncClient().get)("/api/v1/async/end-reading-session/", headers=headers)
+        sync_response = APIClient().get("/api/v1/end-reading-session/", headers=headers)
+        assert response.status_code == sync_response.status_code
+        assert response.json() == sync_response.json()
+        assert response['WWW-Authenticate'] == sync_response['WWW-Authenticate']
+
+    def test_async_views_basic_authentication(self, create_book_1, test_user):
+        credentials = base64.b64encode(b'testusername:testpassword').decode()
+        response = async_to_sync(AsyncClient().get)(f"/api/v1/async/start-reading-session/{create_book_1.id}/",
+                                                    headers={'Authorization': f'Basic {credentials}'})
+        assert response.status_code == 200
+        assert ReadingSession.objects.filter(user_id=test_user, end_time__isnull=True).exists()
+
+
+@pytest.mark.django_db
+class TestAsyncStatistics:
+    def test_async_user_statistics(self, create_book_1, test_user, reading_a_book_for_two_hours, async_get):
+        response = async_get("/api/v1/async/user-statistics/?hours=3")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["Username"] == "testusername"
+        assert data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert data["Last 7 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert data["Last 3 hours reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+
+    def test_async_user_statistics_invalid_period(self, api_client, create_book_1, test_user, async_get):
+        response = async_get("/api/v1/async/user-statistics/?hours=0")
+        assert response.status_code == 400
+        assert response.json() == api_client.get("/api/v1/user-statistics/?hours=0").json()
+
+    def test_async_user_statistics_match_sync_view(self, api_client, create_book_1, test_user,
+                                                   reading_a_book_for_two_hours, async_get):
+        assert async_get("/api/v1/async/user-statistics/").json() == \
+               api_client.get("/api/v1/user-statistics/").data
+
+    def test_async_book_reading_statistics(self, create_book_1, create_book_2, test_user,
+                                           reading_a_book_for_two_hours, async_get):
+        response = async_get(f"/api/v1/async/book-reading-statistics/{create_book_1.id}/")
+        assert response.json()["Book"]["id"] == create_book_1.id
+        assert response.json()["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+
+        response = async_get(f"/api/v1/async/book-reading-statistics/{create_book_2.id + 1}/")
+        assert response.json()["Error"] == "There is no book with this ID"
+
+    def test_async_views_are_measured(self, create_book_1, test_user, async_get):
+        response = async_get("/api/v1/async/user-statistics/")
+        assert int(response['X-DB-Query-Count']) > 0
+
+
+@pytest.mark.django_db
+def test_async_views_token_cache(test_user, async_get):
+    assert async_get('/api/v1/async/user-statistics/').status_code == 200
+    # A deleted token is rejected, although its user is cached
+    Token.objects.get(user_id=test_user).delete()
+    assert async_get('/api/v1/async/user-statistics/').status_code == 401
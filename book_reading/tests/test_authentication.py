@@ -0,0 +1,52 @@
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+
+from book_reading.authentication import get_token_user
+from book_reading.cache import get_auth_cache, auth_token_cache_key
+
+from .test_views import api_client, test_user
+
+
+@pytest.mark.django_db
+class TestCachingTokenAuthentication:
+    def test_token_user_is_cached(self, api_client, test_user):
+        assert api_client.get('/api/v1/reading-session-heartbeat/')['X-DB-Query-Count'] == '1'
+        response = api_client.get('/api/v1/reading-session-heartbeat/')
+        assert response.status_code == 200
+        assert response['X-DB-Query-Count'] == '0'
+
+    def test_password_is_not_cached(self, test_user, django_assert_num_queries):
+        token_key = Token.objects.get(user_id=test_user).key
+        get_token_user(token_key)
+        cached = get_auth_cache().get(auth_token_cache_key(token_key))
+        assert cached['id'] == test_user
+        assert 'password' not in cached and 'email' not in cached
+
+        with django_assert_num_queries(0):
+            user = get_token_user(token_key)
+        assert (user.id, user.username, user.is_active) == (test_user, 'testusername', True)
+        # The other fields are loaded on access
+        assert user.check_password('testpassword')
+
+    def test_invalid_token(self, api_client, test_user):
+        api_client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
+
+    def test_logout_invalidates_cache(self, api_client, test_user):
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 200
+        assert api_client.post('/auth/token/logout/').status_code == 204
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
+
+    def test_deactivated_user_invalidates_cache(self, api_client, test_user):
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 200
+        user = User.objects.get(id=test_user)
+        user.is_active = False
+        user.save()
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
+
+    def test_deleted_user_invalidates_cache(self, api_client, test_user):
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 200
+        User.objects.get(id=test_user).delete()
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
@@ -0,0 +1,78 @@
+import io
+import json
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+from book_reading.benchmarks import percentile, find_regressions
+from book_reading.models import ReadingSession, UserStatistics
+
+
+class TestBenchmarkHelpers:
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 100) == 100
+        assert percentile([7], 99) == 7
+
+    def test_find_regressions(self):
+        baseline = [{'name': 'view: books', 'p95_ms': 10.0, 'queries_per_call': 1.0}]
+        assert find_regressions([{'name': 'view: books', 'p95_ms': 11.0, 'queries_per_call': 1.0}],
+                                baseline, tolerance=20) == []
+        assert len(find_regressions([{'name': 'view: books', 'p95_ms': 13.0, 'queries_per_call': 2.0}],
+                                    baseline, tolerance=20)) == 2
+
+
+@pytest.mark.django_db
+class TestBenchmarkCommands:
+    def test_generate_benchmark_data_and_run_benchmarks(self, tmp_path):
+        call_command('generatebenchmarkdata', users=5, books=3, sessions_per_user=4, chunk_size=7,
+                     stdout=io.StringIO())
+        assert ReadingSession.objects.count() == 20
+        assert UserStatistics.objects.count() == 5
+
+        output = tmp_path / 'results.json'
+        stdout = io.StringIO()
+        call_command('runbenchmarks', iterations=3, users=2, output=str(output), stdout=stdout)
+        results = {result['name']: result for result in json.loads(output.read_text())}
+        assert set(results) >= {'view: books', 'task: reconcile_reading_statistics'}
+        assert 'p95 ms' in stdout.getvalue()
+
+    def test_run_benchmarks_without_data(self):
+        with pytest.raises(CommandError):
+            call_command('runbenchmarks', iterations=1, stdout=io.StringIO())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_throughput_benchmarks(tmp_path):
+    call_command('generatebenchmarkdata', users=3, books=2, sessions_per_user=2, stdout=io.StringIO())
+
+    output = tmp_path / 'throughput.json'
+    stdout = io.StringIO()
+    call_command('runbenchmarks', throughput=True, requests=4, concurrency=2, scenario=['user-statistics'],
+                 output=str(output), stdout=stdout)
+    results = json.loads(output.read_text())
+    assert [result['name'] for result in results] == ['sync: user-statistics', 'async: user-statistics']
+    assert all(result['requests'] == 4 and result['errors'] == 0 for result in results)
+    assert 'req/s' in stdout.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_connection_benchmarks(tmp_path):
+    call_command('generatebenchmarkdata', users=2, books=2, sessions_per_user=2, stdout=io.StringIO())
+
+    output = tmp_path / 'connections.json'
+    stdout = io.StringIO()
+    call_command('runbenchmarks', connections=True, requests=5, output=str(output), stdout=stdout)
+    results = {result['name']: result for result in json.loads(output.read_text())}
+    assert set(results) == {'connections: new connection per request', 'connections: persistent connection'}
+    if connection.vendor == 'postgresql':
+        # The in-memory SQLite test database is never closed
+        assert results['connections: new connection per request']['connections_per_call'] == 1
+        # Only the first request opens a connection
+        assert results['connections: persistent connection']['connections_per_call'] == 1 / 5
+    assert 'connections per request' in stdout.getvalue()
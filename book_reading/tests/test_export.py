@@ -0,0 +1,122 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from book_reading.models import ReadingSession
+from book_reading.services import KIEV_TZ, timedelta_to_string
+
+from .test_views import api_client, create_book_1, create_book_2, test_user
+
+
+@pytest.fixture
+def reading_history(create_book_1, create_book_2, test_user):
+    """Creates two finished sessions and an active session of the user and a session of another user"""
+    other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+    start_time = KIEV_TZ.localize(datetime.datetime.now() - datetime.timedelta(days=3)).replace(hour=10)
+    sessions = [
+        ReadingSession.objects.create(book=create_book_1, user_id=test_user, start_time=start_time,
+                                      end_time=start_time + datetime.timedelta(minutes=90),
+                                      duration=datetime.timedelta(minutes=90)),
+        ReadingSession.objects.create(book=create_book_2, user_id=test_user,
+                                      start_time=start_time + datetime.timedelta(days=1),
+                                      end_time=start_time + datetime.timedelta(days=1, minutes=30),
+                                      duration=datetime.timedelta(minutes=30)),
+        ReadingSession.objects.create(book=create_book_1, user_id=test_user,
+                                      start_time=start_time + datetime.timedelta(days=2)),
+    ]
+    ReadingSession.objects.create(book=create_book_1, user=other_user, start_time=start_time,
+                                  end_time=start_time + datetime.timedelta(hours=1),
+                                  duration=datetime.timedelta(hours=1))
+    return sessions
+
+
+def get_content(response) -> str:
+    return b''.join(response.streaming_content).decode()
+
+
+@pytest.mark.django_db
+class TestReadingSessionsExport:
+    def test_export_csv(self, api_client, reading_history):
+        response = api_client.get('/api/v1/reading-sessions/export/')
+        assert response.status_code == 200
+        assert response.streaming
+        assert response['Content-Type'] == 'text/csv'
+        assert response['Content-Disposition'] == 'attachment; filename="reading-sessions.csv"'
+
+        rows = list(csv.DictReader(io.StringIO(get_content(response))))
+        assert [int(row['id']) for row in rows] == [session.id for session in reading_history]
+        assert rows[0]['book_title'] == 'test_title'
+        assert datetime.datetime.fromisoformat(rows[0]['start_time']) == reading_history[0].start_time
+        assert float(rows[0]['duration_seconds']) == 5400
+        assert 'duration' not in rows[0]
+        # The active session has no end time yet
+        assert rows[2]['end_time'] == '' and rows[2]['duration_seconds'] == ''
+
+    def test_export_ndjson_human_readable(self, api_client, reading_history):
+        response = api_client.get('/api/v1/reading-sessions/export/', {'output': 'ndjson', 'human_readable': 'true'})
+        assert response['Content-Type'] == 'application/x-ndjson'
+
+        rows = [json.loads(line) for line in get_content(response).splitlines()]
+        assert len(rows) == 3
+        assert rows[0]['duration'] == timedelta_to_string(datetime.timedelta(minutes=90))
+        assert rows[2]['end_time'] is None and rows[2]['duration'] is None
+
+    def test_export_filters(self, api_client, reading_history, create_book_1):
+        first_day = reading_history[0].start_time.astimezone(KIEV_TZ).date()
+        response = api_client.get('/api/v1/reading-sessions/export/',
+                                  {'output': 'ndjson', 'book_id': create_book_1.id})
+        assert [json.loads(line)['id'] for line in get_content(response).splitlines()] == \
+               [reading_history[0].id, reading_history[2].id]
+
+        response = api_client.get('/api/v1/reading-sessions/export/',
+                                  {'output': 'ndjson', 'date_from': first_day + datetime.timedelta(days=1),
+                                   'date_to': first_day + datetime.timedelta(days=1)})
+        assert [json.loads(line)['id'] for line in get_content(response).splitlines()] == [reading_history[1].id]
+
+    def test_export_invalid_parameters(self, api_client, test_user):
+        response = api_client.get('/api/v1/reading-sessions/export/', {'date_from': '2023-02-01',
+                                                                       'date_to': '2023-01-01'})
+        assert response.status_code == 400
+        response = api_client.get('/api/v1/reading-sessions/export/', {'output': 'xml'})
+        assert response.status_code == 400
+
+    def test_export_not_authenticated(self, api_client):
+        response = api_client.get('/api/v1/reading-sessions/export/')
+        assert response.status_code == 401
+
+    def test_export_includes_archived_sessions(self, api_client, create_book_1, test_user, reading_history):
+        start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=500)
+        archived = ReadingSession.objects.create(book=create_book_1, user_id=test_user, start_time=start_time,
+                                                 end_time=start_time + datetime.timedelta(hours=1),
+                                                 duration=datetime.timedelta(hours=1))
+        call_command('archivereadingsessions', stdout=io.StringIO())
+
+        response = api_client.get('/api/v1/reading-sessions/export/', {'output': 'ndjson'})
+        assert [json.loads(line)['id'] for line in get_content(response).splitlines()] == \
+               [archived.id] + [session.id for session in reading_history]
+
+
+@pytest.mark.django_db
+class TestExportReadingSessionsCommand:
+    def test_export_all_users(self, reading_history):
+        stdout = io.StringIO()
+        call_command('exportreadingsessions', chunk_size=1, stdout=stdout)
+        rows = list(csv.DictReader(io.StringIO(stdout.getvalue())))
+        assert len(rows) == 4
+        # The session of the other user starts at the same time as the first one and is not skipped between chunks
+        other_session = ReadingSession.objects.exclude(user_id=reading_history[0].user_id).get()
+        assert [int(row['id']) for row in rows] == [reading_history[0].id, other_session.id] + \
+               [session.id for session in reading_history[1:]]
+
+    def test_export_to_file(self, reading_history, test_user, tmp_path):
+        path = tmp_path / 'sessions.ndjson'
+        call_command('exportreadingsessions', '--format', 'ndjson', '--user', str(test_user), '--human-readable',
+                     '--output', str(path))
+        rows = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+        assert [row['id'] for row in rows] == [session.id for session in reading_history]
+        assert rows[1]['duration'] == timedelta_to_string(datetime.timedelta(minutes=30))
@@ -0,0 +1,117 @@
+import datetime
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+
+from book_reading.heartbeats import get_heartbeats, LocalHeartbeats
+from book_reading.models import ReadingSession, ReadingStatistics, UserStatistics, DailyReadingStatistics
+from book_reading.services import flush_reading_session_heartbeats
+from book_reading.tasks import closing_of_idle_reading_sessions, flush_of_reading_session_heartbeats
+
+from .test_views import api_client, create_book_1, create_book_2, test_user
+
+
+@pytest.fixture(autouse=True)
+def shared_heartbeats(monkeypatch):
+    """The tasks run in the process which records the heartbeats, so they are shared"""
+    monkeypatch.setattr(LocalHeartbeats, 'shared', True)
+
+
+def create_active_session(user_id, book, minutes_ago, last_seen_minutes_ago=None):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    last_seen = None if last_seen_minutes_ago is None else now - datetime.timedelta(minutes=last_seen_minutes_ago)
+    return ReadingSession.objects.create(user_id=user_id, book=book,
+                                         start_time=now - datetime.timedelta(minutes=minutes_ago),
+                                         last_seen=last_seen)
+
+
+@pytest.mark.django_db
+class TestReadingSessionHeartbeat:
+    def test_heartbeat(self, api_client, test_user):
+        response = api_client.get('/api/v1/reading-session-heartbeat/')
+        assert response.status_code == 200
+        assert response.data['message'] == 'Heartbeat received'
+        assert response['X-DB-Query-Count'] == '1'
+        assert list(get_heartbeats().pop_all()) == [test_user]
+
+    def test_heartbeat_not_authenticated(self, api_client):
+        assert api_client.get('/api/v1/reading-session-heartbeat/').status_code == 401
+
+    def test_flush_heartbeats(self, api_client, create_book_1, test_user, django_assert_num_queries):
+        session = create_active_session(test_user, create_book_1, minutes_ago=30)
+        other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+        # A heartbeat sent before the session started belongs to an earlier session
+        create_active_session(other_user.id, create_book_1, minutes_ago=1)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        get_heartbeats().record(other_user.id, (now - datetime.timedelta(minutes=5)).timestamp())
+        api_client.get('/api/v1/reading-session-heartbeat/')
+
+        with django_assert_num_queries(2):
+            assert flush_reading_session_heartbeats(batch_size=10) == 1
+        session.refresh_from_db()
+        assert now <= session.last_seen <= datetime.datetime.now(datetime.timezone.utc)
+        assert ReadingSession.objects.get(user=other_user).last_seen is None
+        # The heartbeats are flushed once
+        assert flush_of_reading_session_heartbeats() == 0
+
+    def test_heartbeats_are_kept_when_flush_fails(self, api_client, create_book_1, test_user):
+        create_active_session(test_user, create_book_1, minutes_ago=30)
+        api_client.get('/api/v1/reading-session-heartbeat/')
+        last_seen = get_heartbeats().pop_all()
+        get_heartbeats().restore(last_seen)
+
+        with mock.patch('django.db.models.query.QuerySet.bulk_update', side_effect=ConnectionError):
+            with pytest.raises(ConnectionError):
+                flush_reading_session_heartbeats(batch_size=10)
+        assert flush_reading_session_heartbeats(batch_size=10) == 1
+        assert ReadingSession.objects.get(user_id=test_user).last_seen.timestamp() == last_seen[test_user]
+
+
+@pytest.mark.django_db
+class TestClosingOfIdleReadingSessions:
+    def test_close_idle_reading_sessions(self, create_book_1, create_book_2, test_user):
+        idle_session = create_active_session(test_user, create_book_1, minutes_ago=60, last_seen_minutes_ago=20)
+        users = [User.objects.create_user(username=f'user{i}', password='password') for i in range(3)]
+        read_session = create_active_session(users[0].id, create_book_1, minutes_ago=60, last_seen_minutes_ago=20)
+        get_heartbeats().record(users[0].id, datetime.datetime.now(datetime.timezone.utc).timestamp())
+        abandoned_session = create_active_session(users[1].id, create_book_2, minutes_ago=13 * 60)
+        new_session = create_active_session(users[2].id, create_book_2, minutes_ago=60)
+
+        assert closing_of_idle_reading_sessions() == 2
+
+        idle_session.refresh_from_db()
+        assert idle_session.end_time == idle_session.last_seen
+        assert idle_session.duration == datetime.timedelta(minutes=40)
+        assert ReadingStatistics.objects.get(user_id=test_user).total_reading_time == datetime.timedelta(minutes=40)
+        assert UserStatistics.objects.get(user_id=test_user).total_reading_time == datetime.timedelta(minutes=40)
+        assert sum((statistics.reading_time for statistics in DailyReadingStatistics.objects.all()),
+                   datetime.timedelta()) == datetime.timedelta(minutes=40)
+
+        # A session without heartbeats adds no reading time
+        abandoned_session.refresh_from_db()
+        assert abandoned_session.end_time == abandoned_session.start_time
+        assert not ReadingStatistics.objects.filter(user=users[1]).exists()
+
+        assert ReadingSession.objects.get(id=read_session.id).end_time is None
+        assert ReadingSession.objects.get(id=new_session.id).end_time is None
+
+    def test_heartbeat_tasks_require_shared_heartbeats(self, create_book_1, test_user, monkeypatch):
+        monkeypatch.setattr(LocalHeartbeats, 'shared', False)
+        session = create_active_session(test_user, create_book_1, minutes_ago=13 * 60)
+        get_heartbeats().record(test_user, datetime.datetime.now(datetime.timezone.utc).timestamp())
+
+        assert flush_of_reading_session_heartbeats() == 0
+        assert closing_of_idle_reading_sessions() == 0
+        assert ReadingSession.objects.get(id=session.id).end_time is None
+        assert list(get_heartbeats().pop_all()) == [test_user]
+
+    def test_close_idle_reading_sessions_in_batches(self, create_book_1, settings):
+        settings.STATISTICS_BATCH_SIZE = 2
+        for i in range(5):
+            user = User.objects.create_user(username=f'user{i}', password='password')
+            create_active_session(user.id, create_book_1, minutes_ago=60, last_seen_minutes_ago=30)
+
+        closing_of_idle_reading_sessions()
+        assert not ReadingSession.objects.filter(end_time__isnull=True).exists()
+        assert ReadingStatistics.objects.count() == 5
@@ -0,0 +1,49 @@
+import pytest
+
+from book_reading.metrics import view_metrics
+from book_reading.middleware import QueryBudgetExceeded
+
+from .test_views import api_client, create_book_1
+
+
+@pytest.fixture(autouse=True)
+def reset_view_metrics():
+    view_metrics.reset()
+
+
+@pytest.mark.django_db
+class TestQueryMetricsMiddleware:
+    def test_response_headers(self, api_client, create_book_1):
+        response = api_client.get("/api/v1/books/")
+        assert response["X-DB-Query-Count"] == "1"
+        assert float(response["X-DB-Time-Ms"]) >= 0
+        assert float(response["X-Response-Time-Ms"]) >= float(response["X-DB-Time-Ms"])
+        assert response["Server-Timing"].startswith("db;dur=")
+
+    def test_metrics_url(self, api_client, create_book_1):
+        api_client.get("/api/v1/books/")
+        api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+
+        response = api_client.get("/metrics/")
+        assert response.status_code == 200
+        metrics = response.content.decode()
+        assert 'http_requests_total{view="books"} 1' in metrics
+        assert 'http_db_queries_total{view="book_details"} 1' in metrics
+        assert 'http_request_duration_seconds_count{view="books"} 1' in metrics
+
+    def test_metrics_url_is_not_available_remotely(self, api_client):
+        response = api_client.get("/metrics/", REMOTE_ADDR="10.0.0.1")
+        assert response.status_code == 404
+
+    def test_query_budget_exceeded(self, api_client, create_book_1, settings):
+        settings.QUERY_BUDGETS = {"books": 0}
+        with pytest.raises(QueryBudgetExceeded):
+            api_client.get("/api/v1/books/")
+
+    def test_query_budget_exceeded_is_logged_when_not_strict(self, api_client, create_book_1, settings, caplog):
+        settings.QUERY_BUDGETS = {"books": 0}
+        settings.QUERY_BUDGETS_STRICT = False
+        response = api_client.get("/api/v1/books/")
+        assert response.status_code == 200
+        assert "View books made 1 database queries, its budget is 0" in caplog.text
+        assert 'http_query_budget_exceeded_total{view="books"} 1' in view_metrics.to_prometheus()
@@ -0,0 +1,97 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+BASELINE = ('book_reading', '0001_initial')
+DAILY_READING_STATISTICS = ('book_reading', '0002_daily_reading_statistics')
+UNIQUE_ACTIVE_SESSION_AND_STATISTICS = ('book_reading', '0004_unique_active_session_and_statistics')
+
+
+@pytest.fixture
+def migrate():
+    """
+    Returns a function which migrates the database to a migration of book_reading and returns the models
+    of its state. The database is migrated back to the latest migrations after the test.
+    """
+    def migrate_to(target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    yield migrate_to
+    executor = MigrationExecutor(connection)
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_daily_reading_statistics_migration_fills_finished_sessions(migrate):
+    apps = migrate(BASELINE)
+    user = apps.get_model('auth', 'User').objects.create(username='testusername')
+    book = apps.get_model('book_reading', 'Book').objects.create(
+        title='Book', author='Author', year_published=2000, short_description='Short', full_description='Full',
+    )
+    ReadingSession = apps.get_model('book_reading', 'ReadingSession')
+    # 22:00 - 02:00 in Kiev (UTC+2 in January) is split by midnight, 10:00 - 11:00 adds to the second day
+    for start_time, end_time in (
+        (datetime.datetime(2023, 1, 1, 20, tzinfo=datetime.timezone.utc),
+         datetime.datetime(2023, 1, 2, 0, tzinfo=datetime.timezone.utc)),
+        (datetime.datetime(2023, 1, 2, 8, tzinfo=datetime.timezone.utc),
+         datetime.datetime(2023, 1, 2, 9, tzinfo=datetime.timezone.utc)),
+    ):
+        session = ReadingSession.objects.create(user=user, book=book)
+        ReadingSession.objects.filter(id=session.id).update(start_time=start_time, end_time=end_time,
+                                                            duration=end_time - start_time)
+    # The active session has no reading time yet
+    ReadingSession.objects.create(user=user, book=book)
+
+    apps = migrate(DAILY_READING_STATISTICS)
+    DailyReadingStatistics = apps.get_model('book_reading', 'DailyReadingStatistics')
+    assert list(DailyReadingStatistics.objects.order_by('date').values_list('user_id', 'date', 'reading_time')) == [
+        (user.id, datetime.date(2023, 1, 1), datetime.timedelta(hours=2)),
+        (user.id, datetime.date(2023, 1, 2), datetime.timedelta(hours=3)),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestUniqueActiveSessionAndStatisticsMigration:
+    def test_closes_duplicate_active_sessions(self, migrate):
+        apps = migrate(BASELINE)
+        user = apps.get_model('auth', 'User').objects.create(username='testusername')
+        book = apps.get_model('book_reading', 'Book').objects.create(
+            title='Book', author='Author', year_published=2000, short_description='Short', full_description='Full',
+        )
+        ReadingSession = apps.get_model('book_reading', 'ReadingSession')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        sessions = [ReadingSession.objects.create(user=user, book=book) for _ in range(3)]
+        # start_time is set by auto_now_add on create in the baseline schema
+        for hours_ago, session in zip((3, 1, 2), sessions):
+            ReadingSession.objects.filter(id=session.id).update(start_time=now - datetime.timedelta(hours=hours_ago))
+
+        apps = migrate(UNIQUE_ACTIVE_SESSION_AND_STATISTICS)
+        ReadingSession = apps.get_model('book_reading', 'ReadingSession')
+        assert list(ReadingSession.objects.filter(end_time__isnull=True).values_list('id', flat=True)) == \
+               [sessions[1].id]
+        for session in ReadingSession.objects.filter(end_time__isnull=False):
+            assert session.end_time == session.start_time
+            assert session.duration == datetime.timedelta()
+
+    def test_merges_duplicate_reading_statistics(self, migrate):
+        apps = migrate(BASELINE)
+        User = apps.get_model('auth', 'User')
+        Book = apps.get_model('book_reading', 'Book')
+        user = User.objects.create(username='testusername')
+        other_user = User.objects.create(username='otherusername')
+        book = Book.objects.create(title='Book', author='Author', year_published=2000, short_description='Short',
+                                   full_description='Full')
+        ReadingStatistics = apps.get_model('book_reading', 'ReadingStatistics')
+        for hours in (1, 2, 3):
+            ReadingStatistics.objects.create(user=user, book=book, total_reading_time=datetime.timedelta(hours=hours))
+        ReadingStatistics.objects.create(user=other_user, book=book, total_reading_time=datetime.timedelta(hours=4))
+
+        apps = migrate(UNIQUE_ACTIVE_SESSION_AND_STATISTICS)
+        ReadingStatistics = apps.get_model('book_reading', 'ReadingStatistics')
+        assert set(ReadingStatistics.objects.values_list('user_id', 'total_reading_time')) == {
+            (user.id, datetime.timedelta(hours=6)), (other_user.id, datetime.timedelta(hours=4)),
+        }
@@ -6,7 +6,7 @@ import pytz
 from django.contrib.auth.models import User
 from unittest import mock
 
-from book_reading.models import Book, ReadingStatistics, ReadingSession, UserStatistics
+from book_reading.models import Book, ReadingStatistics, ReadingSession, UserStatistics, DailyReadingStatistics
 
 
 @pytest.mark.django_db
@@ -75,6 +75,24 @@ def test_user_statistics_model():
     assert user_statistics.id is not None
     assert user_statistics.user.username == 'testusername'
     assert user_statistics.total_reading_time == datetime.timedelta()
-    assert user_statistics.last_7_days_reading_time == datetime.timedelta()
-    assert user_statistics.last_30_days_reading_time == datetime.timedelta()
 
+
+@pytest.mark.django_db
+def test_daily_reading_statistics_model():
+    book = Book.objects.create(
+        title='test_title',
+        author='test_author',
+        year_published=2023,
+        short_description='test_short_description',
+        full_description='test_full_description',
+    )
+    user = User.objects.create_user(username='testusername',
+                                    password='testpassword')
+    daily_reading_statistics = DailyReadingStatistics.objects.create(book=book, user=user,
+                                                                     date=datetime.date(2023, 1, 1))
+
+    assert daily_reading_statistics.id is not None
+    assert daily_reading_statistics.book.title == 'test_title'
+    assert daily_reading_statistics.user.username == 'testusername'
+    assert daily_reading_statistics.date == datetime.date(2023, 1, 1)
+    assert daily_reading_statistics.reading_time == datetime.timedelta()
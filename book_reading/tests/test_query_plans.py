@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.db import connection, IntegrityError
+from django.db.models import Sum
+
+from book_reading.models import Book, ReadingSession, ReadingStatistics, DailyReadingStatistics
+from book_reading.services import _get_reading_sessions_not_in_daily_statistics
+
+
+def get_query_plan(queryset):
+    """
+    Returns the query plan of a queryset.
+    Sequential scans are disabled, so the plan only falls back to them if there is no usable index at all.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    return queryset.explain()
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='testusername', password='testpassword')
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason='The plans are checked on PostgreSQL')
+class TestQueryPlans:
+    def test_active_reading_session_lookup_uses_partial_unique_index(self, user):
+        plan = get_query_plan(ReadingSession.objects.filter(user=user, end_time__isnull=True))
+        assert 'unique_active_reading_session' in plan
+        assert 'Seq Scan' not in plan
+
+    def test_user_reading_sessions_for_period_use_composite_index(self, user):
+        period_of_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=7)
+        queryset = ReadingSession.objects.filter(
+            user=user, start_time__gte=period_of_time
+        ).values('user_id').annotate(total_duration=Sum('duration'))
+        plan = get_query_plan(queryset)
+        assert 'reading_session_user_start_idx' in plan
+        assert 'Seq Scan' not in plan
+
+    def test_daily_reading_statistics_for_period_use_composite_index(self, user):
+        first_day = datetime.date.today() - datetime.timedelta(days=6)
+        queryset = DailyReadingStatistics.objects.filter(
+            user=user, date__gte=first_day
+        ).values('user_id').annotate(total_reading_time=Sum('reading_time'))
+        plan = get_query_plan(queryset)
+        assert 'daily_reading_user_date_idx' in plan
+        assert 'Seq Scan' not in plan
+
+    def test_reading_sessions_for_periods_do_not_scan_all_sessions(self, user):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        windows = [(now - datetime.timedelta(days=7), now - datetime.timedelta(days=6)),
+                   (now - datetime.timedelta(hours=1), now)]
+        plan = get_query_plan(_get_reading_sessions_not_in_daily_statistics(user.id, windows))
+        assert 'reading_session_user_start_idx' in plan
+        assert 'Seq Scan' not in plan
+
+
+@pytest.mark.django_db
+def test_reading_statistics_are_unique_per_user_and_book(user):
+    book = Book.objects.create(title='test_title', author='test_author', year_published=2023,
+                               short_description='test_short_description',
+                               full_description='test_full_description')
+    ReadingStatistics.objects.create(user=user, book=book)
+    with pytest.raises(IntegrityError):
+        ReadingStatistics.objects.create(user=user, book=book)
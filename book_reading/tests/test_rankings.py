@@ -0,0 +1,134 @@
+import datetime
+import io
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+
+from book_reading.rankings import LocalRankings, period_label, ranking_key, add_reading_time_to_rankings, \
+    get_rankings, READERS, BOOKS, _period_end
+from book_reading.services import KIEV_TZ, timedelta_to_string, create_reading_sessions_and_get_message, \
+    end_reading_session_and_get_message, get_top_readers
+
+from .test_views import api_client, create_book_1, create_book_2, test_user
+
+
+@pytest.fixture
+def reading_sessions(create_book_1, create_book_2, test_user):
+    """Returns an hour of reading of the first book and a minute of reading of the second book"""
+    start_time = datetime.datetime.now(KIEV_TZ) - datetime.timedelta(minutes=62)
+    return [
+        {'book_id': create_book_1.id, 'start_time': start_time, 'end_time': start_time + datetime.timedelta(hours=1)},
+        {'book_id': create_book_2.id, 'start_time': start_time + datetime.timedelta(hours=1),
+         'end_time': start_time + datetime.timedelta(minutes=61)},
+    ]
+
+
+class TestLocalRankings:
+    def test_top_and_rank(self):
+        rankings = LocalRankings()
+        rankings.increment({('key', 1): 10, ('key', 2): 30, ('key', 3): 20}, {})
+        rankings.increment({('key', 1): 25}, {})
+
+        assert rankings.top('key', 2) == [(1, 35), (2, 30)]
+        assert rankings.rank('key', 3) == (3, 20)
+        assert rankings.rank('key', 4) is None
+        assert rankings.top('other', 10) == []
+
+    def test_replace(self):
+        rankings = LocalRankings()
+        rankings.increment({('key', 1): 10, ('old', 1): 10}, {})
+        rankings.replace([({('key', 2): 5}, {}), ({('key', 2): 5, ('key', 3): 20}, {})])
+
+        assert rankings.top('key', 10) == [(3, 20), (2, 10)]
+        assert rankings.rank('key', 1) is None
+        assert rankings.top('old', 10) == []
+
+    def test_expired_rankings_are_removed(self):
+        rankings = LocalRankings()
+        rankings.increment({('old', 1): 10}, {'old': 0})
+        rankings.increment({('new', 1): 10}, {})
+        assert rankings.top('old', 10) == []
+        assert rankings.top('new', 10) == [(1, 10)]
+
+
+class TestPeriods:
+    def test_period_label(self):
+        assert period_label('week', datetime.date(2023, 1, 2)) == '2023-W01'
+        assert period_label('week', datetime.date(2023, 1, 1)) == '2022-W52'
+        assert period_label('month', datetime.date(2023, 1, 31)) == '2023-01'
+
+    def test_period_end(self):
+        assert _period_end('week', datetime.date(2023, 1, 4)) == datetime.date(2023, 1, 9)
+        assert _period_end('week', datetime.date(2023, 1, 8)) == datetime.date(2023, 1, 9)
+        assert _period_end('month', datetime.date(2023, 12, 31)) == datetime.date(2024, 1, 1)
+
+    def test_reading_time_is_added_to_week_and_month_of_its_day(self):
+        add_reading_time_to_rankings({(1, 2, datetime.date(2023, 1, 1)): datetime.timedelta(minutes=1)})
+        assert get_rankings().top(ranking_key(READERS, 'week', datetime.date(2022, 12, 26)), 10) == [(1, 60)]
+        assert get_rankings().top(ranking_key(BOOKS, 'month', datetime.date(2023, 1, 31)), 10) == [(2, 60)]
+
+    def test_rankings_errors_are_logged(self):
+        with mock.patch.object(get_rankings(), 'increment', side_effect=ConnectionError):
+            add_reading_time_to_rankings({(1, 2, datetime.date(2023, 1, 1)): datetime.timedelta(minutes=1)})
+
+
+@pytest.mark.django_db
+class TestRankings:
+    def test_ended_session_is_added_to_rankings(self, api_client, create_book_1, test_user,
+                                                django_capture_on_commit_callbacks):
+        mocked = datetime.datetime.now() - datetime.timedelta(minutes=30)
+        with mock.patch('django.utils.timezone.now', mock.Mock(return_value=mocked)):
+            api_client.get(f"/api/v1/start-reading-session/{create_book_1.id}/")
+        with django_capture_on_commit_callbacks(execute=True):
+            end_reading_session_and_get_message(user=test_user)
+
+        result = get_top_readers(user=test_user, period='week', limit=10)
+        assert [reader['Username'] for reader in result['Top readers']] == ['testusername']
+        assert result['Your rank'] == 1
+        assert result['Your reading time'] == timedelta_to_string(datetime.timedelta(minutes=30))
+
+    def test_top_readers_url(self, api_client, test_user, reading_sessions, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            create_reading_sessions_and_get_message(test_user, reading_sessions)
+
+        response = api_client.get("/api/v1/rankings/readers/?period=month")
+        assert response.status_code == 200
+        assert response.data['Period'] == datetime.datetime.now(KIEV_TZ).strftime('%Y-%m')
+        assert response.data['Top readers'] == [{'Rank': 1, 'Username': 'testusername',
+                                                 'Reading time': timedelta_to_string(datetime.timedelta(minutes=61))}]
+
+    def test_most_read_books_url(self, api_client, create_book_1, create_book_2, test_user, reading_sessions,
+                                 django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            create_reading_sessions_and_get_message(test_user, reading_sessions)
+
+        response = api_client.get("/api/v1/rankings/books/?limit=1")
+        assert response.status_code == 200
+        assert [book['Book']['id'] for book in response.data['Most read books']] == [create_book_1.id]
+        assert response.data['Most read books'][0]['Reading time'] == \
+               timedelta_to_string(datetime.timedelta(hours=1))
+
+    def test_rankings_url_invalid_period(self, api_client, test_user):
+        assert api_client.get("/api/v1/rankings/readers/?period=year").status_code == 400
+        assert api_client.get("/api/v1/rankings/books/?limit=0").status_code == 400
+
+    def test_rebuild_rankings(self, api_client, create_book_1, create_book_2, test_user, reading_sessions):
+        # The rankings are not updated, since the commit callbacks are not run
+        create_reading_sessions_and_get_message(test_user, reading_sessions)
+        assert get_top_readers(user=test_user, period='week', limit=10)['Top readers'] == []
+
+        stdout = io.StringIO()
+        call_command('rebuildrankings', stdout=stdout)
+        assert 'from 2 daily reading statistics rows' in stdout.getvalue()
+        result = get_top_readers(user=test_user, period='week', limit=10)
+        assert result['Your reading time'] == timedelta_to_string(datetime.timedelta(minutes=61))
+
+    def test_rebuild_rankings_replaces_wrong_rankings(self, create_book_1, test_user, reading_sessions):
+        create_reading_sessions_and_get_message(test_user, reading_sessions)
+        day = reading_sessions[0]['start_time'].date()
+        add_reading_time_to_rankings({(test_user, create_book_1.id, day): datetime.timedelta(hours=5),
+                                      (test_user + 1, create_book_1.id, day): datetime.timedelta(hours=1)})
+
+        call_command('rebuildrankings', stdout=io.StringIO())
+        assert get_rankings().top(ranking_key(READERS, 'week', day), 10) == [(test_user, 61 * 60)]
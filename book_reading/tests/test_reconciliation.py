@@ -0,0 +1,138 @@
+import datetime
+import io
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+
+from book_reading.models import ReadingStatistics, UserStatistics, BookStatistics, ReconciliationCheckpoint
+from book_reading.reconciliation import reconcile_reading_statistics, _compute_reading_time
+from book_reading.services import start_reading_session_and_get_message, end_reading_session_and_get_message, \
+    get_user_reading_statistics, get_user_statistics
+from book_reading.tasks import reconciliation_of_reading_statistics
+
+from .test_views import api_client, create_book_1, create_book_2, test_user, reading_a_book_for_two_hours
+
+
+def stored_statistics():
+    return (
+        set(ReadingStatistics.objects.values_list('user_id', 'book_id', 'total_reading_time')),
+        set(UserStatistics.objects.values_list('user_id', 'total_reading_time')),
+        set(BookStatistics.objects.values_list('book_id', 'total_reading_time', 'readers_count', 'sessions_count',
+                                               'last_read_at')),
+    )
+
+
+@pytest.fixture
+def read_books(api_client, create_book_1, create_book_2, test_user, reading_a_book_for_two_hours):
+    """Two users read the books, so every kind of statistics has rows"""
+    other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+    for user_id, book in ((test_user, create_book_2), (other_user.id, create_book_1)):
+        start_reading_session_and_get_message(user=user_id, book_id=book.id)
+        end_reading_session_and_get_message(user=user_id)
+    return other_user.id
+
+
+@pytest.mark.django_db
+class TestReconcileReadingStatistics:
+    def test_consistent_statistics_are_not_changed(self, read_books):
+        expected = stored_statistics()
+        report = reconcile_reading_statistics(full=True, log=lambda message: None)
+
+        assert report['users'] == 2
+        assert report['books'] == 2
+        assert report['reading_statistics'] == report['user_statistics'] == report['book_statistics'] == 0
+        assert stored_statistics() == expected
+
+    def test_lost_updates_are_repaired(self, read_books, create_book_1, create_book_2, test_user):
+        expected = stored_statistics()
+        ReadingStatistics.objects.filter(user_id=test_user, book=create_book_1).update(
+            total_reading_time=datetime.timedelta(minutes=5))
+        ReadingStatistics.objects.filter(user_id=test_user, book=create_book_2).delete()
+        UserStatistics.objects.filter(user_id=read_books).delete()
+        BookStatistics.objects.filter(book=create_book_1).update(sessions_count=1, readers_count=1)
+
+        report = reconcile_reading_statistics(full=True, chunk_size=1, log=lambda message: None)
+        assert report['reading_statistics'] == 2
+        assert report['user_statistics'] == 1
+        assert report['book_statistics'] == 1
+        assert report['reading_time_corrected'] >= datetime.timedelta(hours=1, minutes=55)
+        assert stored_statistics() == expected
+
+    def test_rows_created_meanwhile_do_not_stop_the_repair(self, read_books, create_book_1, create_book_2,
+                                                           test_user):
+        expected = stored_statistics()
+        concurrent_row = ReadingStatistics.objects.get(user_id=test_user, book=create_book_2)
+        ReadingStatistics.objects.filter(book=create_book_2).delete()
+        ReadingStatistics.objects.filter(user_id=read_books).delete()
+
+        def compute_reading_time_while_a_session_ends(*args):
+            # The row is created by a session ended after the stored rows were read
+            reading_time = _compute_reading_time(*args)
+            concurrent_row.save(force_insert=True)
+            return reading_time
+
+        with mock.patch('book_reading.reconciliation._compute_reading_time',
+                        side_effect=compute_reading_time_while_a_session_ends):
+            report = reconcile_reading_statistics(full=True, log=lambda message: None)
+        assert report['reading_statistics'] == 1
+        assert stored_statistics() == expected
+
+    def test_repairs_are_not_hidden_by_the_statistics_cache(self, read_books, create_book_1, test_user):
+        expected = get_user_reading_statistics(user=test_user, book_id=create_book_1.id)
+        total_reading_time = get_user_statistics(user=test_user)['total_reading_time']
+        ReadingStatistics.objects.filter(user_id=test_user).update(total_reading_time=datetime.timedelta())
+        UserStatistics.objects.filter(user_id=test_user).update(total_reading_time=datetime.timedelta())
+
+        reconcile_reading_statistics(full=True, log=lambda message: None)
+        assert get_user_reading_statistics(user=test_user, book_id=create_book_1.id) == expected
+        assert get_user_statistics(user=test_user)['total_reading_time'] == total_reading_time
+
+    def test_incremental_run_checks_users_with_changed_sessions(self, read_books, create_book_1, test_user,
+                                                                settings):
+        settings.RECONCILIATION_CHECKPOINT_OVERLAP = 0
+        reconcile_reading_statistics(log=lambda message: None)
+        ReadingStatistics.objects.filter(user_id=test_user).update(total_reading_time=datetime.timedelta())
+        UserStatistics.objects.filter(user_id=read_books).update(total_reading_time=datetime.timedelta())
+
+        start_reading_session_and_get_message(user=read_books, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=read_books)
+        report = reconcile_reading_statistics(log=lambda message: None)
+        assert report['users'] == 1
+        assert report['user_statistics'] == 1
+        assert report['reading_statistics'] == 0
+        assert ReadingStatistics.objects.filter(user_id=test_user, total_reading_time=datetime.timedelta()).count() == 2
+
+        # Nothing has changed since the previous run
+        assert reconcile_reading_statistics(log=lambda message: None)['users'] == 0
+        assert reconcile_reading_statistics(full=True, log=lambda message: None)['reading_statistics'] == 2
+
+    def test_checkpoint_is_kept_in_the_database(self, read_books, test_user, settings):
+        settings.RECONCILIATION_CHECKPOINT_OVERLAP = 0
+        reconcile_reading_statistics(log=lambda message: None)
+        reconcile_reading_statistics(log=lambda message: None)
+        assert ReconciliationCheckpoint.objects.count() == 1
+
+        for cache in caches.all():
+            cache.clear()
+        assert reconcile_reading_statistics(log=lambda message: None)['users'] == 0
+
+    def test_pending_sessions_are_not_counted(self, read_books, create_book_1, test_user, settings):
+        settings.STATISTICS_UPDATE_MODE = 'async'
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=test_user)
+
+        report = reconcile_reading_statistics(full=True, log=lambda message: None)
+        assert report['reading_statistics'] == report['user_statistics'] == report['book_statistics'] == 0
+
+    def test_reconciliation_task_and_command(self, read_books, test_user):
+        UserStatistics.objects.filter(user_id=test_user).update(total_reading_time=datetime.timedelta())
+        assert reconciliation_of_reading_statistics()['user_statistics'] == 1
+
+        UserStatistics.objects.filter(user_id=test_user).update(total_reading_time=datetime.timedelta())
+        stdout = io.StringIO()
+        call_command('reconcilestatistics', full=True, stdout=stdout)
+        assert 'Checked 2 users and 2 books, repaired 0 book reading statistics (0 min 0 sec), ' \
+               '1 user statistics' in stdout.getvalue()
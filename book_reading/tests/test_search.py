@@ -0,0 +1,77 @@
+import pytest
+from django.db import connection
+
+from book_reading.models import Book
+from book_reading.search import search_books
+
+from .test_views import api_client
+
+
+@pytest.fixture
+def catalogue():
+    """Creates books of two authors published in two years"""
+    books = [
+        ('War and Peace', 'Leo Tolstoy', 1869, 'A novel about the Napoleonic wars'),
+        ('Anna Karenina', 'Leo Tolstoy', 1878, 'A novel about a tragic love'),
+        ('Crime and Punishment', 'Fyodor Dostoevsky', 1866, 'A novel about a murder'),
+        ('The Idiot', 'Fyodor Dostoevsky', 1869, 'A story of a kind prince'),
+    ]
+    return [Book.objects.create(title=title, author=author, year_published=year, short_description=description,
+                                full_description=f'{description}.') for title, author, year, description in books]
+
+
+@pytest.mark.django_db
+class TestBookSearch:
+    def test_search(self, api_client, catalogue):
+        response = api_client.get('/api/v1/books/search/', {'q': 'tolstoy'})
+        assert response.status_code == 200
+        assert response.data['count'] == 2
+        assert {book['id'] for book in response.data['results']} == {catalogue[0].id, catalogue[1].id}
+        assert set(response.data['results'][0]) == {'id', 'title', 'author', 'year_published', 'short_description',
+                                                    'statistics'}
+        assert response.data['facets'] == {'year_published': [{'value': 1878, 'count': 1},
+                                                              {'value': 1869, 'count': 1}]}
+
+    def test_search_by_description_with_year_facet(self, api_client, catalogue):
+        response = api_client.get('/api/v1/books/search/', {'q': 'novel', 'year_published': 1869})
+        assert response.data['count'] == 1
+        assert [book['id'] for book in response.data['results']] == [catalogue[0].id]
+        # The facets show all years of the matches, so the filter can be changed
+        assert response.data['facets'] == {'year_published': [{'value': 1878, 'count': 1},
+                                                              {'value': 1869, 'count': 1},
+                                                              {'value': 1866, 'count': 1}]}
+
+    def test_search_page(self, catalogue, django_assert_num_queries):
+        with django_assert_num_queries(2):
+            result = search_books('novel', limit=2, offset=2)
+        assert result['count'] == 3
+        assert len(result['results']) == 1
+
+    def test_search_cache_invalidated_on_book_change(self, api_client, catalogue):
+        assert api_client.get('/api/v1/books/search/', {'q': 'karamazov'}).data['count'] == 0
+        Book.objects.create(title='The Brothers Karamazov', author='Fyodor Dostoevsky', year_published=1880,
+                            short_description='A philosophical novel', full_description='A philosophical novel.')
+        response = api_client.get('/api/v1/books/search/', {'q': 'karamazov'})
+        assert response.data['count'] == 1
+        assert response['X-DB-Query-Count'] == '2'
+        assert api_client.get('/api/v1/books/search/', {'q': 'karamazov'})['X-DB-Query-Count'] == '0'
+
+    def test_search_invalid_parameters(self, api_client, settings):
+        assert api_client.get('/api/v1/books/search/').status_code == 400
+        response = api_client.get('/api/v1/books/search/', {'q': 'war', 'limit': settings.BOOK_SEARCH_MAX_LIMIT + 1})
+        assert response.status_code == 400
+
+    def test_search_vector_is_saved_with_book(self, catalogue, django_assert_num_queries):
+        catalogue[0].title = 'War and Peace, Volume 1'
+        with django_assert_num_queries(1):
+            catalogue[0].save()
+        assert [book['id'] for book in search_books('volume')['results']] == [catalogue[0].id]
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='Full-text and trigram search require PostgreSQL')
+    def test_full_text_and_fuzzy_author_search(self, catalogue):
+        catalogue[0].refresh_from_db()
+        assert catalogue[0].search_vector
+
+        # Stemmed words of the descriptions and a misspelt author
+        assert {book['id'] for book in search_books('wars')['results']} == {catalogue[0].id}
+        assert {book['id'] for book in search_books('Dostoevski')['results']} == {catalogue[2].id, catalogue[3].id}
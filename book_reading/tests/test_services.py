@@ -1,15 +1,27 @@
 import datetime
+import io
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, IntegrityError
+from django.db.models import Sum
 
+from book_reading.models import UserStatistics, DailyReadingStatistics, ReadingStatistics, ReadingSession, \
+    BookStatistics
 from book_reading.services import timedelta_to_string, collect_user_reading_statistics,\
     start_reading_session_and_get_message, end_reading_session_and_get_message,\
-    get_user_statistics, get_user_reading_statistics
+    get_user_statistics, get_user_reading_statistics, split_reading_time_by_days, KIEV_TZ, \
+    _update_daily_reading_statistics, get_reading_time_for_periods, create_reading_sessions_and_get_message, \
+    get_user_reading_statistics_for_books, rebuild_book_statistics, rebuild_daily_reading_statistics
 
 from .test_views import api_client, create_book_1, create_book_2, test_user,\
     reading_a_book_for_two_hours, start_reading_session
 from ..serializers import BookWithoutFullDescriptionSerializer
-from ..tasks import daily_collection_of_user_statistics
+from ..cache import get_statistics_cache
+from ..tasks import batch_update_of_reading_statistics, PENDING_STATISTICS_SCHEDULED_CACHE_KEY
 
 
 class TestTimedeltaToString:
@@ -80,6 +92,11 @@ class TestEndReadingSessionAndGetMessage:
         result = end_reading_session_and_get_message(user=test_user)
         assert result.get("message") == "There is currently no book reading session started"
 
+    def test_start_reading_session_does_not_hide_other_integrity_errors(self, create_book_1, api_client, test_user):
+        with mock.patch('book_reading.services.ReadingSession.objects.create', side_effect=IntegrityError):
+            with pytest.raises(IntegrityError):
+                start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+
 
 @pytest.mark.django_db
 class TestGetUserStatistics:
@@ -92,15 +109,58 @@ class TestGetUserStatistics:
     def test_get_user_statistics(self, api_client, create_book_1, test_user, reading_a_book_for_two_hours):
         result = get_user_statistics(user=test_user)
         assert timedelta_to_string(result.get("total_reading_time")) == timedelta_to_string(datetime.timedelta(hours=2))
-        assert timedelta_to_string(result.get("last_7_days_reading_time")) == timedelta_to_string(datetime.timedelta())
-        assert timedelta_to_string(result.get("last_30_days_reading_time")) == timedelta_to_string(datetime.timedelta())
+        assert timedelta_to_string(result.get("last_7_days_reading_time")) == \
+               timedelta_to_string(datetime.timedelta(hours=2))
+        assert timedelta_to_string(result.get("last_30_days_reading_time")) == \
+               timedelta_to_string(datetime.timedelta(hours=2))
 
-    def test_get_user_statistics_with_celery_task(self, api_client, create_book_1, test_user, reading_a_book_for_two_hours):
-        daily_collection_of_user_statistics()
-        result = get_user_statistics(user=test_user)
+    def test_get_user_statistics_for_periods(self, api_client, create_book_1, test_user, reading_a_book_for_two_hours):
+        result = get_user_statistics(user=test_user, periods={'last_3_hours': datetime.timedelta(hours=3)})
         assert timedelta_to_string(result.get("total_reading_time")) == timedelta_to_string(datetime.timedelta(hours=2))
-        assert timedelta_to_string(result.get("last_7_days_reading_time")) == timedelta_to_string(datetime.timedelta(hours=2))
-        assert timedelta_to_string(result.get("last_30_days_reading_time")) == timedelta_to_string(datetime.timedelta(hours=2))
+        assert timedelta_to_string(result.get("last_3_hours")) == timedelta_to_string(datetime.timedelta(hours=2))
+
+
+@pytest.mark.django_db
+class TestGetReadingTimeForPeriods:
+    @staticmethod
+    def kiev_time(days_ago, hour, minute=0):
+        date = datetime.datetime.now(KIEV_TZ).date() - datetime.timedelta(days=days_ago)
+        return KIEV_TZ.localize(datetime.datetime.combine(date, datetime.time(hour, minute)))
+
+    def test_reading_time_for_periods_without_reading(self, api_client, create_book_1, test_user):
+        assert get_reading_time_for_periods(test_user, [datetime.timedelta(days=7)]) == [datetime.timedelta()]
+
+    def test_reading_time_for_periods_with_active_session(self, api_client, create_book_1, test_user):
+        mocked = datetime.datetime.now() - datetime.timedelta(hours=1)
+        with mock.patch('django.utils.timezone.now', mock.Mock(return_value=mocked)):
+            start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+
+        last_7_days, last_30_minutes = get_reading_time_for_periods(
+            test_user, [datetime.timedelta(days=7), datetime.timedelta(minutes=30)]
+        )
+        assert abs(last_7_days - datetime.timedelta(hours=1)) < datetime.timedelta(seconds=1)
+        assert abs(last_30_minutes - datetime.timedelta(minutes=30)) < datetime.timedelta(seconds=1)
+
+    def test_reading_time_for_periods_starting_inside_a_session(self, api_client, create_book_1, test_user):
+        create_reading_sessions_and_get_message(test_user, [
+            {'book_id': create_book_1.id, 'start_time': self.kiev_time(5, 10), 'end_time': self.kiev_time(5, 12)},
+            {'book_id': create_book_1.id, 'start_time': self.kiev_time(3, 23), 'end_time': self.kiev_time(2, 1)},
+            {'book_id': create_book_1.id, 'start_time': self.kiev_time(2, 10), 'end_time': self.kiev_time(2, 11)},
+        ])
+
+        period = datetime.datetime.now(KIEV_TZ) - self.kiev_time(3, 23, 30)
+        reading_time, = get_reading_time_for_periods(test_user, [period])
+        assert abs(reading_time - datetime.timedelta(hours=2, minutes=30)) < datetime.timedelta(seconds=1)
+
+        period = datetime.datetime.now(KIEV_TZ) - self.kiev_time(5, 11)
+        reading_time, = get_reading_time_for_periods(test_user, [period])
+        assert abs(reading_time - datetime.timedelta(hours=4)) < datetime.timedelta(seconds=1)
+
+    def test_reading_time_for_periods_query_count(self, api_client, create_book_1, test_user,
+                                                  reading_a_book_for_two_hours, django_assert_num_queries):
+        periods = [datetime.timedelta(hours=1), datetime.timedelta(days=7), datetime.timedelta(days=30)]
+        with django_assert_num_queries(2):
+            get_reading_time_for_periods(test_user, periods)
 
 
 @pytest.mark.django_db
@@ -117,3 +177,317 @@ class TestGetUserReadingStatistics:
         assert result.get("Book") == book_serialized.data
         assert result.get("Total reading time") == timedelta_to_string(datetime.timedelta())
 
+
+@pytest.mark.django_db
+class TestGetUserReadingStatisticsForBooks:
+    def test_statistics_for_books(self, create_book_1, create_book_2, test_user, django_assert_num_queries):
+        other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+        ReadingStatistics.objects.create(user_id=test_user, book=create_book_1,
+                                         total_reading_time=datetime.timedelta(hours=2))
+        ReadingStatistics.objects.create(user=other_user, book=create_book_2,
+                                         total_reading_time=datetime.timedelta(hours=1))
+
+        with django_assert_num_queries(1):
+            result = get_user_reading_statistics_for_books(
+                user=test_user, book_ids=[create_book_2.id, create_book_2.id + 1, create_book_1.id, create_book_2.id]
+            )
+        assert result['Statistics'] == [
+            {'Book': BookWithoutFullDescriptionSerializer(create_book_2).data,
+             'Total reading time': timedelta_to_string(datetime.timedelta())},
+            {'Book': BookWithoutFullDescriptionSerializer(create_book_1).data,
+             'Total reading time': timedelta_to_string(datetime.timedelta(hours=2))},
+        ]
+        assert result['Not found'] == [create_book_2.id + 1]
+        # Books the user has not read get no statistics rows
+        assert not ReadingStatistics.objects.filter(user_id=test_user, book=create_book_2).exists()
+
+
+class TestSplitReadingTimeByDays:
+    def test_split_reading_time_within_one_day(self):
+        start_time = KIEV_TZ.localize(datetime.datetime(2023, 1, 1, 10, 0))
+        result = split_reading_time_by_days(start_time, start_time + datetime.timedelta(hours=2))
+        assert result == [(datetime.date(2023, 1, 1), datetime.timedelta(hours=2))]
+
+    def test_split_reading_time_across_midnight(self):
+        start_time = KIEV_TZ.localize(datetime.datetime(2023, 1, 1, 23, 0))
+        result = split_reading_time_by_days(start_time, start_time + datetime.timedelta(hours=26))
+        assert result == [(datetime.date(2023, 1, 1), datetime.timedelta(hours=1)),
+                          (datetime.date(2023, 1, 2), datetime.timedelta(hours=24)),
+                          (datetime.date(2023, 1, 3), datetime.timedelta(hours=1))]
+
+    def test_split_reading_time_uses_kiev_time_zone(self):
+        start_time = datetime.datetime(2023, 1, 1, 21, 30, tzinfo=datetime.timezone.utc)
+        result = split_reading_time_by_days(start_time, start_time + datetime.timedelta(hours=1))
+        assert result == [(datetime.date(2023, 1, 1), datetime.timedelta(minutes=30)),
+                          (datetime.date(2023, 1, 2), datetime.timedelta(minutes=30))]
+
+
+@pytest.mark.django_db
+class TestDailyReadingStatistics:
+    def test_update_daily_reading_statistics_across_midnight(self, api_client, create_book_1, test_user):
+        midnight = KIEV_TZ.localize(datetime.datetime(2023, 1, 2))
+        _update_daily_reading_statistics(user_id=test_user, book_id=create_book_1.id,
+                                         start_time=midnight - datetime.timedelta(hours=1),
+                                         end_time=midnight + datetime.timedelta(hours=2))
+        _update_daily_reading_statistics(user_id=test_user, book_id=create_book_1.id,
+                                         start_time=midnight + datetime.timedelta(hours=3),
+                                         end_time=midnight + datetime.timedelta(hours=4))
+
+        daily_statistics = DailyReadingStatistics.objects.filter(user_id=test_user).order_by('date')
+        assert [(row.date, row.reading_time) for row in daily_statistics] == [
+            (datetime.date(2023, 1, 1), datetime.timedelta(hours=1)),
+            (datetime.date(2023, 1, 2), datetime.timedelta(hours=3)),
+        ]
+
+    def test_rebuild_daily_reading_statistics(self, api_client, create_book_1, test_user,
+                                              reading_a_book_for_two_hours):
+        fields = ('user_id', 'book_id', 'date', 'reading_time')
+        expected = list(DailyReadingStatistics.objects.values_list(*fields))
+        DailyReadingStatistics.objects.all().delete()
+
+        call_command('rebuilddailystatistics', stdout=io.StringIO())
+        assert list(DailyReadingStatistics.objects.values_list(*fields)) == expected
+        # Today and yesterday (Europe/Kiev), so the session is included at any time of day
+        assert collect_user_reading_statistics(user_id=test_user, days=2) >= datetime.timedelta(hours=2)
+
+
+def book_statistics(book_id):
+    return BookStatistics.objects.filter(book_id=book_id).values_list(
+        'total_reading_time', 'readers_count', 'sessions_count', 'last_read_at'
+    ).first()
+
+
+def expected_book_statistics(book_id):
+    sessions = ReadingSession.objects.filter(book_id=book_id, end_time__isnull=False)
+    return (sessions.aggregate(Sum('duration'))['duration__sum'], sessions.values('user_id').distinct().count(),
+            sessions.count(), sessions.order_by('-end_time').values_list('end_time', flat=True).first())
+
+
+@pytest.mark.django_db
+class TestBookStatistics:
+    def test_ended_sessions_update_book_statistics(self, api_client, create_book_1, create_book_2, test_user,
+                                                   reading_a_book_for_two_hours):
+        other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=test_user)
+        start_reading_session_and_get_message(user=other_user, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=other_user)
+
+        assert book_statistics(create_book_1.id) == expected_book_statistics(create_book_1.id)
+        assert book_statistics(create_book_1.id)[1:3] == (2, 3)
+        assert book_statistics(create_book_2.id) is None
+
+    def test_batch_update_of_reading_statistics_updates_book_statistics(self, api_client, create_book_1,
+                                                                        create_book_2, test_user,
+                                                                        reading_a_book_for_two_hours, settings):
+        settings.STATISTICS_UPDATE_MODE = 'async'
+        for book in (create_book_2, create_book_1, create_book_2):
+            start_reading_session_and_get_message(user=test_user, book_id=book.id)
+            end_reading_session_and_get_message(user=test_user)
+        batch_update_of_reading_statistics()
+
+        for book in (create_book_1, create_book_2):
+            assert book_statistics(book.id) == expected_book_statistics(book.id)
+        assert book_statistics(create_book_2.id)[1:3] == (1, 2)
+
+    def test_rebuild_book_statistics(self, api_client, create_book_1, create_book_2, test_user,
+                                     reading_a_book_for_two_hours):
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_2.id)
+        end_reading_session_and_get_message(user=test_user)
+        expected = {book.id: book_statistics(book.id) for book in (create_book_1, create_book_2)}
+        BookStatistics.objects.filter(book=create_book_1).delete()
+        BookStatistics.objects.filter(book=create_book_2).update(readers_count=5)
+
+        assert rebuild_book_statistics() == 2
+        assert {book.id: book_statistics(book.id) for book in (create_book_1, create_book_2)} == expected
+
+        call_command('rebuildbookstatistics', stdout=io.StringIO())
+        assert {book.id: book_statistics(book.id) for book in (create_book_1, create_book_2)} == expected
+
+    @pytest.mark.parametrize('statistics_update_mode', ['sync', 'async'])
+    def test_reader_with_zero_reading_time_statistics(self, api_client, create_book_1, create_book_2, test_user,
+                                                      settings, statistics_update_mode):
+        settings.STATISTICS_UPDATE_MODE = statistics_update_mode
+        # Statistics with zero reading time were created by viewing the statistics of a book before reading it
+        for book in (create_book_1, create_book_2):
+            ReadingStatistics.objects.create(user_id=test_user, book=book)
+        for _ in range(2):
+            start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+            end_reading_session_and_get_message(user=test_user)
+        batch_update_of_reading_statistics()
+
+        assert book_statistics(create_book_1.id) == expected_book_statistics(create_book_1.id)
+        assert book_statistics(create_book_1.id)[1:3] == (1, 2)
+        assert rebuild_book_statistics() == 1
+        assert book_statistics(create_book_1.id)[1:3] == (1, 2)
+        assert book_statistics(create_book_2.id) is None
+
+
+@pytest.mark.django_db
+class TestReadingSessionQueryCount:
+    def test_start_reading_session_query_count(self, api_client, create_book_1, create_book_2, test_user,
+                                               django_assert_max_num_queries):
+        # The savepoint queries of the transaction are counted too
+        with django_assert_max_num_queries(5):
+            start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+
+    def test_switch_reading_session_query_count(self, api_client, create_book_1, create_book_2, test_user,
+                                                start_reading_session, django_assert_max_num_queries):
+        end_reading_session_and_get_message(user=test_user)
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_2.id)
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+
+        with django_assert_max_num_queries(10):
+            start_reading_session_and_get_message(user=test_user, book_id=create_book_2.id)
+
+    def test_end_reading_session_query_count(self, api_client, create_book_1, create_book_2, test_user,
+                                             start_reading_session, django_assert_max_num_queries):
+        end_reading_session_and_get_message(user=test_user)
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+
+        with django_assert_max_num_queries(8):
+            end_reading_session_and_get_message(user=test_user)
+
+    def test_end_reading_session_updates_statistics(self, api_client, create_book_1, test_user,
+                                                    reading_a_book_for_two_hours):
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=test_user)
+
+        assert ReadingStatistics.objects.get(user_id=test_user).total_reading_time >= datetime.timedelta(hours=2)
+        assert UserStatistics.objects.get(user_id=test_user).total_reading_time >= datetime.timedelta(hours=2)
+        assert ReadingSession.objects.filter(user_id=test_user, end_time__isnull=True).count() == 0
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason='Row locking requires concurrent PostgreSQL connections')
+def test_concurrent_reading_sessions_keep_statistics_consistent(api_client, create_book_1, create_book_2, test_user):
+    def read_books(book_ids):
+        try:
+            for book_id in book_ids:
+                start_reading_session_and_get_message(user=test_user, book_id=book_id)
+                end_reading_session_and_get_message(user=test_user)
+        finally:
+            connection.close()
+
+    book_ids = [create_book_1.id, create_book_2.id] * 10
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(read_books, [book_ids] * 8))
+
+    total_duration = ReadingSession.objects.filter(user_id=test_user).aggregate(Sum('duration'))['duration__sum']
+    books_reading_time = ReadingStatistics.objects.filter(
+        user_id=test_user
+    ).aggregate(Sum('total_reading_time'))['total_reading_time__sum']
+    assert ReadingSession.objects.filter(user_id=test_user, end_time__isnull=True).count() == 0
+    assert UserStatistics.objects.get(user_id=test_user).total_reading_time == total_duration
+    assert books_reading_time == total_duration
+    assert ReadingStatistics.objects.filter(user_id=test_user).count() == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason='Row locking requires concurrent PostgreSQL connections')
+def test_rebuild_daily_reading_statistics_concurrent_with_reading_sessions(api_client, create_book_1, test_user):
+    def read_book():
+        try:
+            for _ in range(20):
+                start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+                end_reading_session_and_get_message(user=test_user)
+        finally:
+            connection.close()
+
+    def rebuild():
+        try:
+            for _ in range(20):
+                rebuild_daily_reading_statistics()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for future in [executor.submit(read_book), executor.submit(rebuild)]:
+            future.result()
+
+    total_duration = ReadingSession.objects.filter(user_id=test_user).aggregate(Sum('duration'))['duration__sum']
+    daily_reading_time = DailyReadingStatistics.objects.filter(
+        user_id=test_user
+    ).aggregate(Sum('reading_time'))['reading_time__sum']
+    assert daily_reading_time == total_duration
+
+
+@pytest.mark.django_db
+class TestAsyncStatisticsUpdate:
+    @pytest.fixture(autouse=True)
+    def async_statistics_mode(self, settings):
+        settings.STATISTICS_UPDATE_MODE = 'async'
+
+    def test_end_reading_session_schedules_statistics_update(self, api_client, create_book_1, test_user,
+                                                             start_reading_session,
+                                                             django_capture_on_commit_callbacks):
+        with mock.patch('book_reading.tasks.batch_update_of_reading_statistics.apply_async') as apply_async:
+            with django_capture_on_commit_callbacks(execute=True):
+                end_reading_session_and_get_message(user=test_user)
+                start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+                end_reading_session_and_get_message(user=test_user)
+
+        apply_async.assert_called_once()
+        assert not UserStatistics.objects.exists()
+        assert ReadingSession.objects.filter(statistics_applied=False).count() == 2
+
+    def test_end_reading_session_when_statistics_update_cannot_be_scheduled(self, api_client, create_book_1,
+                                                                            test_user, start_reading_session,
+                                                                            django_capture_on_commit_callbacks):
+        with mock.patch('book_reading.tasks.batch_update_of_reading_statistics.apply_async',
+                        side_effect=ConnectionError('The broker is unavailable')) as apply_async:
+            with django_capture_on_commit_callbacks(execute=True):
+                response = api_client.get("/api/v1/end-reading-session/")
+            assert response.status_code == 200
+            assert ReadingSession.objects.filter(statistics_applied=False).count() == 1
+            # The next session ended tries again
+            assert get_statistics_cache().get(PENDING_STATISTICS_SCHEDULED_CACHE_KEY) is None
+
+            start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+            with django_capture_on_commit_callbacks(execute=True):
+                end_reading_session_and_get_message(user=test_user)
+        assert apply_async.call_count == 2
+
+    def test_batch_update_of_reading_statistics(self, api_client, create_book_1, create_book_2, test_user,
+                                                reading_a_book_for_two_hours):
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_2.id)
+        end_reading_session_and_get_message(user=test_user)
+        total_duration = ReadingSession.objects.aggregate(Sum('duration'))['duration__sum']
+
+        assert batch_update_of_reading_statistics() == 2
+        # Redelivered tasks do not apply the sessions again
+        assert batch_update_of_reading_statistics() == 0
+
+        assert UserStatistics.objects.get(user_id=test_user).total_reading_time == total_duration
+        assert ReadingStatistics.objects.get(user_id=test_user, book=create_book_1).total_reading_time >= \
+               datetime.timedelta(hours=2)
+        assert ReadingStatistics.objects.filter(user_id=test_user).count() == 2
+        # Today and yesterday (Europe/Kiev), so the sessions of the last two hours are included at any time of day
+        assert collect_user_reading_statistics(user_id=test_user, days=2) == total_duration
+        assert not ReadingSession.objects.filter(statistics_applied=False).exists()
+
+    def test_batch_update_of_reading_statistics_reschedules_full_batch(self, api_client, create_book_1, test_user,
+                                                                       reading_a_book_for_two_hours, settings):
+        start_reading_session_and_get_message(user=test_user, book_id=create_book_1.id)
+        end_reading_session_and_get_message(user=test_user)
+        settings.STATISTICS_BATCH_SIZE = 1
+
+        with mock.patch('book_reading.tasks.batch_update_of_reading_statistics.delay') as delay:
+            assert batch_update_of_reading_statistics() == 1
+        delay.assert_called_once()
+        assert ReadingSession.objects.filter(statistics_applied=False).count() == 1
+
+    def test_rebuild_daily_reading_statistics_skips_pending_sessions(self, api_client, create_book_1, test_user,
+                                                                     reading_a_book_for_two_hours):
+        call_command('rebuilddailystatistics', stdout=io.StringIO())
+        assert not DailyReadingStatistics.objects.exists()
+
+        assert batch_update_of_reading_statistics() == 1
+        total_duration = ReadingSession.objects.aggregate(Sum('duration'))['duration__sum']
+        assert DailyReadingStatistics.objects.aggregate(Sum('reading_time'))['reading_time__sum'] == total_duration
+
+    def test_reading_time_for_periods_includes_pending_sessions(self, api_client, create_book_1, test_user,
+                                                                reading_a_book_for_two_hours):
+        assert not DailyReadingStatistics.objects.exists()
+        last_7_days, = get_reading_time_for_periods(test_user, [datetime.timedelta(days=7)])
+        assert timedelta_to_string(last_7_days) == timedelta_to_string(datetime.timedelta(hours=2))
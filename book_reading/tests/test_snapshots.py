@@ -0,0 +1,115 @@
+import datetime
+import io
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+
+from book_reading.archive import archive_reading_sessions
+from book_reading.models import ReadingSession
+from book_reading.services import KIEV_TZ, end_reading_session_and_get_message
+from book_reading.snapshot_queries import read_manifest, reading_time_by_user, reading_time_by_book, \
+    reading_time_by_day
+from book_reading.snapshots import export_analytics_snapshot
+
+from .test_views import api_client, create_book_1, create_book_2, test_user
+
+
+@pytest.fixture(autouse=True)
+def snapshot_settings(settings):
+    # Sessions created by the tests are exported at once
+    settings.ANALYTICS_SNAPSHOT_LAG = 0
+
+
+@pytest.fixture
+def finished_sessions(django_user_model, create_book_1, create_book_2, test_user):
+    """Creates finished sessions of two users in two months, an active and a not yet applied session"""
+    other_user = django_user_model.objects.create_user(username='otheruser', password='otherpassword')
+    sessions = [
+        # Starts on 2023-02-01 in Kyiv, but on 2023-01-31 in UTC
+        (test_user, create_book_1, KIEV_TZ.localize(datetime.datetime(2023, 2, 1, 1, 0)), 30),
+        (test_user, create_book_2, KIEV_TZ.localize(datetime.datetime(2023, 2, 1, 12, 0)), 60),
+        (test_user, create_book_1, KIEV_TZ.localize(datetime.datetime(2023, 3, 5, 23, 30)), 90),
+        (other_user.id, create_book_1, KIEV_TZ.localize(datetime.datetime(2023, 3, 5, 10, 0)), 15),
+    ]
+    for user_id, book, start_time, minutes in sessions:
+        ReadingSession.objects.create(user_id=user_id, book=book, start_time=start_time,
+                                      end_time=start_time + datetime.timedelta(minutes=minutes),
+                                      duration=datetime.timedelta(minutes=minutes))
+    start_time = KIEV_TZ.localize(datetime.datetime(2023, 3, 6, 10, 0))
+    ReadingSession.objects.create(user_id=other_user.id, book=create_book_2, start_time=start_time,
+                                  end_time=start_time + datetime.timedelta(minutes=10),
+                                  duration=datetime.timedelta(minutes=10), statistics_applied=False)
+    ReadingSession.objects.create(user_id=test_user, book=create_book_2)
+    return other_user.id
+
+
+@pytest.mark.django_db
+class TestExportAnalyticsSnapshot:
+    def test_export_analytics_snapshot(self, tmp_path, finished_sessions, create_book_1, create_book_2, test_user):
+        assert export_analytics_snapshot(tmp_path, log=lambda message: None) == 4
+
+        manifest = read_manifest(tmp_path)
+        assert [(segment['month'], segment['rows']) for segment in manifest['segments']] == [
+            ('2023-02', 2), ('2023-03', 2),
+        ]
+        assert manifest['checkpoint'] is not None
+
+        by_user = reading_time_by_user(tmp_path)
+        assert by_user['user_id'].tolist() == [test_user, finished_sessions]
+        assert by_user['reading_time'].tolist() == [180 * 60, 15 * 60]
+        assert by_user['sessions'].tolist() == [3, 1]
+
+        by_book = reading_time_by_book(tmp_path, user_id=test_user)
+        assert by_book['book_id'].tolist() == [create_book_1.id, create_book_2.id]
+        assert by_book['reading_time'].tolist() == [120 * 60, 60 * 60]
+
+        by_day = reading_time_by_day(tmp_path, date_from=datetime.date(2023, 3, 1), book_id=create_book_1.id)
+        assert by_day['day'].tolist() == [datetime.date(2023, 3, 5)]
+        assert by_day['reading_time'].tolist() == [105 * 60]
+        assert by_day['sessions'].tolist() == [2]
+
+        by_day = reading_time_by_day(tmp_path, date_to=datetime.date(2023, 2, 28))
+        assert by_day['day'].dtype == np.dtype('datetime64[D]')
+        assert by_day['day'].tolist() == [datetime.date(2023, 2, 1)]
+        assert by_day['reading_time'].tolist() == [90 * 60]
+
+    def test_export_analytics_snapshot_is_incremental(self, tmp_path, finished_sessions, create_book_1,
+                                                      test_user, settings):
+        export_analytics_snapshot(tmp_path, log=lambda message: None)
+        assert export_analytics_snapshot(tmp_path, log=lambda message: None) == 0
+
+        # The session ended by the user and the pending session applied meanwhile are added
+        ReadingSession.objects.filter(statistics_applied=False).update(
+            statistics_applied=True, updated_at=datetime.datetime.now(datetime.timezone.utc))
+        end_reading_session_and_get_message(user=test_user)
+        assert export_analytics_snapshot(tmp_path, log=lambda message: None) == 2
+        assert export_analytics_snapshot(tmp_path, log=lambda message: None) == 0
+
+        assert len(read_manifest(tmp_path)['segments']) == 4
+        assert reading_time_by_user(tmp_path)['sessions'].tolist() == [4, 2]
+        assert reading_time_by_user(tmp_path)['reading_time'].sum() == sum(
+            int(duration.total_seconds()) for duration in ReadingSession.objects.values_list('duration', flat=True)
+        )
+
+    def test_export_analytics_snapshot_in_segments(self, tmp_path, finished_sessions):
+        assert export_analytics_snapshot(tmp_path, chunk_size=1, segment_size=1, log=lambda message: None) == 4
+
+        assert len(read_manifest(tmp_path)['segments']) == 4
+        assert reading_time_by_user(tmp_path)['reading_time'].tolist() == [180 * 60, 15 * 60]
+
+    def test_first_export_includes_archived_sessions(self, tmp_path, finished_sessions, test_user):
+        archive_reading_sessions(retention_days=1, log=lambda message: None)
+        assert ReadingSession.objects.filter(end_time__isnull=False, statistics_applied=True).count() == 0
+
+        assert export_analytics_snapshot(tmp_path, log=lambda message: None) == 4
+        assert reading_time_by_user(tmp_path)['sessions'].tolist() == [3, 1]
+
+    def test_empty_snapshot(self, tmp_path):
+        assert reading_time_by_book(tmp_path)['book_id'].tolist() == []
+
+    def test_export_analytics_snapshot_command(self, tmp_path, finished_sessions):
+        stdout = io.StringIO()
+        call_command('exportanalyticssnapshot', path=str(tmp_path), stdout=stdout)
+        assert 'Exported 4 reading sessions in total' in stdout.getvalue()
+        assert reading_time_by_book(tmp_path)['sessions'].sum() == 4
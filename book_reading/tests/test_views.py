@@ -6,10 +6,12 @@ from unittest import mock
 
 from rest_framework.test import APIClient
 
-from book_reading.models import Book
+from django.contrib.auth.models import User
+
+from book_reading.cache import get_or_set_user_total_reading_time_cache, invalidate_statistics_cache
+from book_reading.models import Book, ReadingStatistics, UserStatistics, ReadingSession, DailyReadingStatistics
 from book_reading.serializers import BookWithoutFullDescriptionSerializer
 from book_reading.services import timedelta_to_string
-from book_reading.tasks import daily_collection_of_user_statistics
 
 
 @pytest.fixture
@@ -72,7 +74,7 @@ class TestBooks:
     def test_books_url(self, api_client, create_book_1):
         response = api_client.get("/api/v1/books/")
         assert response.status_code == 200
-        assert len(response.data) == 1
+        assert len(response.data["results"]) == 1
 
     def test_book_details_url(self, api_client, create_book_1):
         response = api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
@@ -83,6 +85,90 @@ class TestBooks:
         assert response.data["short_description"] == 'test_short_description'
         assert response.data["full_description"] == 'test_full_description'
 
+    def test_book_details_url_includes_statistics(self, api_client, create_book_1, create_book_2, test_user,
+                                                  reading_a_book_for_two_hours):
+        response = api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+        assert response.data["statistics"]["readers_count"] == 1
+        assert response.data["statistics"]["sessions_count"] == 1
+        assert response.data["statistics"]["last_read_at"] is not None
+
+        response = api_client.get(f"/api/v1/book-details/{create_book_2.id}/")
+        assert response.data["statistics"] == {"total_reading_time": "00:00:00", "readers_count": 0,
+                                               "sessions_count": 0, "last_read_at": None}
+
+
+@pytest.mark.django_db
+class TestBooksPagination:
+    def test_books_url_pages(self, api_client, create_book_1, create_book_2):
+        response = api_client.get("/api/v1/books/", {"page_size": 1})
+        assert response.status_code == 200
+        assert [book["id"] for book in response.data["results"]] == [create_book_1.id]
+        assert response.data["previous"] is None
+
+        response = api_client.get(response.data["next"])
+        assert [book["id"] for book in response.data["results"]] == [create_book_2.id]
+        assert response.data["next"] is None
+
+    def test_books_url_does_not_load_full_description(self, api_client, create_book_1,
+                                                      django_assert_num_queries):
+        with django_assert_num_queries(1) as context:
+            response = api_client.get("/api/v1/books/")
+        assert "full_description" not in response.data["results"][0]
+        assert response.data["results"][0]["statistics"]["readers_count"] == 0
+        assert "full_description" not in context.captured_queries[0]["sql"]
+
+
+@pytest.mark.django_db
+class TestBooksCache:
+    def test_books_url_is_served_from_cache(self, api_client, create_book_1, django_assert_num_queries):
+        api_client.get("/api/v1/books/")
+        with django_assert_num_queries(0):
+            response = api_client.get("/api/v1/books/")
+        assert response.status_code == 200
+        assert response.data["results"][0]["title"] == 'test_title'
+
+    def test_books_url_links_use_the_request_scheme(self, api_client, create_book_1, create_book_2):
+        api_client.get("/api/v1/books/", {"page_size": 1})
+        response = api_client.get("/api/v1/books/", {"page_size": 1}, secure=True)
+        assert response.data["next"].startswith("https://")
+
+    def test_book_details_url_is_served_from_cache(self, api_client, create_book_1, django_assert_num_queries):
+        api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+        with django_assert_num_queries(0):
+            response = api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+        assert response.status_code == 200
+        assert response.data["full_description"] == 'test_full_description'
+
+    def test_book_details_url_invalid_book_id(self, api_client, create_book_1):
+        response = api_client.get(f"/api/v1/book-details/{create_book_1.id + 1}/")
+        assert response.status_code == 404
+
+    def test_books_cache_is_invalidated_on_book_change(self, api_client, create_book_1, create_book_2):
+        api_client.get("/api/v1/books/")
+        api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+
+        create_book_1.title = 'new_title'
+        create_book_1.save()
+        assert api_client.get("/api/v1/books/").data["results"][0]["title"] == 'new_title'
+        assert api_client.get(f"/api/v1/book-details/{create_book_1.id}/").data["title"] == 'new_title'
+
+        create_book_2.delete()
+        assert len(api_client.get("/api/v1/books/").data["results"]) == 1
+
+    def test_book_details_cache_is_invalidated_when_session_ends(self, api_client, create_book_1, test_user,
+                                                                 django_capture_on_commit_callbacks,
+                                                                 django_assert_num_queries):
+        api_client.get("/api/v1/books/")
+        api_client.get(f"/api/v1/book-details/{create_book_1.id}/")
+
+        api_client.get(f"/api/v1/start-reading-session/{create_book_1.id}/")
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.get("/api/v1/end-reading-session/")
+        assert api_client.get(f"/api/v1/book-details/{create_book_1.id}/").data["statistics"]["sessions_count"] == 1
+        # The book lists are kept in the cache
+        with django_assert_num_queries(0):
+            assert api_client.get("/api/v1/books/").status_code == 200
+
 
 @pytest.mark.django_db
 class TestBookReadingStatistics:
@@ -99,6 +185,22 @@ class TestBookReadingStatistics:
         assert response.data["Book"] == book_serialized.data
         assert response.data["Total reading time"] == timedelta_to_string(datetime.timedelta())
 
+    def test_books_reading_statistics(self, create_book_1, create_book_2, api_client, reading_a_book_for_two_hours):
+        response = api_client.get("/api/v1/book-reading-statistics/",
+                                  {"ids": f"{create_book_1.id},{create_book_2.id}"})
+        assert response.status_code == 200
+        assert [statistics["Book"]["id"] for statistics in response.data["Statistics"]] == \
+               [create_book_1.id, create_book_2.id]
+        assert response.data["Statistics"][0]["Total reading time"] == \
+               api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/").data["Total reading time"]
+        assert response.data["Statistics"][1]["Total reading time"] == timedelta_to_string(datetime.timedelta())
+
+    def test_books_reading_statistics_invalid_ids(self, api_client, test_user, settings):
+        assert api_client.get("/api/v1/book-reading-statistics/").status_code == 400
+        assert api_client.get("/api/v1/book-reading-statistics/", {"ids": "1,a"}).status_code == 400
+        ids = ",".join(map(str, range(1, settings.BOOK_STATISTICS_BATCH_MAX_SIZE + 2)))
+        assert api_client.get("/api/v1/book-reading-statistics/", {"ids": ids}).status_code == 400
+
 
 @pytest.mark.django_db
 class TestBookReadingSession:
@@ -138,12 +240,91 @@ class TestBookReadingSession:
         assert response.data["message"] == "There is currently no book reading session started"
 
 
+def reading_sessions(book_id, start_time, count, duration=datetime.timedelta(minutes=30)):
+    """Returns data of consecutive reading sessions with one minute breaks"""
+    sessions = []
+    for i in range(count):
+        session_start_time = start_time + i * (duration + datetime.timedelta(minutes=1))
+        sessions.append({"book_id": book_id,
+                         "start_time": session_start_time.isoformat(),
+                         "end_time": (session_start_time + duration).isoformat()})
+    return sessions
+
+
+@pytest.mark.django_db
+class TestBulkReadingSessions:
+    start_time = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).replace(
+        hour=23, minute=0, second=0, microsecond=0)
+
+    def test_bulk_reading_sessions(self, api_client, create_book_1, create_book_2, test_user):
+        sessions = (reading_sessions(create_book_1.id, self.start_time, 2)
+                    + reading_sessions(create_book_2.id, self.start_time + datetime.timedelta(hours=2), 1))
+        response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert response.status_code == 200
+        assert response.data["message"] == "3 book reading sessions saved successfully"
+
+        assert ReadingSession.objects.filter(user_id=test_user).count() == 3
+        assert ReadingStatistics.objects.get(user_id=test_user, book=create_book_1).total_reading_time == \
+               datetime.timedelta(hours=1)
+        assert ReadingStatistics.objects.get(user_id=test_user, book=create_book_2).total_reading_time == \
+               datetime.timedelta(minutes=30)
+        assert UserStatistics.objects.get(user_id=test_user).total_reading_time == datetime.timedelta(minutes=90)
+        assert DailyReadingStatistics.objects.filter(user_id=test_user).count() == 2
+
+    def test_bulk_reading_sessions_add_to_existing_statistics(self, api_client, create_book_1, test_user,
+                                                              reading_a_book_for_two_hours):
+        sessions = reading_sessions(create_book_1.id, self.start_time, 2)
+        api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+
+        response = api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+        assert response.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=3))
+
+    def test_bulk_reading_sessions_query_count(self, api_client, create_book_1, create_book_2, test_user,
+                                               django_assert_max_num_queries):
+        sessions = reading_sessions(create_book_1.id, self.start_time, 500)
+        # Does not depend on the number of sessions, SQLite splits the insert into a few batches
+        with django_assert_max_num_queries(27):
+            response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert ReadingSession.objects.filter(user_id=test_user).count() == 500
+        assert response.data["message"] == "500 book reading sessions saved successfully"
+
+    def test_bulk_reading_sessions_overlap_each_other(self, api_client, create_book_1, test_user):
+        sessions = reading_sessions(create_book_1.id, self.start_time, 2, duration=datetime.timedelta(hours=1))
+        sessions[1]["start_time"] = (self.start_time + datetime.timedelta(minutes=30)).isoformat()
+        response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert "overlaps" in response.data["Error"]
+        assert not ReadingSession.objects.exists()
+
+    def test_bulk_reading_sessions_overlap_active_session(self, api_client, create_book_1, test_user):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with mock.patch('django.utils.timezone.now', mock.Mock(return_value=now - datetime.timedelta(hours=1))):
+            api_client.get(f"/api/v1/start-reading-session/{create_book_1.id}/")
+        sessions = reading_sessions(create_book_1.id, now - datetime.timedelta(minutes=10), 1,
+                                    duration=datetime.timedelta(minutes=5))
+        response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert "overlaps" in response.data["Error"]
+        assert ReadingSession.objects.count() == 1
+
+    def test_bulk_reading_sessions_invalid_book_id(self, api_client, create_book_1, test_user):
+        sessions = reading_sessions(create_book_1.id + 1, self.start_time, 1)
+        response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert response.data["Error"] == f"There are no books with IDs [{create_book_1.id + 1}]"
+
+    def test_bulk_reading_sessions_invalid_time(self, api_client, create_book_1, test_user):
+        sessions = reading_sessions(create_book_1.id, self.start_time, 1)
+        sessions[0]["start_time"], sessions[0]["end_time"] = sessions[0]["end_time"], sessions[0]["start_time"]
+        response = api_client.post("/api/v1/reading-sessions/bulk/", sessions, format="json")
+        assert response.status_code == 400
+
+    def test_bulk_reading_sessions_empty(self, api_client, create_book_1, test_user):
+        response = api_client.post("/api/v1/reading-sessions/bulk/", [], format="json")
+        assert response.status_code == 400
+
+
 @pytest.mark.django_db
 class TestUserReadingStatistics:
     def test_user_reading_statistics_with_zero_total_reading_time(self, api_client, create_book_1, test_user):
         """Testing general user statistics without reading the book before"""
-        daily_collection_of_user_statistics()
-
         response = api_client.get(f"/api/v1/user-statistics/")
         assert response.status_code == 200
         assert response.data["Total reading time"] == timedelta_to_string(datetime.timedelta())
@@ -152,10 +333,86 @@ class TestUserReadingStatistics:
 
     def test_user_reading_statistics(self, api_client, create_book_1, test_user, reading_a_book_for_two_hours):
         """Testing general user statistics after two hours of reading a book"""
-        daily_collection_of_user_statistics()
-
         response = api_client.get(f"/api/v1/user-statistics/")
         assert response.status_code == 200
         assert response.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
         assert response.data["Last 7 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
         assert response.data["Last 30 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+
+    def test_user_reading_statistics_for_periods(self, api_client, create_book_1, test_user,
+                                                 reading_a_book_for_two_hours):
+        """Testing the reading time for the requested number of days and hours"""
+        response = api_client.get("/api/v1/user-statistics/?days=3&hours=3")
+        assert response.status_code == 200
+        assert response.data["Last 3 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert response.data["Last 3 hours reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+
+    def test_user_reading_statistics_invalid_period(self, api_client, create_book_1, test_user):
+        response = api_client.get("/api/v1/user-statistics/?days=0")
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+class TestStatisticsCache:
+    def test_statistics_urls_do_not_write_to_database(self, api_client, create_book_1, test_user):
+        api_client.get("/api/v1/user-statistics/")
+        api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+        assert not UserStatistics.objects.exists()
+        assert not ReadingStatistics.objects.exists()
+
+    def test_statistics_urls_are_served_from_cache(self, api_client, create_book_1, test_user,
+                                                   reading_a_book_for_two_hours, django_assert_num_queries):
+        api_client.force_authenticate(user=User.objects.get(id=test_user))
+        api_client.get("/api/v1/user-statistics/")
+        api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+
+        with django_assert_num_queries(0):
+            user_statistics = api_client.get("/api/v1/user-statistics/")
+            book_reading_statistics = api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+        assert user_statistics.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert book_reading_statistics.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+
+    def test_ended_session_invalidates_cache(self, api_client, create_book_1, test_user,
+                                             django_capture_on_commit_callbacks, django_assert_num_queries):
+        api_client.force_authenticate(user=User.objects.get(id=test_user))
+        api_client.get("/api/v1/user-statistics/")
+        api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+
+        mocked = datetime.datetime.now() - datetime.timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', mock.Mock(return_value=mocked)):
+            api_client.get(f"/api/v1/start-reading-session/{create_book_1.id}/")
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.get(f"/api/v1/end-reading-session/")
+
+        user_statistics = api_client.get("/api/v1/user-statistics/")
+        book_reading_statistics = api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/")
+        assert user_statistics.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert book_reading_statistics.data["Total reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        with django_assert_num_queries(0):
+            assert api_client.get(f"/api/v1/book-reading-statistics/{create_book_1.id}/").data == \
+                   book_reading_statistics.data
+
+    def test_value_loaded_before_statistics_changed_is_not_cached(self, test_user):
+        def read_stale_total_reading_time():
+            # The statistics change after the value is loaded from the database and before it is cached
+            invalidate_statistics_cache([test_user])
+            return datetime.timedelta(hours=1)
+
+        assert get_or_set_user_total_reading_time_cache(test_user, read_stale_total_reading_time) == \
+               datetime.timedelta(hours=1)
+        assert get_or_set_user_total_reading_time_cache(test_user, lambda: datetime.timedelta(hours=2)) == \
+               datetime.timedelta(hours=2)
+
+    def test_session_is_ended_when_cache_is_unavailable(self, api_client, create_book_1, test_user,
+                                                        start_reading_session, django_capture_on_commit_callbacks):
+        with mock.patch('django.core.cache.backends.locmem.LocMemCache.incr', side_effect=ConnectionError):
+            with django_capture_on_commit_callbacks(execute=True):
+                response = api_client.get("/api/v1/end-reading-session/")
+        assert response.status_code == 200
+        assert not ReadingSession.objects.filter(end_time__isnull=True).exists()
+
+    def test_last_days_statistics_are_computed_on_read(self, api_client, create_book_1, test_user,
+                                                       reading_a_book_for_two_hours):
+        response = api_client.get("/api/v1/user-statistics/")
+        assert response.data["Last 7 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
+        assert response.data["Last 30 days reading time"] == timedelta_to_string(datetime.timedelta(hours=2))
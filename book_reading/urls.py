@@ -1,12 +1,28 @@
 from django.urls import path
 
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('books/', views.BookAPIList.as_view(), name='books'),
+    path('books/search/', views.BookSearchAPIView.as_view(), name='book_search'),
     path('book-details/<int:pk>/', views.BookAPIRetrieve.as_view(), name='book_details'),
     path('start-reading-session/<int:pk>/', views.StartReadingSessionAPIView.as_view(), name='start_reading_session'),
     path('end-reading-session/', views.EndReadingSessionAPIView.as_view(), name='end_reading_session'),
+    path('reading-session-heartbeat/', views.ReadingSessionHeartbeatAPIView.as_view(),
+         name='reading_session_heartbeat'),
+    path('reading-sessions/bulk/', views.BulkReadingSessionsAPIView.as_view(), name='bulk_reading_sessions'),
+    path('reading-sessions/export/', views.ReadingSessionsExportAPIView.as_view(), name='export_reading_sessions'),
     path('user-statistics/', views.UserStatisticsAPIView.as_view(), name='user_statistics'),
     path('book-reading-statistics/<int:pk>/', views.ReadingStatisticsAPIView.as_view(), name='book_reading_statistics'),
+    path('book-reading-statistics/', views.BooksReadingStatisticsAPIView.as_view(),
+         name='books_reading_statistics'),
+    path('rankings/readers/', views.TopReadersAPIView.as_view(), name='top_readers'),
+    path('rankings/books/', views.MostReadBooksAPIView.as_view(), name='most_read_books'),
+    path('async/start-reading-session/<int:pk>/', async_views.AsyncStartReadingSessionView.as_view(),
+         name='async_start_reading_session'),
+    path('async/end-reading-session/', async_views.AsyncEndReadingSessionView.as_view(),
+         name='async_end_reading_session'),
+    path('async/user-statistics/', async_views.AsyncUserStatisticsView.as_view(), name='async_user_statistics'),
+    path('async/book-reading-statistics/<int:pk>/', async_views.AsyncReadingStatisticsView.as_view(),
+         name='async_book_reading_statistics'),
 ]
\ No newline at end of file
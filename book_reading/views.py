@@ -1,12 +1,26 @@
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import RetrieveAPIView, ListAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .cache import get_or_set_books_cache, book_list_cache_key
+from .export import export_reading_sessions, EXPORT_FORMATS
 from .models import Book
-from .serializers import BookSerializer, BookWithoutFullDescriptionSerializer
+from .pagination import BookCursorPagination
+from .search import search_books
+from .serializers import BookSerializer, BookWithoutFullDescriptionSerializer, FinishedReadingSessionSerializer, \
+    ReadingPeriodSerializer, RankingSerializer, ReadingSessionsExportSerializer, BookIdsSerializer, \
+    BookSearchSerializer
 from .services import timedelta_to_string, start_reading_session_and_get_message, end_reading_session_and_get_message, \
-    get_user_statistics, get_user_reading_statistics
+    get_user_statistics, get_user_reading_statistics, get_serialized_book, create_reading_sessions_and_get_message, \
+    USER_STATISTICS_PERIODS, get_top_readers, get_most_read_books, get_user_reading_statistics_for_books, \
+    record_reading_session_heartbeat, books_with_statistics
 
 
 class BookAPIRetrieve(RetrieveAPIView):
@@ -14,11 +28,46 @@ class BookAPIRetrieve(RetrieveAPIView):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        book = get_serialized_book(book_id=self.kwargs['pk'])
+        if book is None:
+            raise NotFound()
+        return Response(book)
+
 
 class BookAPIList(ListAPIView):
-    """ Displaying a list of all books"""
-    queryset = Book.objects.all()
+    """ Displaying a list of all books page by page"""
+    # Only the columns sent by the serializer are loaded
+    queryset = books_with_statistics()
     serializer_class = BookWithoutFullDescriptionSerializer
+    pagination_class = BookCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        # The page has absolute next and previous links
+        cache_key = book_list_cache_key(
+            request.scheme,
+            request.get_host(),
+            request.query_params.get(self.paginator.cursor_query_param, ''),
+            self.paginator.get_page_size(request),
+        )
+        return Response(get_or_set_books_cache(cache_key, lambda: super(BookAPIList, self).list(request).data))
+
+
+class BookSearchAPIView(APIView):
+    """
+    Full-text search of books by title, author and descriptions, e.g. ?q=tolstoy.
+    Results can be filtered by year_published, the number of matches per year is returned as facets.
+    """
+
+    def get(self, request):
+        search = BookSearchSerializer(data=request.query_params)
+        search.is_valid(raise_exception=True)
+        params = search.validated_data
+        # The search text can be long, so it is hashed in the cache key
+        cache_key = book_list_cache_key('search', hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest())
+        return Response(get_or_set_books_cache(cache_key, lambda: search_books(
+            params['q'], params.get('year_published'), params['limit'], params['offset']
+        )))
 
 
 class StartReadingSessionAPIView(APIView):
@@ -40,23 +89,93 @@ class EndReadingSessionAPIView(APIView):
         return Response(response)
 
 
+class ReadingSessionHeartbeatAPIView(APIView):
+    """A class that allows a client to report that the user is still reading"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        response = record_reading_session_heartbeat(user=request.user)
+        return Response(response)
+
+
+class BulkReadingSessionsAPIView(APIView):
+    """A class that allows you to upload finished book reading sessions recorded offline"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = FinishedReadingSessionSerializer(data=request.data, many=True, allow_empty=False,
+                                                      max_length=settings.READING_SESSIONS_BULK_MAX_SIZE)
+        serializer.is_valid(raise_exception=True)
+        response = create_reading_sessions_and_get_message(user=request.user, sessions=serializer.validated_data)
+        return Response(response)
+
+
+class ReadingSessionsExportAPIView(APIView):
+    """
+    Exporting all reading sessions of the user in CSV or NDJSON.
+    The sessions are streamed, filters: book_id, date_from and date_to.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        export = ReadingSessionsExportSerializer(data=request.query_params)
+        export.is_valid(raise_exception=True)
+        filters = dict(export.validated_data)
+        export_format = filters.pop('output')
+        human_readable = filters.pop('human_readable')
+
+        response = StreamingHttpResponse(
+            export_reading_sessions(export_format, human_readable, user_id=request.user.id, **filters),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="reading-sessions.{export_format}"'
+        return response
+
+
+def get_user_statistics_periods(validated_period: dict) -> dict:
+    """Returns the periods of the user statistics including the days and hours requested by the user"""
+    periods = dict(USER_STATISTICS_PERIODS)
+    if 'days' in validated_period:
+        periods['last_days_reading_time'] = datetime.timedelta(days=validated_period['days'])
+    if 'hours' in validated_period:
+        periods['last_hours_reading_time'] = datetime.timedelta(hours=validated_period['hours'])
+    return periods
+
+
+def get_user_statistics_data(user, user_statistics: dict, validated_period: dict) -> dict:
+    """Returns the response data of the user statistics"""
+    data = {
+        'Username': user.username,
+        'First name': user.first_name,
+        'Last name': user.last_name,
+        'Date joined': user.date_joined.strftime("%Y-%m-%d %I:%M %p"),
+        'Total reading time': timedelta_to_string(user_statistics["total_reading_time"]),
+        'Last 7 days reading time': timedelta_to_string(user_statistics["last_7_days_reading_time"]),
+        'Last 30 days reading time': timedelta_to_string(user_statistics["last_30_days_reading_time"]),
+    }
+    if 'days' in validated_period:
+        data[f'Last {validated_period["days"]} days reading time'] = \
+            timedelta_to_string(user_statistics['last_days_reading_time'])
+    if 'hours' in validated_period:
+        data[f'Last {validated_period["hours"]} hours reading time'] = \
+            timedelta_to_string(user_statistics['last_hours_reading_time'])
+    return data
+
+
 class UserStatisticsAPIView(APIView):
-    """ Displaying general user statistics"""
+    """
+    Displaying general user statistics.
+    The reading time for the last days or hours can be requested with the days and hours parameters.
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
-        user_statistics = get_user_statistics(user=user)
+        period = ReadingPeriodSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
 
-        return Response({
-            'Username': user.username,
-            'First name': user.first_name,
-            'Last name': user.last_name,
-            'Date joined': user.date_joined.strftime("%Y-%m-%d %I:%M %p"),
-            'Total reading time': timedelta_to_string(user_statistics["total_reading_time"]),
-            'Last 7 days reading time': timedelta_to_string(user_statistics["last_7_days_reading_time"]),
-            'Last 30 days reading time': timedelta_to_string(user_statistics["last_30_days_reading_time"]),
-        })
+        user_statistics = get_user_statistics(user=user, periods=get_user_statistics_periods(period.validated_data))
+        return Response(get_user_statistics_data(user, user_statistics, period.validated_data))
 
 
 class ReadingStatisticsAPIView(APIView):
@@ -69,3 +188,34 @@ class ReadingStatisticsAPIView(APIView):
 
         response = get_user_reading_statistics(user=user, book_id=book_id)
         return Response(response)
+
+
+class BooksReadingStatisticsAPIView(APIView):
+    """Displaying user statistics for several books at once, e.g. ?ids=1,2,3"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        books = BookIdsSerializer(data=request.query_params)
+        books.is_valid(raise_exception=True)
+        return Response(get_user_reading_statistics_for_books(user=request.user,
+                                                              book_ids=books.validated_data['ids']))
+
+
+class TopReadersAPIView(APIView):
+    """Displaying the readers with the most reading time this week or month and the rank of the user"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        ranking = RankingSerializer(data=request.query_params)
+        ranking.is_valid(raise_exception=True)
+        return Response(get_top_readers(user=request.user, **ranking.validated_data))
+
+
+class MostReadBooksAPIView(APIView):
+    """Displaying the books with the most reading time this week or month"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        ranking = RankingSerializer(data=request.query_params)
+        ranking.is_valid(raise_exception=True)
+        return Response(get_most_read_books(**ranking.validated_data))
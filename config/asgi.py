@@ -11,5 +11,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault(
     "DJANGO_SETTINGS_MODULE", "config.settings"
 )
+# Persistent connections are not recommended by Django for ASGI, as connections belong to the threads
+# running the queries of async views, pgbouncer (DB_PGBOUNCER) can reuse server connections instead
+os.environ.setdefault("DB_CONN_MAX_AGE", "0")
 
 application = get_asgi_application()
@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -9,3 +10,13 @@ app = Celery("config", broker_connection_retry_on_startup=True)
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+
+# The Django fixup of Celery closes the database connections inherited by worker processes
+# and the connections older than CONN_MAX_AGE around every task, so connections are reused
+# by the tasks of a process like by the requests of a web process
+@worker_process_shutdown.connect
+def close_database_connections(**kwargs):
+    """Connections of a stopped worker process are closed at once, not when the server notices it"""
+    from django.db import connections
+    connections.close_all()
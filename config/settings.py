@@ -31,6 +31,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     "rest_framework",
     "rest_framework.authtoken",
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "book_reading.middleware.QueryMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -81,10 +83,149 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST"),
         "PORT": os.getenv("POSTGRES_PORT"),
+        # Connections are kept open between requests and Celery tasks for this number of seconds
+        # (0 - closed after every request) and checked before they are reused.
+        # The ASGI application closes them after every request, see config/asgi.py
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": os.getenv("DB_CONN_HEALTH_CHECKS", "True") == "True",
+        # Connections are pooled by pgbouncer, Django 4.2 has no connection pool of its own.
+        # pgbouncer in the transaction pooling mode runs the transactions of a client connection
+        # on any server connection, so server-side cursors, which outlive a transaction, are disabled.
+        # QuerySet.iterator() then loads the whole result, so the export and the analytics snapshot
+        # read the sessions in keyset chunks instead. Prepared statements are disabled by Django with psycopg 3 already
+        "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DB_PGBOUNCER", "False") == "True",
     }
 }
 
 
+# Cache
+# Redis is used when REDIS_CACHE_URL is set, otherwise the local memory cache (e.g. for tests)
+
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL")
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+            "KEY_PREFIX": "reading",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {
+                "MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", 10000)),
+            },
+        }
+    }
+
+# Cache alias and time to live (in seconds) of the serialized books
+BOOKS_CACHE_ALIAS = os.getenv("BOOKS_CACHE_ALIAS", "default")
+BOOKS_CACHE_TIMEOUT = int(os.getenv("BOOKS_CACHE_TIMEOUT", 60 * 60))
+
+# Cache alias and time to live (in seconds) of the user statistics snapshots
+STATISTICS_CACHE_ALIAS = os.getenv("STATISTICS_CACHE_ALIAS", "default")
+STATISTICS_CACHE_TIMEOUT = int(os.getenv("STATISTICS_CACHE_TIMEOUT", 60 * 60 * 24))
+# Time to live (in seconds) of the reading time for the last days, which grows while a session is active
+STATISTICS_PERIOD_CACHE_TIMEOUT = int(os.getenv("STATISTICS_PERIOD_CACHE_TIMEOUT", 30))
+# Maximum number of days of the reading time periods requested from the user statistics
+STATISTICS_MAX_PERIOD_DAYS = int(os.getenv("STATISTICS_MAX_PERIOD_DAYS", 366))
+
+# Cache alias and time to live (in seconds) of the users of authentication tokens.
+# The cache must be shared by all processes (Redis), so deleted tokens are rejected by all of them.
+# Its size is bounded by CACHE_MAX_ENTRIES or by the memory limit of Redis.
+AUTH_CACHE_ALIAS = os.getenv("AUTH_CACHE_ALIAS", "default")
+AUTH_CACHE_TIMEOUT = int(os.getenv("AUTH_CACHE_TIMEOUT", 5 * 60))
+
+# "sync" - statistics are updated when a session is ended,
+# "async" - statistics are updated in batches by a Celery task
+STATISTICS_UPDATE_MODE = os.getenv("STATISTICS_UPDATE_MODE", "sync")
+# Maximum number of ended sessions in one batch and the delay (in seconds) before a batch is applied
+STATISTICS_BATCH_SIZE = int(os.getenv("STATISTICS_BATCH_SIZE", 1000))
+STATISTICS_BATCH_DELAY = int(os.getenv("STATISTICS_BATCH_DELAY", 5))
+
+# Number of users whose statistics are reconciled in one transaction, and the number of seconds
+# the reconciliation looks back before its checkpoint, so sessions committed late are not missed
+RECONCILIATION_CHUNK_SIZE = int(os.getenv("RECONCILIATION_CHUNK_SIZE", 1000))
+RECONCILIATION_CHECKPOINT_OVERLAP = int(os.getenv("RECONCILIATION_CHECKPOINT_OVERLAP", 10 * 60))
+
+# Rankings of readers and books are kept in Redis sorted sets when RANKINGS_REDIS_URL is set,
+# otherwise in the memory of every process, which is only meant for tests and development.
+# The Redis of the rankings must not evict keys (maxmemory-policy noeviction)
+RANKINGS_REDIS_URL = os.getenv("RANKINGS_REDIS_URL")
+# Heartbeats of the active sessions are kept in a Redis hash when HEARTBEATS_REDIS_URL is set,
+# otherwise in the memory of every process, and saved to the database in batches of users.
+# Idle sessions are only closed when it is set, as the worker cannot see the heartbeats of web processes
+HEARTBEATS_REDIS_URL = os.getenv("HEARTBEATS_REDIS_URL")
+HEARTBEATS_FLUSH_BATCH_SIZE = int(os.getenv("HEARTBEATS_FLUSH_BATCH_SIZE", 1000))
+# Active sessions are ended at their last heartbeat when no heartbeat came for this number of seconds,
+# sessions without heartbeats are ended at their start after the maximum duration (in seconds)
+READING_SESSION_IDLE_TIMEOUT = int(os.getenv("READING_SESSION_IDLE_TIMEOUT", 15 * 60))
+READING_SESSION_MAX_DURATION = int(os.getenv("READING_SESSION_MAX_DURATION", 12 * 60 * 60))
+
+# Maximum number of places of a ranking in one response
+RANKINGS_MAX_LIMIT = int(os.getenv("RANKINGS_MAX_LIMIT", 100))
+
+# Finished reading sessions older than this number of days are moved to the archive
+# by the archivereadingsessions command, it must be longer than the longest statistics period
+READING_SESSIONS_RETENTION_DAYS = int(os.getenv("READING_SESSIONS_RETENTION_DAYS", 400))
+
+# Number of reading sessions read from the database at a time by the streamed export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+
+# Directory of the columnar snapshot of the reading sessions written by the exportanalyticssnapshot command,
+# the maximum number of sessions in the segments written at a time, and the number of seconds
+# a session must be unchanged before it is exported, so sessions committed late are not missed
+ANALYTICS_SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR", str(BASE_DIR / "analytics_snapshot"))
+ANALYTICS_SNAPSHOT_SEGMENT_SIZE = int(os.getenv("ANALYTICS_SNAPSHOT_SEGMENT_SIZE", 500000))
+ANALYTICS_SNAPSHOT_LAG = int(os.getenv("ANALYTICS_SNAPSHOT_LAG", 60))
+
+# Maximum number of reading sessions in one bulk upload
+READING_SESSIONS_BULK_MAX_SIZE = int(os.getenv("READING_SESSIONS_BULK_MAX_SIZE", 5000))
+# Maximum number of books in a page of the book search and the maximum offset of a page
+BOOK_SEARCH_MAX_LIMIT = int(os.getenv("BOOK_SEARCH_MAX_LIMIT", 100))
+BOOK_SEARCH_MAX_OFFSET = int(os.getenv("BOOK_SEARCH_MAX_OFFSET", 1000))
+# Maximum number of books in one request of the statistics of several books
+BOOK_STATISTICS_BATCH_MAX_SIZE = int(os.getenv("BOOK_STATISTICS_BATCH_MAX_SIZE", 200))
+
+# Default and maximum number of books on a page of the book list
+BOOKS_PAGE_SIZE = int(os.getenv("BOOKS_PAGE_SIZE", 100))
+BOOKS_MAX_PAGE_SIZE = int(os.getenv("BOOKS_MAX_PAGE_SIZE", 1000))
+
+
+# Request metrics
+
+# Maximum number of database queries per request of a view (by URL name),
+# including authentication and the savepoints of tests. Ending a session writes every statistics
+# table with one query, whether its rows exist or not
+QUERY_BUDGETS = {
+    "books": 2,
+    "book_details": 2,
+    "book_search": 3,
+    "start_reading_session": 10,
+    "end_reading_session": 8,
+    "reading_session_heartbeat": 1,
+    "bulk_reading_sessions": 11,
+    # The sessions are read while the response is streamed, after the budget is checked
+    "export_reading_sessions": 2,
+    "user_statistics": 4,
+    "book_reading_statistics": 3,
+    "books_reading_statistics": 2,
+    "top_readers": 2,
+    "most_read_books": 2,
+    "async_start_reading_session": 11,
+    "async_end_reading_session": 9,
+    "async_user_statistics": 4,
+    "async_book_reading_statistics": 3,
+}
+# Exceeding a query budget raises an error instead of logging a warning (enabled in tests)
+QUERY_BUDGETS_STRICT = os.getenv("QUERY_BUDGETS_STRICT", "False") == "True"
+# Addresses allowed to read the metrics endpoint
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -143,7 +284,7 @@ SWAGGER_SETTINGS = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'book_reading.authentication.CachingTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
@@ -156,8 +297,21 @@ CELERY_TASK_TIME_LIMIT = 3600
 CELERY_TIMEZONE = "Europe/Kiev"
 
 CELERY_BEAT_SCHEDULE = {
-    "daily-collection-of-user-statistics": {
-        "task": "book_reading.tasks.daily_collection_of_user_statistics",
-        "schedule": crontab(hour="00", minute="00"),
+    # Picks up ended sessions whose task was lost, e.g. when the broker was unavailable
+    "batch-update-of-reading-statistics": {
+        "task": "book_reading.tasks.batch_update_of_reading_statistics",
+        "schedule": crontab(minute="*"),
+    },
+    "flush-of-reading-session-heartbeats": {
+        "task": "book_reading.tasks.flush_of_reading_session_heartbeats",
+        "schedule": crontab(minute="*"),
+    },
+    "closing-of-idle-reading-sessions": {
+        "task": "book_reading.tasks.closing_of_idle_reading_sessions",
+        "schedule": crontab(minute="*/5"),
+    },
+    "reconciliation-of-reading-statistics": {
+        "task": "book_reading.tasks.reconciliation_of_reading_statistics",
+        "schedule": crontab(minute="30"),
     },
 }
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from django.views.generic import RedirectView
 
+from book_reading.metrics import metrics_view
 from .yasg import urlpatterns as doc_urls
 
 urlpatterns = [
@@ -11,6 +12,7 @@ urlpatterns = [
     path("auth/", include("djoser.urls")),
     re_path(r"^auth/", include("djoser.urls.authtoken")),
     path("api/v1/", include("book_reading.urls")),
+    path("metrics/", metrics_view, name="metrics"),
 ]
 
 urlpatterns += doc_urls